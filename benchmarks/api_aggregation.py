@@ -0,0 +1,67 @@
+"""Compares aggregating June to August of every year of a station with a
+SQL GROUP BY over WeatherDay against the vectorized aggregation of its
+columnar series. Runs against a throwaway test database and series
+directory.
+
+Usage: python -m benchmarks.api_aggregation [--years 30]
+"""
+import argparse
+import datetime
+import tempfile
+
+from django.conf import settings
+from django.core.management import call_command
+from django.db.models import Avg, Count, Max, Min, Sum
+
+from benchmarks.common import populate, throwaway_database, time_best_of
+from history.aggregation import aggregate_series
+from history.models import WeatherDay
+from history.series import SERIES_FIELDS, read_series
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--years', type=int, default=30)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    with throwaway_database(), tempfile.TemporaryDirectory() as directory:
+        settings.WEATHER_SERIES_DIR = directory
+        populate(num_stations=1, num_years=args.years)
+        call_command('build_series')
+
+        first = datetime.date(1950, 1, 1)
+        last = first + datetime.timedelta(days=args.years * 365 - 1)
+        summer = (6, 7, 8)
+
+        def group_by_sql():
+            return list(
+                WeatherDay.objects.filter(
+                    station__code='BENCH00000',
+                    date__gte=first,
+                    date__lte=last,
+                    date__month__in=summer).values('date__year').annotate(
+                        **{
+                            f'{field}_{name}': function(field)
+                            for field in SERIES_FIELDS
+                            for name, function in (('avg', Avg), (
+                                'min', Min), ('max', Max), ('sum', Sum),
+                                                   ('count', Count))
+                        }).order_by('date__year'))
+
+        def columnar_series():
+            return aggregate_series({'BENCH00000': read_series('BENCH00000')},
+                                    first.toordinal(),
+                                    last.toordinal(),
+                                    'year',
+                                    months=summer)
+
+        print(f'{args.years} years, best of {args.repeat}')
+        for name, func in (('SQL GROUP BY', group_by_sql),
+                           ('columnar series', columnar_series)):
+            seconds = time_best_of(args.repeat, func)
+            print(f'{name:<16} {seconds * 1000:>10,.2f} ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,175 @@
+"""Load test of the sync DRF views against their async counterparts under
+ASGI, at increasing numbers of concurrent clients.
+
+Requests are made to the ASGI application in process, without a server,
+so the numbers show how the views themselves share threads and the event
+loop. For each endpoint and concurrency it prints requests/s, latency
+percentiles, failed requests and the most threads alive at once. Export
+clients read each chunk of the body with a delay, like clients on a slow
+network. Runs against a throwaway test database.
+
+Django 4.1's ASGIHandler gives every request in flight its own thread for
+sync code, so the thread count follows the number of clients for either
+kind of view. The async views only use theirs for each query, while a
+sync view holds it for the whole view. The sync export fails under ASGI,
+since Django 4.1 iterates its body, and so runs its query, on the event
+loop.
+
+Usage: python -m benchmarks.api_concurrency [--clients 1 10 50 100]
+"""
+import argparse
+import asyncio
+import statistics
+import threading
+import time
+
+from django.core import signals
+from django.db import close_old_connections
+
+from benchmarks.common import populate, throwaway_database
+from history.asgi import StreamingASGIHandler
+from history.models import WeatherDay
+from history.statistics import refresh_statistics
+
+ENDPOINTS = (
+    ('days', '/api/weather/', '/api/weather/async',
+     'station__code=BENCH00000&limit=100'),
+    ('stats', '/api/weather/stats', '/api/weather/async/stats',
+     'limit=100'),
+    ('export', '/api/weather/export', '/api/weather/async/export',
+     'station__code=BENCH00000&date__lte=1955-12-31'),
+)
+
+
+async def request(application, path, query_string, read_delay):
+    """make a GET request, waiting read_delay seconds after each chunk of
+    the body. Returns the seconds taken and whether it succeeded."""
+    status = None
+
+    async def receive():
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def send(message):
+        nonlocal status
+        if message['type'] == 'http.response.start':
+            status = message['status']
+        elif read_delay:
+            await asyncio.sleep(read_delay)
+
+    scope = {
+        'type': 'http',
+        'asgi': {
+            'version': '3.0'
+        },
+        'http_version': '1.1',
+        'method': 'GET',
+        'scheme': 'http',
+        'path': path,
+        'raw_path': path.encode(),
+        'query_string': query_string.encode(),
+        'headers': [(b'host', b'localhost')],
+        'server': ('localhost', 80),
+        'client': ('127.0.0.1', 50000),
+    }
+    start = time.perf_counter()
+    try:
+        await application(scope, receive, send)
+    except Exception:
+        status = None
+    return time.perf_counter() - start, status == 200
+
+
+async def load(application, path, query_string, clients, requests_per_client,
+               read_delay):
+    """requests/s, latencies, failures and peak thread count of clients
+    making requests_per_client requests each, one after another"""
+    peak_threads = threading.active_count()
+    done = asyncio.Event()
+
+    async def count_threads():
+        nonlocal peak_threads
+        while not done.is_set():
+            peak_threads = max(peak_threads, threading.active_count())
+            await asyncio.sleep(0.005)
+
+    async def client():
+        return [
+            await request(application, path, query_string, read_delay)
+            for _ in range(requests_per_client)
+        ]
+
+    counter = asyncio.create_task(count_threads())
+    start = time.perf_counter()
+    results = await asyncio.gather(*(client() for _ in range(clients)))
+    seconds = time.perf_counter() - start
+    done.set()
+    await counter
+
+    results = [
+        result for client_results in results for result in client_results
+    ]
+    latencies = sorted(latency for latency, ok in results if ok)
+    return {
+        'requests_per_second': len(results) / seconds,
+        'p50': statistics.median(latencies) if latencies else None,
+        'p95': (latencies[int(len(latencies) * 0.95) - 1]
+                if latencies else None),
+        'failed': sum(not ok for _, ok in results),
+        'peak_threads': peak_threads,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--clients',
+                        type=int,
+                        nargs='+',
+                        default=[1, 10, 50, 100])
+    parser.add_argument('--requests', type=int, default=5,
+                        help='requests made by each client')
+    parser.add_argument('--stations', type=int, default=5)
+    parser.add_argument('--years', type=int, default=10)
+    parser.add_argument('--read-delay',
+                        type=float,
+                        default=0.01,
+                        help='seconds an export client takes per chunk')
+    args = parser.parse_args()
+
+    # as under a server with CONN_MAX_AGE=0, except that the throwaway
+    #  in-memory SQLite database must outlive each request's connection
+    signals.request_finished.disconnect(close_old_connections)
+    application = StreamingASGIHandler()
+
+    with throwaway_database():
+        populate(num_stations=args.stations, num_years=args.years)
+        refresh_statistics(
+            WeatherDay.objects.values_list('station_id',
+                                           'date__year').distinct())
+
+        print(f'{args.requests} requests per client')
+        print(f'{"endpoint":<7} {"view":<5} {"clients":>7} {"req/s":>8} '
+              f'{"p50 ms":>8} {"p95 ms":>8} {"failed":>6} {"threads":>7}')
+        for name, sync_path, async_path, query_string in ENDPOINTS:
+            read_delay = args.read_delay if name == 'export' else 0
+            for path in (sync_path, async_path):
+                # warm up, so the first run does not pay for imports
+                asyncio.run(request(application, path, query_string, 0))
+            for clients in args.clients:
+                for view, path in (('sync', sync_path), ('async', async_path)):
+                    result = asyncio.run(
+                        load(application, path, query_string, clients,
+                             args.requests, read_delay))
+                    print(f'{name:<7} {view:<5} {clients:>7} '
+                          f'{result["requests_per_second"]:>8,.1f} '
+                          f'{format_ms(result["p50"]):>8} '
+                          f'{format_ms(result["p95"]):>8} '
+                          f'{result["failed"]:>6} '
+                          f'{result["peak_threads"]:>7}')
+
+
+def format_ms(seconds):
+    return '-' if seconds is None else f'{seconds * 1000:,.1f}'
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,47 @@
+"""Compares per-page latency of offset and cursor pagination on
+/api/weather at increasing depths. Runs against a throwaway test database.
+
+Usage: python -m benchmarks.api_pagination [--stations 20] [--years 30]
+"""
+import argparse
+
+from django.test import Client
+from django.test.utils import setup_test_environment
+
+from benchmarks.common import populate, throwaway_database, time_best_of
+from history.models import WeatherDay
+from history.pagination import encode_cursor
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--stations', type=int, default=20)
+    parser.add_argument('--years', type=int, default=30)
+    parser.add_argument('--limit', type=int, default=100)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    setup_test_environment()
+    client = Client()
+    with throwaway_database():
+        num_rows = populate(args.stations, args.years)
+        print(f'{num_rows} rows, limit={args.limit}, best of {args.repeat}')
+
+        depth = 0
+        while depth < num_rows:
+            row = WeatherDay.objects.all()[depth]
+            cursor = encode_cursor([row.station_id, row.date.isoformat()],
+                                   False)
+            offset_seconds = time_best_of(
+                args.repeat, lambda: client.get(
+                    f'/api/weather/?limit={args.limit}&offset={depth}'))
+            cursor_seconds = time_best_of(
+                args.repeat, lambda: client.get(
+                    f'/api/weather/?limit={args.limit}&cursor={cursor}'))
+            print(f'depth {depth:>10,}: offset {offset_seconds * 1000:8.1f} '
+                  f'ms, cursor {cursor_seconds * 1000:8.1f} ms')
+            depth = depth * 10 or 1000
+
+
+if __name__ == '__main__':
+    main()
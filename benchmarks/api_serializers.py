@@ -0,0 +1,59 @@
+"""Compares serializing a page of weather days with the ModelSerializer,
+with and without select_related, against the .values() fast path. Runs
+against a throwaway test database.
+
+Usage: python -m benchmarks.api_serializers [--limit 1000]
+"""
+import argparse
+
+from django.db import connection, reset_queries
+from django.test import Client
+from django.test.utils import setup_test_environment
+
+from benchmarks.common import populate, throwaway_database, time_best_of
+from history.models import WeatherDay
+from history.serializers import (WeatherDaySerializer,
+                                 WeatherDayValuesSerializer)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--limit', type=int, default=1000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    setup_test_environment()
+    client = Client()
+    with throwaway_database():
+        populate(num_stations=5, num_years=2)
+        limit = args.limit
+
+        cases = {
+            'ModelSerializer, no select_related':
+            lambda: WeatherDaySerializer(WeatherDay.objects.all()[:limit],
+                                         many=True).data,
+            'ModelSerializer, select_related':
+            lambda: WeatherDaySerializer(
+                WeatherDay.objects.select_related('station')[:limit],
+                many=True).data,
+            'ValuesSerializer':
+            lambda: WeatherDayValuesSerializer(WeatherDay.objects.values(
+                *WeatherDayValuesSerializer.values_fields)[:limit]).data,
+            'GET /api/weather':
+            lambda: client.get(f'/api/weather/?limit={limit}'),
+        }
+
+        print(f'limit={limit}, best of {args.repeat}')
+        for name, func in cases.items():
+            reset_queries()
+            connection.force_debug_cursor = True
+            func()
+            num_queries = len(connection.queries)
+            connection.force_debug_cursor = False
+            seconds = time_best_of(args.repeat, func)
+            print(f'{name:<36} {limit / seconds:>10,.0f} rows/s '
+                  f'{num_queries:>6} queries')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,53 @@
+"""Helpers shared by the benchmark scripts.
+
+Importing this module sets up Django with the logging-free settings.
+"""
+import datetime
+import os
+import time
+from contextlib import contextmanager
+
+import django
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'weather.settings_base')
+django.setup()
+
+from django.db import connection  # noqa: E402
+
+from history.models import WeatherDay, WeatherStation  # noqa: E402
+
+
+def time_best_of(repeat, func):
+    """the fastest of repeat calls to func, in seconds"""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def populate(num_stations, num_years):
+    """bulk insert num_years of days for each of num_stations stations"""
+    num_days = num_years * 365
+    start = datetime.date(1950, 1, 1)
+    for i in range(num_stations):
+        station = WeatherStation.objects.create(code=f'BENCH{i:05d}')
+        WeatherDay.objects.bulk_create(
+            (WeatherDay(station=station,
+                        date=start + datetime.timedelta(days=day),
+                        temperature_max=day % 400,
+                        temperature_min=-(day % 300),
+                        precipitation=day % 50) for day in range(num_days)),
+            batch_size=5000)
+    return num_stations * num_days
+
+
+@contextmanager
+def throwaway_database():
+    """run the block against a freshly migrated test database"""
+    old_name = connection.creation.create_test_db(verbosity=0)
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
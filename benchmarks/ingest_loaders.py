@@ -0,0 +1,54 @@
+"""Compares rows/s of the WeatherDay loaders available on the configured
+database. Runs against a throwaway test database.
+
+Usage: python -m benchmarks.ingest_loaders [--years 100] [--stations 5]
+"""
+import argparse
+import logging
+import tempfile
+import time
+from pathlib import Path
+
+from django.db import connection
+
+from benchmarks.common import throwaway_database
+from benchmarks.synthetic import write_synthetic_station
+from history.management.commands.ingest_history import Command
+from history.models import WeatherStation
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--years', type=int, default=100)
+    parser.add_argument('--stations', type=int, default=5)
+    args = parser.parse_args()
+
+    logging.disable(logging.WARNING)
+    loaders = ['orm']
+    if connection.vendor == 'postgresql':
+        loaders.append('copy')
+
+    with throwaway_database():
+        with tempfile.TemporaryDirectory() as tmp:
+            paths = [
+                Path(tmp, f'BENCH{i}.txt') for i in range(args.stations)
+            ]
+            num_rows = sum(
+                write_synthetic_station(path, args.years, seed=i)['rows']
+                for i, path in enumerate(paths))
+
+            print(f'{connection.vendor}: {num_rows} rows in '
+                  f'{args.stations} files')
+            for loader in loaders:
+                WeatherStation.objects.all().delete()
+                for phase in ('insert', 'upsert'):
+                    start = time.perf_counter()
+                    for path in paths:
+                        Command().ingest_file(path, loader=loader)
+                    seconds = time.perf_counter() - start
+                    print(f'{loader:<5} {phase:<7} '
+                          f'{num_rows / seconds:>12,.0f} rows/s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+"""Compares rows/s of the row-by-row and columnar station file parsers.
+
+Usage: python -m benchmarks.ingest_parser [--years 100] [--repeat 3]
+"""
+import argparse
+import logging
+import os
+import tempfile
+
+from benchmarks.common import time_best_of
+from benchmarks.synthetic import write_synthetic_station
+from history.loaders import OrmLoader
+from history.management.commands.ingest_history import Command
+from history.models import WeatherStation
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--years', type=int, default=100)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    logging.disable(logging.WARNING)
+    command = Command()
+    loader = OrmLoader()
+    station = WeatherStation(code='BENCH')
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'BENCH.txt')
+        num_rows = write_synthetic_station(path, args.years)['rows']
+
+        cases = {
+            'rows: parse only':
+            lambda: sum(1 for _ in command.iter_rows_to_process(path)),
+            'rows: parse + WeatherDay instances':
+            lambda: command.convert_file_rows_to_database_rows(station, path),
+            'columnar: parse only':
+            lambda: sum(
+                len(batch)
+                for batch in command.iter_batches_to_process(path)),
+            'columnar: parse + WeatherDay instances':
+            lambda: [
+                loader.convert_batch_to_database_rows(station, batch)
+                for batch in command.iter_batches_to_process(path)
+            ],
+        }
+
+        print(f'{num_rows} rows, best of {args.repeat}')
+        for name, func in cases.items():
+            seconds = time_best_of(args.repeat, func)
+            print(f'{name:<40} {num_rows / seconds:>12,.0f} rows/s')
+
+
+if __name__ == '__main__':
+    main()
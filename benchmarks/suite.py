@@ -0,0 +1,318 @@
+"""Runs ingestion and API benchmarks on synthetic station files and writes
+the results as JSON, so runs on different commits can be compared.
+
+Measures ingestion rows/s and peak RSS, the time to refresh the yearly
+and monthly statistics of every station and year, and the p50 and p99
+latency of each API endpoint, at increasing offset and cursor depths for
+the days list. Responses are never served from the response cache. Runs
+against a throwaway test database and series directory.
+
+Usage: python -m benchmarks.suite [--stations 10] [--years 30]
+                                  [--output benchmark-results.json]
+       python -m benchmarks.suite --compare OLD.json NEW.json
+"""
+import argparse
+import datetime
+import json
+import logging
+import math
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import django
+from django.conf import settings
+from django.core.cache import caches
+from django.core.management import call_command
+from django.db import connection
+from django.test import Client
+from django.test.utils import setup_test_environment
+
+from benchmarks.common import throwaway_database
+from benchmarks.synthetic import write_synthetic_stations
+from history.cache import API_CACHE_ALIAS
+from history.models import WeatherDay, WeatherStation
+from history.pagination import encode_cursor
+from history.statistics import refresh_monthly_statistics, refresh_statistics
+
+FORMAT_VERSION = 1
+PERCENTILES = (50, 99)
+# results keys compared between runs. Throughputs should go up, the rest
+#  down
+MEASUREMENT_SUFFIXES = ('_ms', 'seconds', 'per_second', '_bytes')
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'],
+                              capture_output=True,
+                              check=True,
+                              text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def peak_rss_bytes() -> int:
+    """the largest resident set size of this process or any of its
+    finished child processes so far"""
+    return 1024 * max(
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+
+
+def percentile(sorted_values: list, percent: float):
+    """nearest-rank percentile of a sorted list"""
+    return sorted_values[max(
+        math.ceil(percent / 100 * len(sorted_values)) - 1, 0)]
+
+
+def measure_ingestion(directory, num_rows: int, workers: int) -> dict:
+    """ingest the directory three times: inserting every row, upserting
+    every row again, then skipping the unchanged files"""
+    results = {}
+    for phase, force in (('insert', False), ('upsert', True),
+                         ('unchanged', False)):
+        start = time.perf_counter()
+        call_command('ingest_history', str(directory), workers=workers,
+                     force=force)
+        seconds = time.perf_counter() - start
+        results[phase] = {
+            'seconds': seconds,
+            'rows_per_second': num_rows / seconds,
+            'peak_rss_bytes': peak_rss_bytes(),
+        }
+    return results
+
+
+def measure_statistics() -> dict:
+    """recompute the yearly and monthly statistics of every stored station,
+    year and month from its days"""
+    days = WeatherDay.objects.order_by()
+    station_years = list(
+        days.values_list('station_id', 'date__year').distinct())
+    station_months = list(
+        days.values_list('station_id', 'date__year',
+                         'date__month').distinct())
+
+    results = {}
+    for name, refresh, keys in (('yearly', refresh_statistics,
+                                 station_years),
+                                ('monthly', refresh_monthly_statistics,
+                                 station_months)):
+        start = time.perf_counter()
+        num_rows = refresh(keys)
+        results[name] = {
+            'seconds': time.perf_counter() - start,
+            'rows': num_rows,
+        }
+    return results
+
+
+def api_cases() -> dict:
+    """the URL of each measured request, by name"""
+    station_codes = list(
+        WeatherStation.objects.order_by('code').values_list('code',
+                                                            flat=True))
+    first_year = WeatherDay.objects.order_by('date').first().date.year
+    num_days = WeatherDay.objects.count()
+
+    cases = {}
+    depth = 0
+    while depth < num_days:
+        day = WeatherDay.objects.order_by('station_id', 'date')[depth]
+        cursor = encode_cursor([day.station_id, day.date.isoformat()],
+                               False)
+        cases[f'days/offset/{depth}'] = (
+            f'/api/weather/?limit=100&offset={depth}')
+        cases[f'days/cursor/{depth}'] = (
+            f'/api/weather/?limit=100&cursor={cursor}')
+        depth = depth * 10 or 1000
+
+    station = station_codes[0]
+    cases.update({
+        'days/station_year': (f'/api/weather/?station__code={station}'
+                              f'&date__gte={first_year}-01-01'
+                              f'&date__lte={first_year}-12-31&limit=366'),
+        'days/station_year_filter': (f'/api/weather/?station__code={station}'
+                                     f'&year={first_year}&limit=366'),
+        'days/stations_years': ('/api/weather/?station__code__in=' +
+                                ','.join(station_codes[:10]) +
+                                f'&year__gte={first_year + 1}'
+                                f'&year__lte={first_year + 2}&cursor='
+                                '&limit=1000'),
+        'stats/offset/0': '/api/weather/stats?limit=100',
+        'stats/monthly/offset/0': '/api/weather/stats?limit=100'
+        '&source=monthly',
+        'export/station': f'/api/weather/export?station__code={station}',
+        'aggregate/station_years': (
+            f'/api/weather/aggregate?station__code={station}'
+            '&group_by=year'),
+        'batch/stations_year': (
+            '/api/weather/batch?station__code__in=' +
+            ','.join(station_codes[:10]) + f'&year__gte={first_year}'
+            f'&year__lte={first_year}'),
+    })
+    return cases
+
+
+def measure_api(cases: dict, samples: int) -> dict:
+    """latency percentiles of each request, in milliseconds, after an
+    untimed first request"""
+    client = Client()
+    cache = caches[API_CACHE_ALIAS]
+
+    def get(url) -> float:
+        cache.clear()
+        start = time.perf_counter()
+        response = client.get(url)
+        if response.streaming:
+            for _ in response.streaming_content:
+                pass
+        if response.status_code != 200:
+            raise RuntimeError(f'{url} returned {response.status_code}')
+        return (time.perf_counter() - start) * 1000
+
+    results = {}
+    for name, url in cases.items():
+        get(url)
+        latencies = sorted(get(url) for _ in range(samples))
+        results[name] = {
+            'url': url,
+            'samples': samples,
+            **{
+                f'p{percent}_ms': percentile(latencies, percent)
+                for percent in PERCENTILES
+            },
+        }
+    return results
+
+
+def run(args) -> dict:
+    logging.disable(logging.WARNING)
+    setup_test_environment()
+    results = {
+        'format_version': FORMAT_VERSION,
+        'commit': git_commit(),
+        'started': datetime.datetime.now(
+            datetime.timezone.utc).isoformat(timespec='seconds'),
+        'environment': {
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'database': connection.vendor,
+            'platform': platform.platform(),
+        },
+        'parameters': {
+            'stations': args.stations,
+            'years': args.years,
+            'missing': args.missing,
+            'duplicates': args.duplicates,
+            'seed': args.seed,
+            'workers': args.workers,
+            'samples': args.samples,
+        },
+    }
+
+    with tempfile.TemporaryDirectory() as tmp, throwaway_database():
+        settings.WEATHER_SERIES_DIR = Path(tmp, 'series')
+        files = write_synthetic_stations(Path(tmp, 'files'), args.stations,
+                                         args.years, args.missing,
+                                         args.duplicates, args.seed)
+        results['data'] = files
+        results['ingestion'] = measure_ingestion(Path(tmp, 'files'),
+                                                 files['rows'], args.workers)
+        results['statistics'] = measure_statistics()
+        results['api'] = measure_api(api_cases(), args.samples)
+    return results
+
+
+def measurements(results: dict, prefix: str = '') -> dict:
+    """the measured values of a results dict, by dotted path"""
+    leaves = {}
+    for key, value in results.items():
+        path = f'{prefix}{key}'
+        if isinstance(value, dict):
+            leaves.update(measurements(value, f'{path}.'))
+        elif path.endswith(MEASUREMENT_SUFFIXES):
+            leaves[path] = value
+    return leaves
+
+
+def compare(old_path, new_path, threshold: float) -> int:
+    """print the change of every measurement between two results files.
+    Returns how many got worse by more than threshold."""
+    old = json.loads(Path(old_path).read_text())
+    new = json.loads(Path(new_path).read_text())
+    if old.get('parameters') != new.get('parameters'):
+        print('warning: the runs used different parameters')
+
+    old_values, new_values = measurements(old), measurements(new)
+    num_regressions = 0
+    for path in sorted(old_values.keys() & new_values.keys()):
+        old_value, new_value = old_values[path], new_values[path]
+        change = (new_value - old_value) / old_value if old_value else 0
+        worse = -change if path.endswith('per_second') else change
+        flag = ''
+        if worse > threshold:
+            flag = '  REGRESSION'
+            num_regressions += 1
+        print(f'{path:<50} {old_value:>14,.2f} {new_value:>14,.2f} '
+              f'{change:>+8.1%}{flag}')
+    return num_regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('--stations', type=int, default=10)
+    parser.add_argument('--years', type=int, default=30)
+    parser.add_argument('--missing',
+                        type=float,
+                        default=0.02,
+                        help='share of values written as -9999')
+    parser.add_argument('--duplicates',
+                        type=float,
+                        default=0.001,
+                        help='share of days written twice')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workers',
+                        type=int,
+                        default=1,
+                        help='ingestion processes, each with its own '
+                        'database connection. The SQLite test database is a '
+                        'file, so they work on either backend.')
+    parser.add_argument('--samples',
+                        type=int,
+                        default=20,
+                        help='requests timed per API case')
+    parser.add_argument('--output', default='benchmark-results.json')
+    parser.add_argument('--compare',
+                        nargs=2,
+                        metavar=('OLD', 'NEW'),
+                        help='compare two results files instead of '
+                        'running the benchmarks')
+    parser.add_argument('--threshold',
+                        type=float,
+                        default=0.1,
+                        help='relative change counted as a regression by '
+                        '--compare, which exits with status 1 if any')
+    args = parser.parse_args()
+
+    if args.compare:
+        sys.exit(1 if compare(*args.compare, args.threshold) else 0)
+    if args.workers < 1:
+        parser.error('--workers must be at least 1')
+
+    results = run(args)
+    Path(args.output).write_text(
+        json.dumps(results, indent=2, sort_keys=True) + '\n')
+    print(f'results written to {args.output}')
+    for path, value in measurements(results).items():
+        print(f'{path:<50} {value:>14,.2f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+"""Writes synthetic station files in the tab separated format ingested by
+ingest_history, with seasonal values, a chosen share of missing (-9999)
+values and of duplicated dates. The same arguments always give the same
+files.
+
+Usage: python -m benchmarks.synthetic DIRECTORY [--stations 10]
+       [--years 30] [--missing 0.02] [--duplicates 0.001]
+"""
+import argparse
+import datetime
+import math
+import random
+from pathlib import Path
+
+MISSING_VALUE = -9999
+
+
+def format_value(value):
+    return f'{MISSING_VALUE if value is None else value:5d}'
+
+
+def write_synthetic_station(path, num_years: int, first_year: int = 1950,
+                            missing: float = 0.0, duplicates: float = 0.0,
+                            seed: int = 0) -> dict:
+    """write num_years of daily rows from January 1st of first_year.
+
+    Each value is missing with probability missing, and each day is
+    followed by a second row with the same date and other values with
+    probability duplicates. Returns the number of rows and distinct days
+    written.
+    """
+    rng = random.Random(seed)
+    # each station has its own climate
+    mean_max = rng.randint(50, 250)
+    amplitude = rng.randint(50, 150)
+    wet_days = rng.uniform(0.1, 0.5)
+
+    def random_values(day):
+        season = math.sin(2 * math.pi * (day.timetuple().tm_yday - 105) /
+                          365.25)
+        temperature_max = round(mean_max + amplitude * season +
+                                rng.gauss(0, 30))
+        temperature_min = temperature_max - rng.randint(30, 150)
+        precipitation = (round(rng.expovariate(1 / 80))
+                         if rng.random() < wet_days else 0)
+        return [
+            None if rng.random() < missing else value
+            for value in (temperature_max, temperature_min, precipitation)
+        ]
+
+    day = datetime.date(first_year, 1, 1)
+    last_day = datetime.date(first_year + num_years, 1, 1)
+    num_rows = num_days = 0
+    with open(path, 'w') as f:
+        while day < last_day:
+            num_days += 1
+            for _ in range(2 if rng.random() < duplicates else 1):
+                f.write(f'{day:%Y%m%d}\t' +
+                        '\t'.join(map(format_value, random_values(day))) +
+                        '\n')
+                num_rows += 1
+            day += datetime.timedelta(days=1)
+    return {'rows': num_rows, 'days': num_days}
+
+
+def write_synthetic_stations(directory, num_stations: int, num_years: int,
+                             missing: float = 0.0, duplicates: float = 0.0,
+                             seed: int = 0) -> dict:
+    """write a file per station, named like the station codes of GHCN-D
+    files, into directory. Returns the total rows and distinct days."""
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    totals = {'rows': 0, 'days': 0}
+    for i in range(num_stations):
+        written = write_synthetic_station(directory / f'SYN{i:08d}.txt',
+                                          num_years,
+                                          missing=missing,
+                                          duplicates=duplicates,
+                                          seed=seed * 1_000_003 + i)
+        for key, count in written.items():
+            totals[key] += count
+    return totals
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('directory')
+    parser.add_argument('--stations', type=int, default=10)
+    parser.add_argument('--years', type=int, default=30)
+    parser.add_argument('--missing',
+                        type=float,
+                        default=0.02,
+                        help='share of values written as -9999')
+    parser.add_argument('--duplicates',
+                        type=float,
+                        default=0.001,
+                        help='share of days written twice')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    totals = write_synthetic_stations(args.directory, args.stations,
+                                      args.years, args.missing,
+                                      args.duplicates, args.seed)
+    print(f'{totals["rows"]:,} rows, {totals["days"]:,} distinct days in '
+          f'{args.stations} files')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,9 @@
 from django.contrib import admin
 
-from history.models import WeatherDay, WeatherStation, WeatherStats
+from history.models import (IngestionJob, WeatherDay, WeatherStation,
+                            WeatherStats)
 
 admin.site.register(WeatherDay)
 admin.site.register(WeatherStation)
 admin.site.register(WeatherStats)
+admin.site.register(IngestionJob)
@@ -0,0 +1,179 @@
+import datetime
+
+import numpy as np
+
+from history.models import to_hundredths
+from history.parsing import MISSING_VALUE
+from history.series import (SERIES_FIELDS, StationSeries,
+                            ordinal_to_datetime64)
+
+GROUPINGS = ('total', 'year', 'season', 'month', 'window')
+SEASONS = ('DJF', 'MAM', 'JJA', 'SON')
+MEASURES = ('avg', 'min', 'max', 'sum', 'count')
+# stored units per unit returned, matching WeatherStats: tenths of a
+#  degree to degrees Celsius, tenths of a millimeter to centimeters
+UNIT_DIVISORS = {
+    'temperature_max': 10,
+    'temperature_min': 10,
+    'precipitation': 100,
+}
+
+
+def count_groups(first_ordinal: int, last_ordinal: int, group_by: str,
+                 window_days: int = None) -> int:
+    """how many groups group_days splits the days from first_ordinal to
+    last_ordinal into, at most, without building them"""
+    first = datetime.date.fromordinal(first_ordinal)
+    last = datetime.date.fromordinal(last_ordinal)
+    first_month = first.year * 12 + first.month - 1
+    last_month = last.year * 12 + last.month - 1
+    if group_by == 'year':
+        return last.year - first.year + 1
+    if group_by == 'month':
+        return last_month - first_month + 1
+    if group_by == 'season':
+        return (last_month + 1) // 3 - (first_month + 1) // 3 + 1
+    if group_by == 'window':
+        return -(-(last_ordinal - first_ordinal + 1) // window_days)
+    if group_by == 'total':
+        return 1
+    raise ValueError(f'unknown grouping: {group_by}')
+
+
+def group_days(first_ordinal: int, last_ordinal: int, group_by: str,
+               window_days: int = None, months=None):
+    """split the days from first_ordinal to last_ordinal into groups.
+
+    Returns the indexes of the days kept by the months filter, the offset
+    into those of the first day of each group, and each group's label.
+    Groups are runs of consecutive kept days, so they can be reduced with
+    ufunc.reduceat.
+    """
+    dates = ordinal_to_datetime64(np.arange(first_ordinal, last_ordinal + 1))
+    # months since January 1970
+    month_numbers = dates.astype('datetime64[M]').astype(np.int64)
+
+    if group_by == 'year':
+        keys = month_numbers // 12
+    elif group_by == 'month':
+        keys = month_numbers
+    elif group_by == 'season':
+        # meteorological seasons, with December counted in the winter of
+        #  the following year
+        keys = (month_numbers + 1) // 3
+    elif group_by == 'window':
+        keys = np.arange(len(dates)) // window_days
+    elif group_by == 'total':
+        keys = np.zeros(len(dates), dtype=np.int64)
+    else:
+        raise ValueError(f'unknown grouping: {group_by}')
+
+    kept = np.arange(len(dates))
+    if months:
+        kept = kept[np.isin(month_numbers % 12 + 1, list(months))]
+    keys = keys[kept]
+    if not len(kept):
+        return kept, kept, []
+
+    starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+    labels = []
+    for key, day in zip(keys[starts].tolist(), kept[starts].tolist()):
+        if group_by == 'year':
+            labels.append(f'{key + 1970}')
+        elif group_by == 'month':
+            labels.append(f'{key // 12 + 1970}-{key % 12 + 1:02}')
+        elif group_by == 'season':
+            labels.append(f'{(key * 3) // 12 + 1970}-'
+                          f'{SEASONS[(key * 3) % 12 // 3]}')
+        elif group_by == 'window':
+            labels.append(
+                datetime.date.fromordinal(first_ordinal + day).isoformat())
+        else:
+            labels.append('total')
+    return kept, starts, labels
+
+
+def aggregate_column(values: np.ndarray, starts: np.ndarray) -> dict:
+    """avg/min/max/sum/count arrays of the non-missing values of a column
+    per group, with groups starting at the given offsets"""
+    values = values.astype(np.int64)
+    present = values != MISSING_VALUE
+    info = np.iinfo(np.int64)
+    return {
+        'count': np.add.reduceat(present, starts),
+        'sum': np.add.reduceat(np.where(present, values, 0), starts),
+        'min': np.minimum.reduceat(np.where(present, values, info.max),
+                                   starts),
+        'max': np.maximum.reduceat(np.where(present, values, info.min),
+                                   starts),
+    }
+
+
+def aggregate_series(series_by_station: dict, first_ordinal: int,
+                     last_ordinal: int, group_by: str,
+                     window_days: int = None, months=None) -> list[dict]:
+    """aggregate each station's stored days from first_ordinal to
+    last_ordinal inclusive into groups of days.
+
+    Returns a dict per station and group with the avg, min, max, sum and
+    count of each field's non-missing values, in the units WeatherStats
+    uses. Stations without a stored series have every count at 0.
+    """
+    kept, starts, labels = group_days(first_ordinal, last_ordinal, group_by,
+                                      window_days, months)
+    if not labels:
+        return []
+    ends = np.r_[starts[1:], len(kept)] - 1
+    first_dates = [
+        datetime.date.fromordinal(first_ordinal + day)
+        for day in kept[starts].tolist()
+    ]
+    last_dates = [
+        datetime.date.fromordinal(first_ordinal + day)
+        for day in kept[ends].tolist()
+    ]
+
+    results = []
+    for station_code, series in series_by_station.items():
+        if series is None:
+            series = StationSeries(first_ordinal,
+                                   np.empty((len(SERIES_FIELDS), 0),
+                                            dtype=np.int16))
+        columns = series.window(first_ordinal, last_ordinal)[:, kept]
+        aggregates = {
+            field: aggregate_column(columns[row], starts)
+            for row, field in enumerate(SERIES_FIELDS)
+        }
+        for group, label in enumerate(labels):
+            result = {
+                'station': {
+                    'code': station_code
+                },
+                'group': label,
+                'first_date': first_dates[group],
+                'last_date': last_dates[group],
+            }
+            for field, aggregate in aggregates.items():
+                result[field] = convert_units(
+                    field, {
+                        measure: int(values[group])
+                        for measure, values in aggregate.items()
+                    })
+            results.append(result)
+    return results
+
+
+def convert_units(field: str, aggregate: dict) -> dict:
+    """the measures of a group in returned units, with None in place of
+    every measure but the count if there were no values"""
+    count = aggregate['count']
+    divisor = UNIT_DIVISORS[field]
+    if not count:
+        return {measure: None for measure in MEASURES} | {'count': 0}
+    return {
+        'avg': to_hundredths(aggregate['sum'], count * divisor),
+        'min': to_hundredths(aggregate['min'], divisor),
+        'max': to_hundredths(aggregate['max'], divisor),
+        'sum': to_hundredths(aggregate['sum'], divisor),
+        'count': count,
+    }
@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class HistoryConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'history'
+
+    def ready(self):
+        # connects the signals keeping the station code cache up to date
+        import history.stations  # noqa: F401
@@ -0,0 +1,86 @@
+import django
+from asgiref.sync import async_to_sync
+from django.core.handlers.asgi import ASGIHandler
+from django.http import StreamingHttpResponse
+
+
+class AsyncStreamingHttpResponse(StreamingHttpResponse):
+    """A StreamingHttpResponse whose content is an async iterator, so the
+    body can be produced with the async ORM.
+
+    StreamingASGIHandler sends it as the iterator produces it, without a
+    thread. Served any other way, e.g. under WSGI, the whole body is read
+    before it is sent, as Django 4.2 does for such responses.
+    """
+    is_async = True
+
+    @property
+    def streaming_content(self):
+        return self._aiter_bytes()
+
+    @streaming_content.setter
+    def streaming_content(self, value):
+        self._set_streaming_content(value)
+
+    def _set_streaming_content(self, value):
+        self._iterator = aiter(value)
+
+    async def _aiter_bytes(self):
+        async for part in self._iterator:
+            yield self.make_bytes(part)
+
+    def __aiter__(self):
+        return self.streaming_content
+
+    def __iter__(self):
+        return iter(async_to_sync(self._read)())
+
+    async def _read(self) -> list:
+        return [part async for part in self]
+
+    def getvalue(self):
+        return b''.join(self)
+
+
+class StreamingASGIHandler(ASGIHandler):
+    """ASGIHandler which also streams AsyncStreamingHttpResponses.
+
+    Django 4.1 iterates streaming responses synchronously on the event
+    loop, so their content can neither await nor use the ORM.
+    """
+
+    async def send_response(self, response, send):
+        if not getattr(response, 'is_async', False):
+            return await super().send_response(response, send)
+
+        response_headers = []
+        for header, value in response.items():
+            if isinstance(header, str):
+                header = header.encode('ascii')
+            if isinstance(value, str):
+                value = value.encode('latin1')
+            response_headers.append((bytes(header), bytes(value)))
+        for cookie in response.cookies.values():
+            response_headers.append(
+                (b'Set-Cookie',
+                 cookie.output(header='').encode('ascii').strip()))
+        await send({
+            'type': 'http.response.start',
+            'status': response.status_code,
+            'headers': response_headers,
+        })
+        async for part in response:
+            for chunk, _ in self.chunk_bytes(part):
+                await send({
+                    'type': 'http.response.body',
+                    'body': chunk,
+                    'more_body': True,
+                })
+        await send({'type': 'http.response.body'})
+
+
+def get_asgi_application():
+    """django.core.asgi.get_asgi_application, serving with
+    StreamingASGIHandler"""
+    django.setup(set_prefix=False)
+    return StreamingASGIHandler()
@@ -0,0 +1,162 @@
+"""Async versions of the days, stats and export endpoints.
+
+Under ASGI a sync view holds a thread for the whole request. These read
+rows with the async ORM instead, and the export streams its body from an
+async iterator, so a slow client holds no thread. They return the same
+JSON and CSV as the DRF views, without ETags or the response cache.
+"""
+import io
+
+from asgiref.sync import sync_to_async
+from django.http import JsonResponse
+from django.views import View
+from rest_framework.exceptions import ValidationError
+from rest_framework.request import Request
+
+from history.asgi import AsyncStreamingHttpResponse
+from history.filters import WeatherDayFilterSet, station_filterset_factory
+from history.models import WeatherDay, WeatherStats
+from history.pagination import AsyncLimitOffsetPagination
+from history.renderers import CSVRenderer, NDJSONRenderer
+from history.serializers import (WeatherDayValuesSerializer,
+                                 WeatherStatsValuesSerializer)
+from history.views import (MonthlyRollupsMixin, WeatherDayExportView,
+                           csv_row_encoder, ndjson_row_encoder)
+
+
+class AsyncValuesListView(View):
+    """An async counterpart of ValuesListAPIView, paginated by limit and
+    offset"""
+
+    queryset = None
+    values_serializer_class = None
+    filterset_class = None
+    pagination_class = AsyncLimitOffsetPagination
+
+    def get_queryset(self):
+        return self.queryset.all()
+
+    def get_values_serializer_class(self):
+        return self.values_serializer_class
+
+    def filter_queryset(self, queryset):
+        filterset = self.filterset_class(self.request.query_params,
+                                         queryset=queryset)
+        if not filterset.is_valid():
+            raise ValidationError(filterset.errors)
+        return filterset.qs
+
+    async def get(self, request, *args, **kwargs):
+        # for query_params and the paginator, which expect a DRF request
+        self.request = Request(request)
+        # the station filters and the serializers may look up station
+        #  codes, so are run in a thread
+        try:
+            values_serializer_class = self.get_values_serializer_class()
+            queryset = values_serializer_class.values(await sync_to_async(
+                self.filter_queryset)(self.get_queryset()))
+        except ValidationError as error:
+            return JsonResponse(error.detail, status=400)
+
+        paginator = self.pagination_class()
+        page = await paginator.apaginate_queryset(queryset, self.request)
+        if page is None:
+            rows = [row async for row in queryset]
+            return JsonResponse(await sync_to_async(
+                lambda: values_serializer_class(rows).data)(),
+                                safe=False)
+        data = await sync_to_async(
+            lambda: values_serializer_class(page).data)()
+        return JsonResponse(paginator.get_paginated_data(data))
+
+
+class AsyncWeatherDayListView(AsyncValuesListView):
+    """Lists information on a day of weather by station"""
+
+    queryset = WeatherDay.objects.all()
+    values_serializer_class = WeatherDayValuesSerializer
+    filterset_class = WeatherDayFilterSet
+
+
+class AsyncWeatherStatsListView(MonthlyRollupsMixin, AsyncValuesListView):
+    """Lists statistical information on a year of weather by station"""
+
+    queryset = WeatherStats.objects.all()
+    values_serializer_class = WeatherStatsValuesSerializer
+    filterset_class = station_filterset_factory(WeatherStats,
+                                        fields={
+                                            'station__code': ['exact', 'in'],
+                                            'year': ['exact', 'gte', 'lte'],
+                                        })
+
+
+class AsyncWeatherDayExportView(AsyncValuesListView):
+    """Streams every matching day of weather as CSV (the default) or
+    newline delimited JSON, like WeatherDayExportView, reading chunk_size
+    rows at a time with the async ORM"""
+
+    queryset = WeatherDay.objects.all()
+    filterset_class = WeatherDayFilterSet
+    renderer_classes = (CSVRenderer, NDJSONRenderer)
+    chunk_size = WeatherDayExportView.chunk_size
+
+    def get_renderer(self):
+        """the renderer picked by ?format, else the first one the Accept
+        header allows, or None if the format is unknown"""
+        format = self.request.query_params.get('format')
+        if format is not None:
+            return next((renderer for renderer in self.renderer_classes
+                         if renderer.format == format), None)
+        accept = self.request.META.get('HTTP_ACCEPT', '')
+        return next((renderer for renderer in self.renderer_classes
+                     if renderer.media_type in accept),
+                    self.renderer_classes[0])
+
+    async def get(self, request, *args, **kwargs):
+        self.request = Request(request)
+        renderer = self.get_renderer()
+        if renderer is None:
+            return JsonResponse({'detail': 'Not found.'}, status=404)
+        try:
+            queryset = await sync_to_async(self.filter_queryset)(
+                self.get_queryset())
+        except ValidationError as error:
+            return JsonResponse(error.detail, status=400)
+
+        # ordered by the (station, date) unique index, as in the sync view.
+        #  values() rather than values_list(), whose aiterator() runs the
+        #  query on the event loop in Django 4.1
+        rows = queryset.order_by('station_id', 'date').values(
+            *WeatherDayValuesSerializer.export_fields).aiterator(
+                chunk_size=self.chunk_size)
+
+        if renderer.format == 'ndjson':
+            content = self.aiter_chunks(rows, ndjson_row_encoder())
+        else:
+            encode_row = csv_row_encoder()
+            content = self.aiter_chunks(
+                rows,
+                encode_row,
+                header=encode_row(WeatherDayExportView.csv_header))
+
+        response = AsyncStreamingHttpResponse(
+            content,
+            content_type=f'{renderer.media_type}; charset={renderer.charset}')
+        response['Content-Disposition'] = (
+            f'attachment; filename="weather.{renderer.format}"')
+        return response
+
+    async def aiter_chunks(self, rows, encode_row, header=None):
+        """yield the encoded values() rows chunk_size at a time"""
+        buffer = io.StringIO()
+        if header is not None:
+            buffer.write(header)
+        i = 0
+        async for row in rows:
+            i += 1
+            buffer.write(encode_row(tuple(row.values())))
+            if i % self.chunk_size == 0:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+        yield buffer.getvalue()
@@ -0,0 +1,157 @@
+import hashlib
+import pickle
+from collections import Counter
+from threading import Lock
+from urllib.parse import urlencode
+
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+from django.core.cache.backends.locmem import LocMemCache
+from django.http import HttpResponse
+
+API_CACHE_ALIAS = 'weather_api'
+DEFAULT_MAX_SIZE = 64 * 1024 * 1024
+
+# per process hit and miss counts of CachedResponseMixin
+_counters = Counter()
+_counters_lock = Lock()
+# per cache name size and eviction count of LRUCache
+_sizes = {}
+
+
+class LRUCache(LocMemCache):
+    """In-process cache which evicts the least recently used entries once
+    the pickled size of all entries would exceed OPTIONS['MAX_SIZE']
+    bytes, rather than culling a fraction of them by count."""
+
+    def __init__(self, name, params):
+        super().__init__(name, params)
+        self._max_size = int(
+            params.get('OPTIONS', {}).get('MAX_SIZE', DEFAULT_MAX_SIZE))
+        self._size = _sizes.setdefault(name, Counter())
+
+    def _set(self, key, value, timeout=DEFAULT_TIMEOUT):
+        self._delete(key)
+        if len(value) > self._max_size:
+            return
+        while self._size['bytes'] + len(value) > self._max_size:
+            # the least recently used entry is last
+            evicted_key, evicted = self._cache.popitem()
+            del self._expire_info[evicted_key]
+            self._size['bytes'] -= len(evicted)
+            self._size['evictions'] += 1
+        self._cache[key] = value
+        self._cache.move_to_end(key, last=False)
+        self._expire_info[key] = self.get_backend_timeout(timeout)
+        self._size['bytes'] += len(value)
+
+    def incr(self, key, delta=1, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        with self._lock:
+            if self._has_expired(key):
+                self._delete(key)
+                raise ValueError("Key '%s' not found" % key)
+            new_value = pickle.loads(self._cache[key]) + delta
+            # through _set, keeping the expiry, so the size stays right
+            expiry = self._expire_info[key]
+            self._set(key, pickle.dumps(new_value, self.pickle_protocol))
+            self._expire_info[key] = expiry
+        return new_value
+
+    def _delete(self, key):
+        value = self._cache.pop(key, None)
+        if value is None:
+            return False
+        del self._expire_info[key]
+        self._size['bytes'] -= len(value)
+        return True
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+            self._expire_info.clear()
+            self._size['bytes'] = 0
+
+    def statistics(self) -> dict:
+        with self._lock:
+            return {
+                'entries': len(self._cache),
+                'size': self._size['bytes'],
+                'max_size': self._max_size,
+                'evictions': self._size['evictions'],
+            }
+
+
+def get_cache_statistics(alias: str = API_CACHE_ALIAS) -> dict:
+    """hit, miss and, where the backend tracks them, eviction counts of
+    the API response cache in this process"""
+    cache = caches[alias]
+    with _counters_lock:
+        statistics = {
+            'backend': f'{type(cache).__module__}.{type(cache).__name__}',
+            'hits': _counters['hits'],
+            'misses': _counters['misses'],
+            'entries': None,
+            'size': None,
+            'max_size': None,
+            'evictions': None,
+        }
+    if isinstance(cache, LRUCache):
+        statistics.update(cache.statistics())
+    return statistics
+
+
+def reset_cache_statistics():
+    with _counters_lock:
+        _counters.clear()
+
+
+def _count(counter: str):
+    with _counters_lock:
+        _counters[counter] += 1
+
+
+class CachedResponseMixin:
+    """Serves GET requests from the API response cache.
+
+    Entries are keyed on the URL, the request's query params in a
+    normalized order, the accepted format and the data version found by
+    ConditionalGetMixin, which must come before this mixin in the bases.
+    Ingesting a station's year changes the version of every request that
+    could return it, so stale entries are never served and are left to be
+    evicted, while entries for other stations and years stay valid.
+    """
+
+    cache_alias = API_CACHE_ALIAS
+
+    def get_cache_key(self, request) -> str:
+        # params are sorted by name, but repeated values keep their order
+        #  since the filters can depend on it
+        params = urlencode(sorted(request.query_params.lists()), doseq=True)
+        # the host is included since page links are absolute URLs
+        url = request.build_absolute_uri(request.path)
+        digest = hashlib.md5(
+            f'{url}?{params}|{request.accepted_renderer.format}'.encode(),
+            usedforsecurity=False).hexdigest()
+        return f'response:{self.data_version}:{digest}'
+
+    def get(self, request, *args, **kwargs):
+        cache = caches[self.cache_alias]
+        key = self.get_cache_key(request)
+
+        cached = cache.get(key)
+        if cached is not None:
+            _count('hits')
+            content, content_type = cached
+            response = HttpResponse(content, content_type=content_type)
+            response['X-Cache'] = 'HIT'
+            return response
+
+        _count('misses')
+        response = super().get(request, *args, **kwargs)
+        if response.status_code == 200:
+            # the content only exists once the response has been rendered
+            response.add_post_render_callback(lambda rendered: cache.set(
+                key, (rendered.content, rendered['Content-Type'])))
+        response['X-Cache'] = 'MISS'
+        return response
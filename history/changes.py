@@ -0,0 +1,166 @@
+import datetime
+from collections import Counter, defaultdict
+from collections.abc import Iterable, Iterator
+
+import numpy as np
+from django.utils import timezone
+
+from history.models import WeatherDataVersion, WeatherDay, WeatherStation
+from history.parsing import MISSING_VALUE, ColumnBatch
+
+VALUE_FIELDS = ('temperature_max', 'temperature_min', 'precipitation')
+ROW_HASH_MULTIPLIER = np.uint64(0x9e3779b97f4a7c15)
+
+
+def mix64(values: np.ndarray) -> np.ndarray:
+    """the splitmix64 finalizer, scrambling uint64 values"""
+    values = values ^ (values >> np.uint64(30))
+    values = values * np.uint64(0xbf58476d1ce4e5b9)
+    values = values ^ (values >> np.uint64(27))
+    values = values * np.uint64(0x94d049bb133111eb)
+    return values ^ (values >> np.uint64(31))
+
+
+def batch_years(batch: ColumnBatch) -> np.ndarray:
+    """the calendar year of each row"""
+    return batch.dates.astype('datetime64[Y]').astype(np.int64) + 1970
+
+
+def rows_checksum(batch: ColumnBatch) -> int:
+    """a checksum of a set of rows, whatever their order: the sum, wrapping
+    at 64 bits, of a hash of each row. Returned as a signed 64 bit int to
+    fit a BigIntegerField."""
+    hashes = batch.date_ordinal.astype(np.uint64)
+    for field in VALUE_FIELDS:
+        values = getattr(batch, field).filled(MISSING_VALUE).astype(
+            np.int64).astype(np.uint64)
+        hashes = mix64(hashes * ROW_HASH_MULTIPLIER + values)
+    total = mix64(hashes).sum(dtype=np.uint64)
+    return int(np.array(total, dtype=np.uint64).view(np.int64))
+
+
+def stored_rows(station: WeatherStation, first: datetime.date,
+                last: datetime.date) -> ColumnBatch:
+    """the stored days of a station from first to last inclusive, in date
+    order"""
+    return ColumnBatch.from_rows(
+        WeatherDay.objects.filter(
+            station=station, date__gte=first,
+            date__lte=last).values_list('date',
+                                        *VALUE_FIELDS).order_by('date'))
+
+
+class ChangedRows:
+    """Passes on only the rows of a station file that would change what is
+    stored, so re-delivered files do not rewrite identical days.
+
+    Rows are grouped into blocks by calendar year. A block is first
+    compared against the checksum of the stored year kept on its
+    WeatherDataVersion, and skipped whole if they match. Otherwise the
+    stored days over the block's dates are read in one query and compared
+    row by row. A year's block is complete once a later year's rows
+    arrive, so in date-ordered files at most one year is held back.
+
+    counts is incremented by rows_inserted, rows_updated and
+    rows_unchanged.
+    """
+
+    def __init__(self, station: WeatherStation, counts: Counter = None):
+        self.station = station
+        self.counts = Counter() if counts is None else counts
+        self.checksums = {}
+        self.pending = defaultdict(list)
+        self.compared_years = set()
+        self.years_changed = set()
+        self.months_changed = set()
+
+    def track(self, batches: Iterable[ColumnBatch]) -> Iterator[ColumnBatch]:
+        """pass on the new and modified rows of the batches"""
+        self.checksums = dict(
+            WeatherDataVersion.objects.filter(
+                station=self.station).values_list('year', 'days_checksum'))
+        for batch in batches:
+            if not len(batch):
+                continue
+            years = batch_years(batch)
+            for year in np.unique(years).tolist():
+                rows = batch[years == year]
+                if year in self.compared_years:
+                    # an out of order row for a year already compared
+                    yield from self.compare_rows(rows)
+                else:
+                    self.pending[year].append(rows)
+
+            first_year = int(years.min())
+            for year in sorted(self.pending):
+                if year < first_year:
+                    yield from self.compare_block(year)
+        for year in sorted(self.pending):
+            yield from self.compare_block(year)
+
+    def compare_block(self, year: int) -> Iterator[ColumnBatch]:
+        rows = ColumnBatch.concatenate(self.pending.pop(year))
+        self.compared_years.add(year)
+        checksum = self.checksums.get(year)
+        if checksum is not None and checksum == rows_checksum(rows):
+            self.counts['rows_unchanged'] += len(rows)
+            return
+        yield from self.compare_rows(rows)
+
+    def compare_rows(self, rows: ColumnBatch) -> Iterator[ColumnBatch]:
+        dates = rows.dates
+        stored = stored_rows(self.station, dates.min().item(),
+                             dates.max().item())
+
+        exists = np.zeros(len(rows), dtype=bool)
+        same = np.zeros(len(rows), dtype=bool)
+        if len(stored):
+            indexes = np.minimum(
+                np.searchsorted(stored.date_ordinal, rows.date_ordinal),
+                len(stored) - 1)
+            exists = stored.date_ordinal[indexes] == rows.date_ordinal
+            same = exists.copy()
+            for field in VALUE_FIELDS:
+                stored_values = getattr(stored, field).filled(MISSING_VALUE)
+                same &= (getattr(rows, field).filled(MISSING_VALUE) ==
+                         stored_values[indexes])
+
+        self.counts['rows_inserted'] += int((~exists).sum())
+        self.counts['rows_updated'] += int((exists & ~same).sum())
+        self.counts['rows_unchanged'] += int(same.sum())
+        changed = rows[~same]
+        if len(changed):
+            self.years_changed |= changed.years()
+            self.months_changed |= changed.months()
+            yield changed
+
+    def years_to_checksum(self) -> set[int]:
+        """the compared years whose stored checksum is missing or out of
+        date once the changed rows are written"""
+        return self.years_changed | {
+            year for year in self.compared_years
+            if self.checksums.get(year) is None
+        }
+
+
+def refresh_year_checksums(station: WeatherStation, years: Iterable[int]):
+    """recompute the checksums of a station's stored days in each year"""
+    years = sorted(set(years))
+    if not years:
+        return
+    rows = stored_rows(station, datetime.date(years[0], 1, 1),
+                       datetime.date(years[-1], 12, 31))
+    row_years = batch_years(rows)
+    now = timezone.now()
+    WeatherDataVersion.objects.bulk_create(
+        [
+            WeatherDataVersion(station=station,
+                               year=year,
+                               days_checksum=rows_checksum(
+                                   rows[row_years == year]),
+                               last_ingested=now) for year in years
+        ],
+        update_conflicts=True,
+        update_fields=('days_checksum', ),
+        unique_fields=('station', 'year'),
+    )
@@ -0,0 +1,131 @@
+import datetime
+import hashlib
+from collections.abc import Iterable
+from functools import reduce
+from operator import or_
+
+from django.db.models import Count, F, Max, Q, Sum
+from django.utils import timezone
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+
+from history.models import WeatherDataVersion
+from history.stations import station_cache
+
+PAIRS_PER_QUERY = 500
+
+
+def mark_data_ingested(station_years: Iterable[tuple[int, int]]):
+    """bump the data version of the (station id, year) pairs whose days
+    ingestion wrote"""
+    station_years = sorted(set(station_years))
+    now = timezone.now()
+    for start in range(0, len(station_years), PAIRS_PER_QUERY):
+        chunk = station_years[start:start + PAIRS_PER_QUERY]
+        versions = WeatherDataVersion.objects.filter(
+            reduce(or_, (Q(station_id=station_id, year=year)
+                         for station_id, year in chunk)))
+
+        existing = set(versions.values_list('station_id', 'year'))
+        versions.update(version=F('version') + 1, last_ingested=now)
+        WeatherDataVersion.objects.bulk_create(
+            [
+                WeatherDataVersion(station_id=station_id,
+                                   year=year,
+                                   last_ingested=now)
+                for station_id, year in chunk
+                if (station_id, year) not in existing
+            ],
+            ignore_conflicts=True,
+        )
+
+
+def get_data_version(station_codes=None, first_year=None, last_year=None):
+    """a (version, last modified) pair for the given stations and years,
+    or for all of them, which changes whenever ingestion writes any of
+    their days"""
+    versions = WeatherDataVersion.objects.all()
+    if station_codes is not None:
+        versions = versions.filter(
+            station_id__in=station_cache.ids(station_codes).values())
+    if first_year is not None:
+        versions = versions.filter(year__gte=first_year)
+    if last_year is not None:
+        versions = versions.filter(year__lte=last_year)
+    version = versions.aggregate(years=Count('pk'),
+                                 total=Sum('version'),
+                                 last_ingested=Max('last_ingested'))
+    return (f'{version["years"]}-{version["total"] or 0}',
+            version['last_ingested'])
+
+
+class ConditionalGetMixin:
+    """Answers GET requests with ETag and Last-Modified headers derived
+    from the data version of the stations and years the request can
+    return, and with 304 Not Modified, without running the view's query,
+    when the client already has the current version.
+
+    The version is kept on the view as data_version for the rest of the
+    request."""
+
+    station_code_query_param = 'station__code'
+
+    def get_station_codes(self, request):
+        """the stations a request is limited to, or None for all of them"""
+        params = request.query_params
+        station_codes = params.getlist(self.station_code_query_param)
+        for value in params.getlist(f'{self.station_code_query_param}__in'):
+            station_codes += value.split(',')
+        return station_codes or None
+
+    def get_year_range(self, request) -> tuple:
+        """the first and last years a request is limited to by its year or
+        date filters, with None for no limit. Where several filters bound
+        the same end, any one of them covers every day the request can
+        return."""
+        params = request.query_params
+        first_year = last_year = None
+        try:
+            if 'year' in params:
+                first_year = last_year = int(params['year'])
+            if 'year__gte' in params:
+                first_year = int(params['year__gte'])
+            if 'year__lte' in params:
+                last_year = int(params['year__lte'])
+            if 'date' in params:
+                first_year = last_year = datetime.date.fromisoformat(
+                    params['date']).year
+            if 'date__gte' in params:
+                first_year = datetime.date.fromisoformat(
+                    params['date__gte']).year
+            if 'date__lt' in params:
+                last_year = (datetime.date.fromisoformat(params['date__lt']) -
+                             datetime.timedelta(days=1)).year
+            if 'date__lte' in params:
+                last_year = datetime.date.fromisoformat(
+                    params['date__lte']).year
+        except (ValueError, OverflowError):
+            # the filters reject the request, whatever its version
+            return None, None
+        return first_year, last_year
+
+    def get(self, request, *args, **kwargs):
+        self.data_version, last_modified = get_data_version(
+            self.get_station_codes(request), *self.get_year_range(request))
+        etag = quote_etag(
+            hashlib.md5(
+                f'{request.get_full_path()}|{self.data_version}'.encode(),
+                usedforsecurity=False).hexdigest())
+        last_modified = (int(last_modified.timestamp())
+                         if last_modified else None)
+
+        response = get_conditional_response(request,
+                                            etag=etag,
+                                            last_modified=last_modified)
+        if response is None:
+            response = super().get(request, *args, **kwargs)
+
+        response['ETag'] = etag
+        if last_modified is not None:
+            response['Last-Modified'] = http_date(last_modified)
+        return response
@@ -0,0 +1,102 @@
+import datetime
+
+from django import forms
+from django_filters import BaseInFilter, CharFilter, NumberFilter
+from django_filters.constants import EMPTY_VALUES
+from django_filters.filterset import FilterSet
+from django_filters.rest_framework import DjangoFilterBackend
+from django_filters.rest_framework import FilterSet as RestFilterSet
+
+from history.models import WeatherDay
+from history.stations import station_cache
+
+STATION_CODE_FIELD = 'station__code'
+
+
+class StationCodeFilter(CharFilter):
+    """filters on station_id, resolving the station code through the
+    station code cache rather than joining the station table"""
+
+    def filter(self, qs, value):
+        if value in EMPTY_VALUES:
+            return qs
+        codes = value if isinstance(value, list) else [value]
+        station_ids = list(station_cache.ids(codes).values())
+        if not station_ids:
+            return qs.none()
+        if len(station_ids) == 1:
+            return qs.filter(station_id=station_ids[0])
+        return qs.filter(station_id__in=station_ids)
+
+
+class StationCodeInFilter(BaseInFilter, StationCodeFilter):
+    pass
+
+
+class YearFilter(NumberFilter):
+    """filters a date field on calendar years with half-open date ranges,
+    date >= January 1st and date < the next January 1st, which an index
+    on the date can range scan, where a year lookup compiles to an
+    EXTRACT or strftime of every row's date"""
+    field_class = forms.IntegerField
+
+    def __init__(self, *args, **kwargs):
+        kwargs.setdefault('min_value', 1)
+        kwargs.setdefault('max_value', 9998)
+        super().__init__(*args, **kwargs)
+
+    def filter(self, qs, value):
+        if value in EMPTY_VALUES:
+            return qs
+        bounds = {}
+        if self.lookup_expr in ('exact', 'gte'):
+            bounds[f'{self.field_name}__gte'] = datetime.date(value, 1, 1)
+        if self.lookup_expr in ('exact', 'lte'):
+            bounds[f'{self.field_name}__lt'] = datetime.date(value + 1, 1, 1)
+        return self.get_method(qs)(**bounds)
+
+
+class StationFilterSetMixin:
+    """makes the station__code filters of a FilterSet filter on station_id"""
+
+    @classmethod
+    def filter_for_field(cls, field, field_name, lookup_expr=None):
+        if field_name != STATION_CODE_FIELD:
+            return super().filter_for_field(field, field_name, lookup_expr)
+        if lookup_expr == 'in':
+            return StationCodeInFilter(field_name=field_name,
+                                       lookup_expr=lookup_expr)
+        return StationCodeFilter(field_name=field_name)
+
+
+class StationFilterSet(StationFilterSetMixin, RestFilterSet):
+    pass
+
+
+class WeatherDayFilterSet(StationFilterSet):
+    """the filters of the day endpoints, whose year and date filters all
+    compile to ranges of the (station_id, date) index"""
+    year = YearFilter(field_name='date')
+    year__gte = YearFilter(field_name='date', lookup_expr='gte')
+    year__lte = YearFilter(field_name='date', lookup_expr='lte')
+
+    class Meta:
+        model = WeatherDay
+        fields = {
+            'station__code': ['exact', 'in'],
+            'date': ['exact', 'gte', 'lt', 'lte'],
+        }
+
+
+class StationFilterBackend(DjangoFilterBackend):
+    """DjangoFilterBackend whose filters from filterset_fields filter on
+    station_id for station__code lookups"""
+    filterset_base = StationFilterSet
+
+
+def station_filterset_factory(model, fields):
+    """like django-filter's filterset_factory, for a FilterSet whose
+    station__code lookups filter on station_id"""
+    meta = type('Meta', (), {'model': model, 'fields': fields})
+    return type(f'{model._meta.object_name}FilterSet',
+                (StationFilterSetMixin, FilterSet), {'Meta': meta})
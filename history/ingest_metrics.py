@@ -0,0 +1,101 @@
+import cProfile
+import time
+from collections import Counter
+from collections.abc import Iterable, Iterator
+from contextlib import contextmanager
+
+
+class IngestMetrics:
+    """Wall time, SQL queries and database time per phase of ingestion,
+    plus row and byte counts.
+
+    Phases nest without overlapping: time spent in an inner phase,
+    including pulling batches from an upstream generator tracked under
+    its own phase, is not counted in the outer one. Queries are counted
+    while the metrics are installed as an execute wrapper on a database
+    connection. The COPY statements of the copy loader bypass execute, so
+    only its other statements are counted.
+    """
+
+    def __init__(self):
+        self.seconds = Counter()
+        self.queries = Counter()
+        self.db_seconds = Counter()
+        self.counts = Counter()
+        self._phases = []
+        self._phase_started = None
+
+    @contextmanager
+    def phase(self, name: str):
+        now = time.perf_counter()
+        if self._phases:
+            self.seconds[self._phases[-1]] += now - self._phase_started
+        self._phases.append(name)
+        self._phase_started = now
+        try:
+            yield
+        finally:
+            now = time.perf_counter()
+            self.seconds[self._phases.pop()] += now - self._phase_started
+            self._phase_started = now
+
+    def track(self, iterable: Iterable, name: str) -> Iterator:
+        """pass items through, timing the work of producing each one under
+        the phase name"""
+        iterator = iter(iterable)
+        while True:
+            with self.phase(name):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            yield item
+
+    def __call__(self, execute, sql, params, many, context):
+        """count and time a query against the current phase, for
+        connection.execute_wrapper()"""
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            phase = self._phases[-1] if self._phases else 'other'
+            self.queries[phase] += 1
+            self.db_seconds[phase] += time.perf_counter() - start
+
+    def merge(self, other: 'IngestMetrics'):
+        for name in ('seconds', 'queries', 'db_seconds', 'counts'):
+            getattr(self, name).update(getattr(other, name))
+
+    def as_dict(self) -> dict:
+        """the metrics as loggable values, with times in seconds"""
+        phases = {
+            name: {
+                'seconds': round(self.seconds[name], 6),
+                'queries': self.queries[name],
+                'db_seconds': round(self.db_seconds[name], 6),
+            }
+            for name in self.seconds.keys() | self.queries.keys()
+        }
+        return {
+            'seconds': round(sum(self.seconds.values()), 6),
+            'queries': sum(self.queries.values()),
+            'db_seconds': round(sum(self.db_seconds.values()), 6),
+            **self.counts,
+            'phases': dict(sorted(phases.items())),
+        }
+
+
+@contextmanager
+def profiling(path):
+    """profile the block with cProfile and dump the stats to path, for
+    pstats or snakeviz, or do nothing if path is None"""
+    if path is None:
+        yield
+        return
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        profiler.dump_stats(path)
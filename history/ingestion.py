@@ -0,0 +1,26 @@
+"""The entry point for running an ingestion from outside the ingest_history
+command, e.g. for queued jobs, and the choices of its options that the API
+validates.
+
+The command is loaded through Django's command registry, so callers do not
+depend on the management command module.
+"""
+from collections.abc import Callable
+
+from django.core.management import call_command, load_command_class
+
+from history.ingest_metrics import IngestMetrics
+
+STATS_CHOICES = ('incremental', 'recompute', 'deferred')
+
+
+def ingest(path: str,
+           progress_callback: Callable[[dict, IngestMetrics], None] = None,
+           **options):
+    """ingest the station files at path with ingest_history's options,
+    calling progress_callback with the running counts and metrics after
+    each file and at the end of the run. Raises CommandError for invalid
+    options or a missing path, like the command."""
+    command = load_command_class('history', 'ingest_history')
+    command.progress_callback = progress_callback
+    call_command(command, path, **options)
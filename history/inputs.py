@@ -0,0 +1,152 @@
+import bz2
+import calendar
+import gzip
+import lzma
+import tarfile
+import zipfile
+from collections.abc import Iterable, Iterator
+from contextlib import contextmanager
+from dataclasses import dataclass
+from itertools import groupby
+from pathlib import Path, PurePosixPath
+
+# single station files compressed on their own, and the readers streaming
+#  them decompressed
+COMPRESSED_SUFFIXES = {
+    '.gz': gzip.open,
+    '.bz2': bz2.open,
+    '.xz': lzma.open,
+}
+ZIP_SUFFIXES = ('.zip', )
+TAR_SUFFIXES = ('.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tbz2', '.tar.xz',
+                '.txz')
+
+
+def archive_kind(path) -> str:
+    """'zip' or 'tar' for an archive of station files, otherwise None"""
+    name = str(path).lower()
+    if name.endswith(ZIP_SUFFIXES):
+        return 'zip'
+    if name.endswith(TAR_SUFFIXES):
+        return 'tar'
+    return None
+
+
+def station_code_for(name: str) -> str:
+    """the station code of a file or archive member name: its base name
+    without any compression suffix and then its extension"""
+    name = PurePosixPath(name.replace('\\', '/'))
+    if name.suffix.lower() in COMPRESSED_SUFFIXES:
+        name = name.with_suffix('')
+    return name.stem
+
+
+@dataclass(frozen=True)
+class StationInput:
+    """a station file to ingest: a file on disk, possibly compressed, or a
+    member of a zip or tar archive. size and mtime_ns are those of the
+    file, or those recorded for the member in the archive, when it was
+    found."""
+    path: Path
+    member: str = None
+    size: int = None
+    mtime_ns: int = None
+
+    @classmethod
+    def for_file(cls, path: Path) -> 'StationInput':
+        stat = Path(path).stat()
+        return cls(Path(path), size=stat.st_size, mtime_ns=stat.st_mtime_ns)
+
+    @property
+    def name(self) -> str:
+        """the path, followed by the member name for archive members"""
+        if self.member is None:
+            return str(self.path)
+        return f'{self.path}:{self.member}'
+
+    @property
+    def station_code(self) -> str:
+        return station_code_for(self.member or self.path.name)
+
+
+def iter_inputs(path: Path) -> Iterator[StationInput]:
+    """the station files of a file on disk: the file itself, or the
+    regular files inside it if it is an archive. Listing a compressed tar
+    archive reads through it once."""
+    kind = archive_kind(path)
+    if kind == 'zip':
+        with zipfile.ZipFile(path) as archive:
+            for info in archive.infolist():
+                if info.is_dir():
+                    continue
+                yield StationInput(path, info.filename, info.file_size,
+                                   zip_mtime_ns(info))
+    elif kind == 'tar':
+        with tarfile.open(path, 'r:*') as archive:
+            for info in archive:
+                if info.isfile():
+                    yield StationInput(path, info.name, info.size,
+                                       int(info.mtime) * 1_000_000_000)
+    else:
+        yield StationInput.for_file(path)
+
+
+def zip_mtime_ns(info: zipfile.ZipInfo) -> int:
+    """the modification time recorded for a zip member in nanoseconds,
+    taking its local time as UTC, since zip files record no time zone"""
+    return calendar.timegm(info.date_time + (0, 0, 0)) * 1_000_000_000
+
+
+def decompressed(file, name: str):
+    """file, read through a decompressor if name has a compression suffix"""
+    reader = COMPRESSED_SUFFIXES.get(PurePosixPath(name).suffix.lower())
+    return file if reader is None else reader(file)
+
+
+def open_inputs(inputs: Iterable[StationInput]) -> Iterator[tuple]:
+    """yield (input, binary file) for each input, streaming the decompressed
+    contents without writing anything to disk. Each file can only be read
+    until the next pair is requested.
+
+    Consecutive members of the same tar archive are read in one pass
+    through the archive, in the archive's order.
+    """
+    for (path, kind), group in groupby(
+            inputs, lambda source: (source.path, source.member and
+                                    archive_kind(source.path))):
+        if not kind:
+            for source in group:
+                with open(path, 'rb') as raw, decompressed(
+                        raw, path.name) as f:
+                    yield source, f
+        elif kind == 'zip':
+            with zipfile.ZipFile(path) as archive:
+                for source in group:
+                    with archive.open(source.member) as raw, decompressed(
+                            raw, source.member) as f:
+                        yield source, f
+        else:
+            wanted = {source.member: source for source in group}
+            with tarfile.open(path, 'r|*') as archive:
+                for info in archive:
+                    source = wanted.pop(info.name, None)
+                    if source is None:
+                        continue
+                    with archive.extractfile(info) as raw, decompressed(
+                            raw, source.member) as f:
+                        yield source, f
+                    if not wanted:
+                        break
+            if wanted:
+                raise FileNotFoundError(
+                    f'{path} no longer has {", ".join(sorted(wanted))}')
+
+
+@contextmanager
+def open_input(source: StationInput):
+    """the binary contents of a single input"""
+    pairs = open_inputs([source])
+    try:
+        yield next(pairs)[1]
+    finally:
+        pairs.close()
@@ -0,0 +1,203 @@
+import datetime
+import logging
+import os
+import socket
+import threading
+import time
+from contextlib import nullcontext
+
+from django.db import DatabaseError, connection, connections, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from history.ingest_metrics import IngestMetrics
+from history.ingestion import ingest
+from history.models import IngestionJob
+
+# the ingest_history options a job can be given
+JOB_OPTIONS = ('recursive', 'force', 'stats', 'missing_data')
+PROGRESS_INTERVAL = 1.0
+# seconds between a running job's heartbeats, and without one after which
+#  its worker is taken to have died
+HEARTBEAT_INTERVAL = 30.0
+STALE_AFTER = 300.0
+
+logger = logging.getLogger(__name__)
+
+
+def worker_name() -> str:
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+def enqueue_ingestion(path: str, options: dict = None) -> IngestionJob:
+    """queue an ingestion of path, with some of ingest_history's options"""
+    options = options or {}
+    unknown = set(options) - set(JOB_OPTIONS)
+    if unknown:
+        raise ValueError(f'unknown options: {", ".join(sorted(unknown))}')
+    job = IngestionJob.objects.create(path=path, options=options)
+    logger.info({'msg': 'ingestion job queued', 'job': job.pk,
+                 'path': path, 'options': options})
+    return job
+
+
+def claim_next_job(worker: str) -> IngestionJob:
+    """mark the oldest queued job as running by worker and return it, or
+    return None if no jobs are queued.
+
+    Where the database supports it, the job row is locked while it is
+    claimed and rows locked by other workers are skipped, so workers do
+    not wait on each other. The claim itself only succeeds if the job is
+    still queued, which keeps it safe on SQLite too, where the lock is
+    not available.
+    """
+    while True:
+        # on SQLite a transaction that reads then writes fails rather
+        #  than waits when another process writes first, so the select
+        #  and the update are run as separate statements there
+        with (transaction.atomic()
+              if connection.features.has_select_for_update else
+              nullcontext()):
+            now = timezone.now()
+            job = IngestionJob.objects.select_for_update(
+                skip_locked=True).filter(
+                    status=IngestionJob.Status.QUEUED).order_by('pk').first()
+            if job is None:
+                return None
+            claimed = IngestionJob.objects.filter(
+                pk=job.pk, status=IngestionJob.Status.QUEUED).update(
+                    status=IngestionJob.Status.RUNNING,
+                    worker=worker,
+                    started=now,
+                    heartbeat=now)
+        if claimed:
+            job.refresh_from_db()
+            return job
+
+
+def fail_job(job_id: int, error: str) -> bool:
+    """mark a job that is still running as failed, returning whether it
+    was"""
+    return bool(
+        IngestionJob.objects.filter(
+            pk=job_id, status=IngestionJob.Status.RUNNING).update(
+                status=IngestionJob.Status.FAILED,
+                error=error,
+                finished=timezone.now()))
+
+
+def requeue_job(job_id: int):
+    """put a claimed job that was never started back in the queue"""
+    IngestionJob.objects.filter(
+        pk=job_id, status=IngestionJob.Status.RUNNING).update(
+            status=IngestionJob.Status.QUEUED,
+            worker='',
+            started=None,
+            heartbeat=None)
+
+
+def fail_stale_jobs(stale_after: float = STALE_AFTER) -> list[int]:
+    """mark running jobs without a heartbeat in the last stale_after
+    seconds as failed, as their workers were killed or lost, returning
+    their ids"""
+    cutoff = timezone.now() - datetime.timedelta(seconds=stale_after)
+    stale = IngestionJob.objects.filter(
+        Q(heartbeat__lt=cutoff)
+        | Q(heartbeat__isnull=True, started__lt=cutoff),
+        status=IngestionJob.Status.RUNNING)
+    job_ids = list(stale.values_list('pk', flat=True))
+    if job_ids:
+        # only jobs still stale when updated, in case one just finished
+        job_ids = [
+            job_id for job_id in job_ids if stale.filter(pk=job_id).update(
+                status=IngestionJob.Status.FAILED,
+                error=f'WorkerLost: no heartbeat for {stale_after:g} seconds',
+                finished=timezone.now())
+        ]
+        logger.warning({'msg': 'stale ingestion jobs failed',
+                        'jobs': job_ids, 'stale_after': stale_after})
+    return job_ids
+
+
+class JobProgress:
+    """Saves an ingestion's running counts and metrics on its job, at most
+    once per interval seconds so progress does not slow ingestion down."""
+
+    def __init__(self, job: IngestionJob, interval: float = PROGRESS_INTERVAL):
+        self.job = job
+        self.interval = interval
+        self.counts = {}
+        self.metrics = IngestMetrics()
+        self.last_saved = None
+
+    def update(self, counts: dict, metrics: IngestMetrics):
+        self.counts, self.metrics = counts, metrics
+        now = time.monotonic()
+        if self.last_saved is None or now - self.last_saved >= self.interval:
+            self.save()
+            self.last_saved = now
+
+    def save(self, **fields):
+        IngestionJob.objects.filter(pk=self.job.pk).update(
+            **self.counts, metrics=self.metrics.as_dict(), **fields)
+
+    def finish(self, status: str, error: str = ''):
+        self.save(status=status, error=error, finished=timezone.now())
+
+
+class JobHeartbeat:
+    """Records on a running job, every interval seconds from a background
+    thread, that its worker is still running it, so fail_stale_jobs can
+    tell jobs of killed workers from long ones."""
+
+    def __init__(self, job: IngestionJob,
+                 interval: float = HEARTBEAT_INTERVAL):
+        self.job = job
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run,
+                                       name=f'job-{job.pk}-heartbeat',
+                                       daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stopped.set()
+        self.thread.join()
+
+    def run(self):
+        try:
+            while not self.stopped.wait(self.interval):
+                try:
+                    IngestionJob.objects.filter(
+                        pk=self.job.pk,
+                        status=IngestionJob.Status.RUNNING).update(
+                            heartbeat=timezone.now())
+                except DatabaseError:
+                    # e.g. SQLite locked by a long write, retried next time
+                    logger.warning({'msg': 'ingestion job heartbeat failed',
+                                    'job': self.job.pk}, exc_info=True)
+        finally:
+            # this thread's connection
+            connections.close_all()
+
+
+def run_job(job_id: int):
+    """run a claimed job's ingestion, recording its progress and outcome"""
+    job = IngestionJob.objects.get(pk=job_id)
+    logger.info({'msg': 'ingestion job started', 'job': job.pk,
+                 'path': job.path, 'worker': job.worker})
+    progress = JobProgress(job)
+    try:
+        with JobHeartbeat(job):
+            ingest(job.path, progress.update, **job.options)
+    except Exception as e:
+        logger.exception({'msg': 'ingestion job failed', 'job': job.pk,
+                          'path': job.path})
+        progress.finish(IngestionJob.Status.FAILED, f'{type(e).__name__}: {e}')
+        return
+    progress.finish(IngestionJob.Status.SUCCEEDED)
+    logger.info({'msg': 'ingestion job finished', 'job': job.pk,
+                 'path': job.path, **progress.counts})
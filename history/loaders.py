@@ -0,0 +1,123 @@
+import io
+from collections.abc import Iterable
+
+from django.db import connections, transaction
+
+from history.models import WeatherDay, WeatherStation
+from history.parsing import ColumnBatch
+
+VALUE_FIELDS = ('temperature_max', 'temperature_min', 'precipitation')
+LOADER_CHOICES = ('auto', 'orm', 'copy')
+
+
+class OrmLoader:
+    """upserts WeatherDay rows with bulk_create, works on every backend"""
+
+    def __init__(self, using='default'):
+        self.using = using
+
+    def load(self, station: WeatherStation,
+             batches: Iterable[ColumnBatch]) -> int:
+        """write every batch for the station, returning rows written"""
+        num_rows = 0
+        for batch in batches:
+            num_rows += len(WeatherDay.objects.using(self.using).bulk_create(
+                self.convert_batch_to_database_rows(station, batch),
+                update_conflicts=True,
+                update_fields=VALUE_FIELDS,
+                unique_fields=('station', 'date'),
+            ))
+        return num_rows
+
+    def convert_batch_to_database_rows(self, station, batch: ColumnBatch):
+        """based on a station and a parsed batch, return WeatherDay instances"""
+        return [
+            WeatherDay(
+                station=station,
+                date=date,
+                temperature_max=temperature_max,
+                temperature_min=temperature_min,
+                precipitation=precipitation,
+            ) for (date, temperature_max, temperature_min,
+                   precipitation) in batch.iter_rows()
+        ]
+
+
+class PostgresCopyLoader:
+    """streams rows into a temporary staging table with COPY FROM STDIN,
+    then merges the whole file into WeatherDay with one INSERT ... ON
+    CONFLICT statement. PostgreSQL only."""
+
+    staging_table = 'history_weatherday_staging'
+
+    def __init__(self, using='default'):
+        self.using = using
+
+    def load(self, station: WeatherStation,
+             batches: Iterable[ColumnBatch]) -> int:
+        """write every batch for the station, returning rows written"""
+        connection = connections[self.using]
+        quote = connection.ops.quote_name
+        table = quote(WeatherDay._meta.db_table)
+        staging = quote(self.staging_table)
+        unique_columns = ', '.join(
+            quote(WeatherDay._meta.get_field(name).column)
+            for name in ('station', 'date'))
+        columns = ', '.join([unique_columns] +
+                            [quote(name) for name in VALUE_FIELDS])
+        updates = ', '.join(
+            f'{quote(name)} = EXCLUDED.{quote(name)}' for name in VALUE_FIELDS)
+
+        with transaction.atomic(using=self.using), \
+                connection.cursor() as cursor:
+            # dropped at the end of the load rather than on commit, which
+            #  inside an outer transaction comes after any later loads
+            cursor.execute(
+                f'CREATE TEMPORARY TABLE {staging} ('
+                'station_id bigint NOT NULL, date date NOT NULL, '
+                'temperature_max smallint, temperature_min smallint, '
+                'precipitation integer)')
+            for batch in batches:
+                cursor.copy_expert(
+                    f'COPY {staging} ({columns}) FROM STDIN',
+                    self.batch_to_copy_buffer(station, batch))
+
+            # rows were already deduplicated by date when parsed, so a single
+            #  set-based upsert can merge them all
+            cursor.execute(f'INSERT INTO {table} ({columns}) '
+                           f'SELECT {columns} FROM {staging} '
+                           f'ON CONFLICT ({unique_columns}) '
+                           f'DO UPDATE SET {updates}')
+            num_rows = cursor.rowcount
+            cursor.execute(f'DROP TABLE {staging}')
+            return num_rows
+
+    @staticmethod
+    def batch_to_copy_buffer(station, batch: ColumnBatch) -> io.StringIO:
+        """render a batch in COPY's tab separated text format"""
+        buffer = io.StringIO()
+        for row in zip(batch.dates.astype(str).tolist(),
+                       *(getattr(batch, name).tolist()
+                         for name in VALUE_FIELDS)):
+            buffer.write(f'{station.pk}\t' + '\t'.join(
+                r'\N' if value is None else str(value)
+                for value in row) + '\n')
+        buffer.seek(0)
+        return buffer
+
+
+def get_loader(name: str = 'auto', using: str = 'default'):
+    """return the loader for a name in LOADER_CHOICES.
+
+    'auto' picks COPY on PostgreSQL and the ORM everywhere else.
+    """
+    vendor = connections[using].vendor
+    if name == 'auto':
+        name = 'copy' if vendor == 'postgresql' else 'orm'
+    if name == 'copy':
+        if vendor != 'postgresql':
+            raise ValueError('the copy loader requires PostgreSQL')
+        return PostgresCopyLoader(using)
+    if name == 'orm':
+        return OrmLoader(using)
+    raise ValueError(f'unknown loader: {name}')
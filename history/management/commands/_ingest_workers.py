@@ -0,0 +1,46 @@
+"""Entry points for ingest_history's worker processes.
+
+Kept apart from the command module so that spawned workers can import this
+before Django is set up; models are only imported once setup has run.
+"""
+import django
+from django.db import connections
+
+
+def initialize_worker(database_name):
+    """set up Django in a fresh worker and point it at the parent's database"""
+    django.setup()
+
+    # under fork the parent's closed connection objects are inherited, under
+    #  spawn the settings are reloaded, so set the database name explicitly
+    #  in case the parent was using a test database
+    connections.close_all()
+    connections['default'].settings_dict['NAME'] = database_name
+
+
+def ingest_station_files(sources, ingest_options):
+    """ingest StationInputs in order, returning the records ingested per
+    file, the (station id, year) and (station id, year, month) keys written,
+    the IngestMetrics of the files and the exception that stopped the
+    task, or None. The keys cover the files committed before any failure."""
+    from history.inputs import open_inputs
+    from history.management.commands.ingest_history import Command
+
+    command = Command()
+    records_per_file = []
+    error = None
+    try:
+        for source, file in open_inputs(sources):
+            records_per_file.append(
+                command.ingest_file(source, file, **ingest_options))
+    except Exception as e:
+        error = e
+    return (records_per_file, command.station_years_touched,
+            command.station_months_touched, command.metrics, error)
+
+
+def run_ingestion_job(job_id):
+    """run a claimed IngestionJob, for run_ingestion_jobs"""
+    from history.jobs import run_job
+
+    run_job(job_id)
@@ -0,0 +1,48 @@
+import logging
+
+from django.core.management.base import BaseCommand
+
+from history.conditional import mark_data_ingested
+from history.models import WeatherDataVersion, WeatherDay, WeatherStation
+from history.parsing import ColumnBatch
+from history.series import SERIES_FIELDS, delete_series, write_series
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = ('Rebuilds the columnar series of stations from their stored '
+            'weather days, e.g. for data ingested before the series '
+            'existed')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--station', action='append', dest='stations',
+                            help='Code of a station to rebuild. Can be '
+                                 'repeated. All stations are rebuilt by '
+                                 'default.')
+
+    def handle(self, *args, **options):
+        stations = WeatherStation.objects.order_by('pk')
+        if options['stations']:
+            stations = stations.filter(code__in=options['stations'])
+
+        num_stations = 0
+        num_days = 0
+        for station in stations.iterator():
+            batch = ColumnBatch.from_rows(
+                WeatherDay.objects.filter(station=station).values_list(
+                    'date', *SERIES_FIELDS).order_by())
+            delete_series(station.code)
+            write_series(station.code, batch)
+            # aggregates cached from the old series are stale for every
+            #  year it or the new one covers
+            mark_data_ingested(
+                (station.pk, year) for year in batch.years()
+                | set(WeatherDataVersion.objects.filter(
+                    station=station).values_list('year', flat=True)))
+            num_stations += 1
+            num_days += len(batch)
+
+        logger.info({'msg': 'series rebuilt',
+                     'stations': num_stations,
+                     'days': num_days})
@@ -1,13 +1,40 @@
 import datetime
+import hashlib
+import io
 import logging
 import re
-from collections.abc import Iterator
+import time
+from collections import Counter, defaultdict
+from collections.abc import Iterable, Iterator
+from contextlib import nullcontext
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 
 from django.core.management.base import BaseCommand, CommandError
-from django.db.models import F, Sum, Avg
+from django.db import connection, connections
 
-from history.models import WeatherDay, WeatherStation, WeatherStats
+from history.changes import ChangedRows, refresh_year_checksums
+from history.conditional import mark_data_ingested
+from history.ingestion import STATS_CHOICES
+from history.loaders import LOADER_CHOICES, get_loader
+from history.ingest_metrics import IngestMetrics, profiling
+from history.inputs import (StationInput, archive_kind, iter_inputs,
+                            open_input, open_inputs)
+from history.management.commands._ingest_workers import (
+    initialize_worker, ingest_station_files)
+from history.manifest import (FileManifest, HashingReader,
+                              record_ingested_file)
+from history.missing_data import (DEFAULT_SAMPLE_LIMIT, MISSING_DATA_CHOICES,
+                                  MissingDataReport)
+from history.models import WeatherDay, WeatherStation
+from history.parsing import (ColumnBatch, DEFAULT_BATCH_SIZE,
+                             iter_column_batches)
+from history.series import SeriesRecorder
+from history.sqlite_tuning import sqlite_fast_load, write_transaction
+from history.statistics import (StatisticsDelta, refresh_monthly_statistics,
+                                refresh_statistics)
+from history.watching import (DEFAULT_POLL_INTERVAL, DEFAULT_SETTLE_SECONDS,
+                              DEFAULT_WATCH_BATCH_SIZE, DirectoryWatcher)
 
 logger = logging.getLogger(__name__)
 
@@ -15,56 +42,543 @@ logger = logging.getLogger(__name__)
 class Command(BaseCommand):
     help = 'Loads weather data from station files'
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # (station id, year) pairs with days written by this command
+        self.station_years_touched = set()
+        # (station id, year, month) triples with days written
+        self.station_months_touched = set()
+        # the metrics of every file ingested, and of the end of the run
+        self.metrics = IngestMetrics()
+        # called with the running counts and metrics after each file and at
+        #  the end of the run, for reporting progress
+        self.progress_callback = None
+        # SeriesRecorders of the files whose days are written but not yet
+        #  committed, whose series are updated once they are, with the
+        #  (station id, year) pairs the files changed
+        self.pending_series = []
+        # whether the files are loaded in one transaction for the run
+        self.fast_load = False
+
     def add_arguments(self, parser):
         parser.add_argument('path', type=str,
                             help='Path to input file or directory '
-                                 'containing files. Subdirectories '
-                                 'will not be processed.')
+                                 'containing files. Files may be '
+                                 'compressed with gzip, bzip2 or xz, or be '
+                                 'zip or tar archives of station files. '
+                                 'Subdirectories are only processed with '
+                                 '--recursive.')
+        parser.add_argument('--recursive', action='store_true',
+                            help='Also process the files in '
+                                 'subdirectories, at any depth.')
+        parser.add_argument('--batch-size', type=int,
+                            default=DEFAULT_BATCH_SIZE,
+                            help='Number of rows parsed and written to the '
+                                 'database at a time.')
+        parser.add_argument('--workers', type=int, default=1,
+                            help='Number of processes ingesting files in '
+                                 'parallel, each with its own database '
+                                 'connection.')
+        parser.add_argument('--loader', choices=LOADER_CHOICES,
+                            default='auto',
+                            help='How rows are written. "copy" streams them '
+                                 'through PostgreSQL\'s COPY, "orm" uses '
+                                 'bulk_create and works on every backend. '
+                                 '"auto" picks copy when available.')
+        parser.add_argument('--fast-load', action='store_true',
+                            help='SQLite only. Load everything in one '
+                                 'transaction under bulk-load PRAGMAs, so '
+                                 'a failed run leaves the database as it '
+                                 'was.')
+        parser.add_argument('--stats', choices=STATS_CHOICES,
+                            default='incremental',
+                            help='How yearly statistics are kept up to '
+                                 'date. "incremental" applies the change '
+                                 'made by each upserted row, "recompute" '
+                                 're-aggregates every day of each touched '
+                                 'year after each file, and "deferred" '
+                                 're-aggregates all touched years at the '
+                                 'end of the run in set-based batches.')
+        parser.add_argument('--missing-data', choices=MISSING_DATA_CHOICES,
+                            default='rows',
+                            help='How rows with missing (-9999) values are '
+                                 'logged. "rows" logs a warning per row, '
+                                 '"summary" logs one warning per file with '
+                                 'counts by field and year, after the '
+                                 'first --missing-data-samples rows.')
+        parser.add_argument('--missing-data-samples', type=int,
+                            default=DEFAULT_SAMPLE_LIMIT,
+                            help='Number of rows with missing values '
+                                 'logged individually per file in summary '
+                                 'mode.')
+        parser.add_argument('--force', action='store_true',
+                            help='Ingest every file, including those '
+                                 'unchanged since they were last '
+                                 'ingested, and write every row, '
+                                 'including those already stored with '
+                                 'the same values.')
+        parser.add_argument('--profile', metavar='PATH',
+                            help='Profile the run with cProfile and write '
+                                 'the stats to PATH, for pstats or '
+                                 'snakeviz. Cannot be combined with '
+                                 '--workers.')
+        parser.add_argument('--watch', action='store_true',
+                            help='Keep running, ingesting the files that '
+                                 'arrive in or change in the directory in '
+                                 'micro-batches, until interrupted. Files '
+                                 'already in the directory are ingested '
+                                 'first.')
+        parser.add_argument('--watch-settle', type=float,
+                            default=DEFAULT_SETTLE_SECONDS,
+                            help='Seconds a file must go unmodified before '
+                                 'it is ingested in watch mode, so files '
+                                 'still being written are left alone.')
+        parser.add_argument('--watch-batch-size', type=int,
+                            default=DEFAULT_WATCH_BATCH_SIZE,
+                            help='Most files ingested per micro-batch in '
+                                 'watch mode.')
+        parser.add_argument('--watch-poll-interval', type=float,
+                            default=DEFAULT_POLL_INTERVAL,
+                            help='Seconds between directory scans in watch '
+                                 'mode when inotify is not used.')
+        parser.add_argument('--watch-polling', action='store_true',
+                            help='Scan the directory for changes instead of '
+                                 'using inotify, which does not see changes '
+                                 'made on other machines to network '
+                                 'filesystems.')
 
     def handle(self, *args, **options):
         logger.info({'msg': 'ingestion started', 'path': options['path']})
+        started = time.perf_counter()
+
+        if options['workers'] < 1:
+            raise CommandError('--workers must be at least 1')
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be at least 1')
+        if options['fast_load'] and connection.vendor != 'sqlite':
+            raise CommandError('--fast-load requires SQLite')
+        if options['fast_load'] and options['workers'] > 1:
+            raise CommandError('--fast-load cannot be combined with --workers')
+        if options['missing_data_samples'] < 0:
+            raise CommandError('--missing-data-samples must not be negative')
+        if options['profile'] and options['workers'] > 1:
+            raise CommandError('--profile cannot be combined with --workers')
+        if options['watch']:
+            if not Path(options['path']).is_dir():
+                raise CommandError('--watch requires a directory')
+            if options['fast_load']:
+                raise CommandError('--fast-load cannot be combined with '
+                                   '--watch')
+            if options['watch_settle'] < 0:
+                raise CommandError('--watch-settle must not be negative')
+            if options['watch_batch_size'] < 1:
+                raise CommandError('--watch-batch-size must be at least 1')
+            if options['watch_poll_interval'] <= 0:
+                raise CommandError('--watch-poll-interval must be positive')
+        try:
+            get_loader(options['loader'])
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        ingest_options = {
+            'batch_size': options['batch_size'],
+            'loader': options['loader'],
+            'stats': options['stats'],
+            'missing_data': options['missing_data'],
+            'missing_data_samples': options['missing_data_samples'],
+            'force': options['force'],
+        }
+
+        if options['watch']:
+            with profiling(options['profile']):
+                self.watch(options, ingest_options)
+            return
+
+        # iterate through all files in the directory, or just the one file
+        #  if a specific file was given, and the station files inside any
+        #  archives among them
+        filepaths = self.iter_files_to_process(options['path'],
+                                               options['recursive'])
+        sources = (source for filepath in filepaths
+                   for source in iter_inputs(filepath))
+
+        with profiling(options['profile']):
+            counts = self.ingest_sources(sources, options, ingest_options)
+
+        # with workers, phase times add up across processes, so can exceed
+        #  the wall time
+        logger.info(
+            {'msg': 'ingestion finished', 'path': options['path'],
+             **counts,
+             'workers': options['workers'],
+             'wall_seconds': round(time.perf_counter() - started, 6),
+             **self.metrics.as_dict()})
+
+    def ingest_sources(self, sources: Iterable[StationInput], options: dict,
+                       ingest_options: dict) -> dict:
+        """ingest the station files, returning the numbers of records
+        ingested, files processed and files skipped as unchanged"""
         num_records_ingested = 0
         num_files_processed = 0
 
-        # iterate through all files in the directory, or just the one file
-        #  if a specific file was given
-        for num_files_processed, filepath in enumerate(
-                self.iter_files_to_process(options['path']), 1):
-
-            # create the weather station object
-            #  with its code set based on the filename of the data
-            station = WeatherStation.objects.get_or_create(
-                defaults={'code': filepath.stem},
-                code=filepath.stem
+        # files with the same size, modification time and contents as when
+        #  they were last ingested would write the same rows again
+        files_unchanged = []
+        if not options['force']:
+            sources = list(sources)
+            sources = FileManifest(sources).iter_changed(
+                sources, files_unchanged)
+
+        if options['workers'] > 1:
+            records_per_file = self.ingest_files_in_parallel(
+                sources, options['workers'], ingest_options)
+        else:
+            records_per_file = (self.ingest_file(source, file,
+                                                 **ingest_options)
+                                for source, file in open_inputs(sources))
+
+        # in fast load mode the whole run is one transaction
+        self.fast_load = options['fast_load']
+        self.pending_series = []
+        with (sqlite_fast_load() if options['fast_load'] else nullcontext()):
+            try:
+                for num_files_processed, num_records in enumerate(
+                        records_per_file, 1):
+                    num_records_ingested += num_records
+                    self.report_progress(num_records_ingested,
+                                         num_files_processed,
+                                         len(files_unchanged))
+            except BaseException:
+                # the files loaded before the failure are committed and
+                #  later runs skip them as unchanged, so their statistics
+                #  cannot wait for a run that completes. In fast load mode
+                #  the failure rolls them back instead
+                if options['stats'] == 'deferred' and not self.fast_load:
+                    self.refresh_deferred_statistics()
+                raise
+            if options['stats'] == 'deferred':
+                self.refresh_deferred_statistics()
+        if self.pending_series:
+            with connection.execute_wrapper(self.metrics):
+                self.save_pending_series(self.metrics)
+
+        self.report_progress(num_records_ingested, num_files_processed,
+                             len(files_unchanged))
+        return {'records_ingested': num_records_ingested,
+                'files_processed': num_files_processed,
+                'files_unchanged': len(files_unchanged)}
+
+    def refresh_deferred_statistics(self):
+        """in deferred mode, no statistics were touched while loading, so
+        re-aggregate every station year and month the run wrote. The data
+        versions are bumped again so clients do not keep responses cached
+        between the file and statistics updates"""
+        metrics = self.metrics
+        with connection.execute_wrapper(metrics):
+            with metrics.phase('statistics'):
+                refresh_statistics(self.station_years_touched)
+            with metrics.phase('monthly_statistics'):
+                refresh_monthly_statistics(self.station_months_touched)
+            with metrics.phase('versions'):
+                mark_data_ingested(self.station_years_touched)
+
+    def report_progress(self, records_ingested: int, files_processed: int,
+                        files_unchanged: int):
+        if self.progress_callback is not None:
+            self.progress_callback(
+                {'records_ingested': records_ingested,
+                 'files_processed': files_processed,
+                 'files_unchanged': files_unchanged}, self.metrics)
+
+    def watch(self, options: dict, ingest_options: dict):
+        """ingest the files that arrive in or change in the directory in
+        micro-batches, until interrupted. Each batch is logged with how
+        long its files waited from when they were first seen, and how many
+        files are still waiting."""
+        watcher = DirectoryWatcher(
+            options['path'], options['recursive'],
+            settle_seconds=options['watch_settle'],
+            poll_interval=options['watch_poll_interval'],
+            use_inotify=not options['watch_polling'])
+        logger.info({'msg': 'watching', 'path': options['path'],
+                     'watcher': watcher.kind,
+                     'backlog_files': watcher.backlog})
+        num_batches = 0
+        try:
+            while True:
+                ready = watcher.next_batch(options['watch_batch_size'])
+                started = time.perf_counter()
+                # each batch gets its own metrics and deferred statistics
+                self.metrics = IngestMetrics()
+                self.station_years_touched = set()
+                self.station_months_touched = set()
+                paths = [pending.path for pending in ready]
+                try:
+                    sources = [source for path in paths if path.exists()
+                               for source in iter_inputs(path)]
+                    counts = self.ingest_sources(sources, options,
+                                                 ingest_options)
+                except Exception:
+                    # a bad file must not stop the watch. It is retried
+                    #  once it changes again
+                    logger.exception({'msg': 'watch batch failed',
+                                      'paths': [str(p) for p in paths]})
+                    continue
+                num_batches += 1
+                finished = time.perf_counter()
+                logger.info(
+                    {'msg': 'watch batch ingested', 'path': options['path'],
+                     'files_ready': len(ready),
+                     **counts,
+                     'backlog_files': watcher.backlog,
+                     'ingest_seconds': round(finished - started, 6),
+                     'latency_seconds': round(
+                         time.monotonic() -
+                         min(pending.first_seen for pending in ready), 6),
+                     **self.metrics.as_dict()})
+        except KeyboardInterrupt:
+            pass
+        finally:
+            watcher.close()
+        logger.info({'msg': 'watch stopped', 'path': options['path'],
+                     'batches': num_batches,
+                     'backlog_files': watcher.backlog})
+
+    def ingest_files_in_parallel(self, sources: Iterable[StationInput],
+                                 workers: int,
+                                 ingest_options: dict) -> Iterator[int]:
+        """ingest files in a process pool, yielding records ingested per file"""
+
+        # files are grouped by station so that each station's days and
+        #  statistics are only ever written by one worker at a time
+        sources_by_station = defaultdict(list)
+        for source in sources:
+            sources_by_station[source.station_code].append(source)
+
+        # tar archives can only be read from the start, so rather than a
+        #  task per station, stations with files in tar archives are dealt
+        #  into one task per worker, each reading through an archive once
+        #  for all of its members
+        tasks = []
+        tar_tasks = [[] for _ in range(workers)]
+        num_tar_stations = 0
+        for station_sources in sources_by_station.values():
+            if any(source.member and archive_kind(source.path) == 'tar'
+                   for source in station_sources):
+                tar_tasks[num_tar_stations % workers] += station_sources
+                num_tar_stations += 1
+            else:
+                tasks.append(station_sources)
+        tasks += [
+            sorted(task, key=lambda source: str(source.path))
+            for task in tar_tasks if task
+        ]
+
+        # workers must open their own database connections rather than
+        #  inherit this process's connection
+        connections.close_all()
+        # a task that fails returns what its files before the failure
+        #  wrote along with the error, which is raised once every task's
+        #  committed files are accounted for
+        error = None
+        with ProcessPoolExecutor(
+                max_workers=workers,
+                initializer=initialize_worker,
+                initargs=(connection.settings_dict['NAME'], )) as executor:
+            for (records_per_file, station_years_touched,
+                 station_months_touched, metrics,
+                 task_error) in executor.map(ingest_station_files, tasks,
+                                             [ingest_options] * len(tasks)):
+                self.station_years_touched |= station_years_touched
+                self.station_months_touched |= station_months_touched
+                self.metrics.merge(metrics)
+                yield from records_per_file
+                error = error or task_error
+        if error is not None:
+            raise error
+
+    def ingest_file(self, source: StationInput, file=None,
+                    batch_size: int = DEFAULT_BATCH_SIZE,
+                    loader: str = 'auto',
+                    stats: str = 'incremental',
+                    missing_data: str = 'rows',
+                    missing_data_samples: int = DEFAULT_SAMPLE_LIMIT,
+                    force: bool = False) -> int:
+        """load one station file, returning the number of records ingested.
+        source can also be the path of a file on disk. file is its open
+        binary contents, opened from source if not given. Logs the file's
+        metrics and adds them to the run's."""
+        if not isinstance(source, StationInput):
+            source = StationInput.for_file(source)
+        metrics = IngestMetrics()
+        missing_data_report = MissingDataReport(
+            missing_data_samples if missing_data == 'summary' else None)
+        # the file's days and all of its bookkeeping are written in one
+        #  transaction, so a file that fails part way leaves nothing that
+        #  later runs would take as already ingested
+        with connection.execute_wrapper(metrics), (
+                nullcontext(file) if file is not None else
+                open_input(source)) as file, write_transaction():
+            num_records_ingested = self.load_file(source, file, metrics,
+                                                  missing_data_report,
+                                                  batch_size, loader, stats,
+                                                  force)
+        # in fast load mode the file's days are only committed at the end
+        #  of the run
+        if not self.fast_load:
+            with connection.execute_wrapper(metrics):
+                self.save_pending_series(metrics)
+
+        if missing_data == 'summary' and missing_data_report.rows:
+            logger.warning({'msg': 'missing data summary',
+                            'path': source.name,
+                            'station': source.station_code,
+                            **missing_data_report.as_dict()})
+        metrics.counts['rows_upserted'] = num_records_ingested
+        metrics.counts['rows_with_missing_data'] = missing_data_report.rows
+        logger.info({'msg': 'file ingested', 'path': source.name,
+                     **metrics.as_dict()})
+        self.metrics.merge(metrics)
+        return num_records_ingested
+
+    def load_file(self, source: StationInput, file, metrics: IngestMetrics,
+                  missing_data_report: MissingDataReport, batch_size: int,
+                  loader: str, stats: str, force: bool = False) -> int:
+        """the work of ingest_file, split into phases of metrics"""
+
+        # the file is recorded in the manifest with the size and
+        #  modification time it had when it was found. If it changes while
+        #  being read, the next run will see a different one
+        digest = hashlib.sha256()
+
+        # create the weather station object
+        #  with its code set based on the filename of the data. Its row is
+        #  locked until the file's transaction ends, so concurrent runs
+        #  ingesting the same station take turns rather than applying
+        #  statistics deltas computed from the same stored rows. SQLite
+        #  transactions already take turns on the whole database
+        with metrics.phase('station'):
+            stations = WeatherStation.objects.select_for_update()
+            station = stations.get_or_create(
+                defaults={'code': source.station_code},
+                code=source.station_code
             )[0]
 
-            # create WeatherDay objects based on the rows in the text file
-            weather_days_to_create = self.convert_file_rows_to_database_rows(
-                station, filepath
-            )
+        months_in_file = set()
+        batches = metrics.track(
+            self.iter_file_batches(file, batch_size, metrics.counts,
+                                   digest), 'parse')
+        batches = metrics.track(
+            self.inspect_batches(station, batches, months_in_file,
+                                 missing_data_report),
+            'inspect')
 
-            # consider what years were in the file in order to update
-            #  only the statistics affected by those years
-            years_to_update = {weather_day.date.year for weather_day
-                               in weather_days_to_create}
+        # only rows that are new or differ from the stored ones are passed
+        #  on to be written, unless forced
+        changed_rows = None
+        if not force:
+            changed_rows = ChangedRows(station, metrics.counts)
+            batches = metrics.track(changed_rows.track(batches), 'compare')
 
-            # update the database in bulk for our particular station
-            num_records_ingested += len(WeatherDay.objects.bulk_create(
-                weather_days_to_create,
-                update_conflicts=True,
-                update_fields=('temperature_max', 'temperature_min',
-                               'precipitation'),
-                unique_fields=('station', 'date'),
-            ))
+        # in incremental mode, the change each row makes to its year's
+        #  totals is worked out before the row is written
+        statistics_delta = None
+        if stats == 'incremental':
+            statistics_delta = StatisticsDelta(station)
+            batches = metrics.track(statistics_delta.track(batches),
+                                    'statistics')
 
-            # update the statistics that could be affected by this
-            #  station's update
-            self.update_statistics(station, years_to_update)
+        # the station's columnar series is rewritten once per file, from
+        #  the database after the file's days are committed
+        series_recorder = SeriesRecorder(station)
+        batches = metrics.track(series_recorder.track(batches), 'series')
 
-        logger.info(
-            {'msg': 'ingestion finished', 'path': options['path'],
-             'records_ingested': num_records_ingested,
-             'files_processed': num_files_processed})
+        # write the file in fixed-size batches so memory use does not grow
+        #  with the length of the file
+        with metrics.phase('load'):
+            num_records_ingested = get_loader(loader).load(station, batches)
+
+        # statistics and data versions only need updating where days
+        #  changed
+        if changed_rows is None:
+            months_to_update = months_in_file
+        else:
+            months_to_update = changed_rows.months_changed
+        years_to_update = {year for year, _ in months_to_update}
+        station_years = {(station.pk, year) for year in years_to_update}
+        station_months = {(station.pk, year, month)
+                          for year, month in months_to_update}
+
+        # update the statistics that could be affected by this
+        #  station's update
+        with metrics.phase('statistics'):
+            if statistics_delta is not None:
+                statistics_delta.apply()
+            elif stats == 'recompute':
+                self.update_statistics(station, years_to_update)
+        # monthly rollups hold extremes, which cannot be updated from
+        #  deltas, so the touched months are re-aggregated. They only
+        #  hold the days just written, plus any others of those months
+        if stats != 'deferred':
+            with metrics.phase('monthly_statistics'):
+                refresh_monthly_statistics(station_months)
+        # let API caches and clients know that responses covering these
+        #  years are stale
+        with metrics.phase('versions'):
+            mark_data_ingested(station_years)
+        with metrics.phase('checksums'):
+            refresh_year_checksums(
+                station, years_to_update if changed_rows is None else
+                changed_rows.years_to_checksum())
+        with metrics.phase('manifest'):
+            record_ingested_file(source, digest.hexdigest(), station,
+                                 num_records_ingested)
+        self.station_years_touched |= station_years
+        self.station_months_touched |= station_months
+        self.pending_series.append((series_recorder, station_years))
+        return num_records_ingested
+
+    def save_pending_series(self, metrics: IngestMetrics):
+        """update the series of the files whose days are committed, then
+        bump the data versions of their years again, so an aggregate
+        computed from the old series before then is not cached as
+        current"""
+        station_years = set()
+        with metrics.phase('series'):
+            while self.pending_series:
+                recorder, file_station_years = self.pending_series.pop(0)
+                recorder.save()
+                station_years |= file_station_years
+        with metrics.phase('versions'):
+            mark_data_ingested(station_years)
+
+    def inspect_batches(
+            self, station, batches: Iterable[ColumnBatch], months_seen: set,
+            missing_data_report: MissingDataReport = None
+    ) -> Iterator[ColumnBatch]:
+        """pass batches through, recording the (year, month) pairs seen and
+        counting rows with missing data into missing_data_report. Rows the
+        report keeps as samples, or all of them without a report, are
+        logged."""
+        if missing_data_report is None:
+            missing_data_report = MissingDataReport()
+        for batch in batches:
+
+            # consider what months were in the file in order to update
+            #  only the statistics affected by those months
+            months_seen |= batch.months()
+
+            samples = missing_data_report.add(batch[batch.missing()])
+            for (date, temperature_max, temperature_min,
+                 precipitation) in samples.iter_rows():
+                self.log_message_if_some_data_missing(WeatherDay(
+                    station=station,
+                    date=date,
+                    temperature_max=temperature_max,
+                    temperature_min=temperature_min,
+                    precipitation=precipitation,
+                ))
+            yield batch
 
     def convert_file_rows_to_database_rows(self, station, filepath_to_load):
         """based on a station and a path to file, return WeatherDay instances"""
@@ -89,8 +603,10 @@ class Command(BaseCommand):
             dates_encountered.add(date)
         return rows
 
-    def iter_files_to_process(self, path: str) -> Iterator[Path]:
-        """for user's input path, yield each filepath needing processing"""
+    def iter_files_to_process(self, path: str,
+                              recursive: bool = False) -> Iterator[Path]:
+        """for user's input path, yield each filepath needing processing,
+        descending into subdirectories if recursive"""
         path = Path(path)
 
         if not path.exists():
@@ -99,6 +615,10 @@ class Command(BaseCommand):
         if path.is_dir():
             for file_path in path.iterdir():
                 if file_path.is_dir():
+                    if recursive:
+                        yield from self.iter_files_to_process(file_path,
+                                                              recursive)
+                        continue
                     logger.warning({'msg': 'skipping subdirectory',
                                     'path': str(file_path)})
                     continue
@@ -106,10 +626,31 @@ class Command(BaseCommand):
         else:
             yield path
 
+    def iter_batches_to_process(
+            self, filepath_to_load: str,
+            batch_size: int = DEFAULT_BATCH_SIZE,
+            counts: Counter = None,
+            digest=None) -> Iterator[ColumnBatch]:
+        """for a file needing processing, possibly compressed, yield
+        deduplicated column batches"""
+        with open_input(StationInput.for_file(Path(filepath_to_load))) as f:
+            yield from self.iter_file_batches(f, batch_size, counts, digest)
+
+    def iter_file_batches(self, file, batch_size: int = DEFAULT_BATCH_SIZE,
+                          counts: Counter = None,
+                          digest=None) -> Iterator[ColumnBatch]:
+        """for an open binary station file, yield deduplicated column
+        batches, counting bytes and rows read into counts and hashing the
+        file's contents into the hashlib digest if given"""
+        if digest is not None:
+            file = HashingReader(file, digest)
+        yield from iter_column_batches(file, batch_size, counts=counts)
+
     def iter_rows_to_process(self, filepath_to_load: str):
-        """for a file needing processing, yield each row as raw data"""
-        with open(filepath_to_load, 'r') as f:
-            for line in f:
+        """for a file needing processing, possibly compressed, yield each
+        row as raw data"""
+        with open_input(StationInput.for_file(Path(filepath_to_load))) as f:
+            for line in io.TextIOWrapper(f):
                 columns = re.findall(r'\S+', line)
                 for i, column in enumerate(columns):
                     if column == '-9999':
@@ -132,26 +673,4 @@ class Command(BaseCommand):
 
     def update_statistics(self, station, years_to_update):
         """for a station and the given years, recalculate and save stats"""
-        stats_to_update = []
-
-        for r in WeatherDay.objects.filter(
-                station=station, date__year__in=years_to_update).values(
-            'date__year').annotate(
-            avg_temperature_max_celsius=Avg(F('temperature_max') / 10.0),
-            avg_temperature_min_celsius=Avg(F('temperature_min') / 10.0),
-            total_precipitation_centimeters=Sum(F('precipitation') / 100.0)):
-            stats_to_update.append(WeatherStats(
-                station=station,
-                year=r['date__year'],
-                avg_temperature_max=r['avg_temperature_max_celsius'],
-                avg_temperature_min=r['avg_temperature_min_celsius'],
-                total_precipitation=r['total_precipitation_centimeters'],
-            ))
-
-        WeatherStats.objects.bulk_create(
-            stats_to_update,
-            update_conflicts=True,
-            update_fields=('avg_temperature_max', 'avg_temperature_min',
-                           'total_precipitation'),
-            unique_fields=('station', 'year'),
-        )
+        refresh_statistics((station.pk, year) for year in years_to_update)
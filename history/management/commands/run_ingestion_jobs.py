@@ -0,0 +1,146 @@
+import logging
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+
+from history.jobs import (HEARTBEAT_INTERVAL, STALE_AFTER, claim_next_job,
+                          fail_job, fail_stale_jobs, requeue_job, run_job,
+                          worker_name)
+from history.management.commands._ingest_workers import (initialize_worker,
+                                                          run_ingestion_job)
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = ('Runs the ingestion jobs queued through the API, claiming them '
+            'from the database so several workers can share the queue')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=1,
+                            help='Number of jobs run at once, each in its '
+                                 'own process when more than 1.')
+        parser.add_argument('--poll-interval', type=float, default=2.0,
+                            help='Seconds between checks for new jobs '
+                                 'while idle.')
+        parser.add_argument('--stale-after', type=float,
+                            default=STALE_AFTER,
+                            help='Seconds without a heartbeat after which '
+                                 'a running job\'s worker is taken to have '
+                                 'died and the job is marked failed.')
+        parser.add_argument('--exit-when-idle', action='store_true',
+                            help='Stop once no jobs are queued or running, '
+                                 'rather than waiting for more.')
+
+    def handle(self, *args, **options):
+        if options['concurrency'] < 1:
+            raise CommandError('--concurrency must be at least 1')
+        if options['poll_interval'] <= 0:
+            raise CommandError('--poll-interval must be positive')
+        if options['stale_after'] <= HEARTBEAT_INTERVAL:
+            raise CommandError('--stale-after must be longer than the '
+                               f'{HEARTBEAT_INTERVAL:g} second heartbeat '
+                               'interval')
+
+        worker = worker_name()
+        logger.info({'msg': 'ingestion worker started', 'worker': worker,
+                     'concurrency': options['concurrency']})
+        try:
+            if options['concurrency'] == 1:
+                num_jobs = self.run_serially(worker, options)
+            else:
+                num_jobs = self.run_in_parallel(worker, options)
+        except KeyboardInterrupt:
+            num_jobs = None
+        logger.info({'msg': 'ingestion worker stopped', 'worker': worker,
+                     'jobs_run': num_jobs})
+
+    def run_serially(self, worker: str, options: dict) -> int:
+        num_jobs = 0
+        while True:
+            fail_stale_jobs(options['stale_after'])
+            job = claim_next_job(worker)
+            if job is None:
+                if options['exit_when_idle']:
+                    return num_jobs
+                time.sleep(options['poll_interval'])
+                continue
+            run_job(job.pk)
+            num_jobs += 1
+
+    def run_in_parallel(self, worker: str, options: dict) -> int:
+        """claim jobs while fewer than --concurrency are running, running
+        each in a pool process. A pool broken by a process that died is
+        replaced, after failing the jobs it was running."""
+        num_jobs = 0
+        while True:
+            num_jobs, pool_broken = self.run_pool(worker, options, num_jobs)
+            if not pool_broken:
+                return num_jobs
+            logger.warning({'msg': 'ingestion worker pool restarted',
+                            'worker': worker})
+
+    def run_pool(self, worker: str, options: dict,
+                 num_jobs: int) -> tuple[int, bool]:
+        """run jobs in a new pool until idle with --exit-when-idle or until
+        the pool breaks, returning the number of jobs run so far and
+        whether it broke"""
+        # the job id of each running future
+        running = {}
+        with ProcessPoolExecutor(
+                max_workers=options['concurrency'],
+                initializer=initialize_worker,
+                initargs=(connection.settings_dict['NAME'], )) as executor:
+            while True:
+                if len(running) < options['concurrency']:
+                    fail_stale_jobs(options['stale_after'])
+                while len(running) < options['concurrency']:
+                    job = claim_next_job(worker)
+                    if job is None:
+                        break
+                    # the pool may start a process for the job, which must
+                    #  not inherit this process's connection
+                    connections.close_all()
+                    try:
+                        running[executor.submit(run_ingestion_job,
+                                                job.pk)] = job.pk
+                    except BrokenProcessPool:
+                        # the job never started, so can run in the next pool
+                        requeue_job(job.pk)
+                        self.fail_jobs_of_broken_pool(running)
+                        return num_jobs, True
+                    num_jobs += 1
+                if not running:
+                    if options['exit_when_idle']:
+                        return num_jobs, False
+                    time.sleep(options['poll_interval'])
+                    continue
+                done, _ = wait(running,
+                               timeout=options['poll_interval'],
+                               return_when=FIRST_COMPLETED)
+                pool_broken = False
+                for future in done:
+                    job_id = running.pop(future)
+                    # run_job records its own failures on the job, so these
+                    #  are failures of the pool process itself
+                    try:
+                        future.result()
+                    except Exception as e:
+                        logger.error({'msg': 'ingestion job process failed',
+                                      'job': job_id},
+                                     exc_info=True)
+                        fail_job(job_id, f'{type(e).__name__}: {e}')
+                        pool_broken |= isinstance(e, BrokenProcessPool)
+                if pool_broken:
+                    self.fail_jobs_of_broken_pool(running)
+                    return num_jobs, True
+
+    def fail_jobs_of_broken_pool(self, running: dict):
+        """fail the jobs of the futures still running in a broken pool,
+        which fail with it"""
+        for job_id in running.values():
+            fail_job(job_id, 'BrokenProcessPool: the pool was broken by '
+                     'another job\'s process')
@@ -0,0 +1,106 @@
+import logging
+
+from django.core.management.base import BaseCommand, CommandError
+
+from history.conditional import mark_data_ingested
+from history.models import WeatherDay, WeatherStation, WeatherStats
+from history.statistics import (STATISTIC_FIELDS, TOTAL_FIELDS,
+                                aggregate_totals)
+
+logger = logging.getLogger(__name__)
+
+STATIONS_PER_CHUNK = 500
+
+
+class Command(BaseCommand):
+    help = ('Checks the stored yearly weather statistics against a full '
+            'recompute from the weather days')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--station', action='append', dest='stations',
+                            help='Code of a station to check. Can be '
+                                 'repeated. All stations are checked by '
+                                 'default.')
+        parser.add_argument('--fix', action='store_true',
+                            help='Overwrite mismatched statistics with the '
+                                 'recomputed values.')
+
+    def handle(self, *args, **options):
+        stations = WeatherStation.objects.order_by('pk')
+        if options['stations']:
+            stations = stations.filter(code__in=options['stations'])
+        station_codes = dict(stations.values_list('pk', 'code'))
+        station_ids = list(station_codes)
+
+        num_checked = 0
+        num_mismatched = 0
+        for start in range(0, len(station_ids), STATIONS_PER_CHUNK):
+            chunk = station_ids[start:start + STATIONS_PER_CHUNK]
+            expected = self.recompute_statistics(chunk)
+            stored = {(stats.station_id, stats.year): stats
+                      for stats in WeatherStats.objects.filter(
+                          station_id__in=chunk)}
+
+            mismatched = []
+            for key in sorted(expected.keys() | stored.keys()):
+                num_checked += 1
+                fields = self.mismatched_fields(expected.get(key),
+                                                stored.get(key))
+                if fields:
+                    mismatched.append(key)
+                    logger.warning({
+                        'msg': 'statistics do not match a full recompute',
+                        'station': station_codes[key[0]],
+                        'year': key[1],
+                        'fields': fields,
+                    })
+            num_mismatched += len(mismatched)
+
+            if options['fix'] and mismatched:
+                self.fix_statistics(mismatched, expected)
+
+        logger.info({'msg': 'statistics verified',
+                     'stats_checked': num_checked,
+                     'stats_mismatched': num_mismatched,
+                     'fixed': options['fix']})
+        if num_mismatched and not options['fix']:
+            raise CommandError(f'{num_mismatched} of {num_checked} '
+                               'statistics do not match a full recompute')
+
+    def recompute_statistics(self, station_ids) -> dict:
+        """WeatherStats for the stations built from scratch, by key"""
+        expected = {}
+        for r in aggregate_totals(
+                WeatherDay.objects.filter(station_id__in=station_ids)):
+            stats = WeatherStats(
+                station_id=r['station_id'],
+                year=r['date__year'],
+                **{field: r[field] or 0 for field in TOTAL_FIELDS})
+            stats.update_from_totals()
+            expected[(stats.station_id, stats.year)] = stats
+        return expected
+
+    def mismatched_fields(self, expected, stored) -> list[str]:
+        """names of fields that differ, or all of them if a row is absent"""
+        if expected is None or stored is None:
+            return ['missing' if stored is None else 'unexpected']
+        return [
+            field for field in STATISTIC_FIELDS + TOTAL_FIELDS
+            if getattr(expected, field) != getattr(stored, field)
+        ]
+
+    def fix_statistics(self, keys, expected):
+        """save the recomputed statistics for keys, deleting stray rows,
+        and bump their data versions so responses cached with the old
+        statistics are not served"""
+        WeatherStats.objects.bulk_create(
+            [expected[key] for key in keys if key in expected],
+            update_conflicts=True,
+            update_fields=STATISTIC_FIELDS + TOTAL_FIELDS,
+            unique_fields=('station', 'year'),
+        )
+        for station_id, year in keys:
+            if (station_id, year) not in expected:
+                WeatherStats.objects.filter(station_id=station_id,
+                                            year=year).delete()
+        mark_data_ingested(keys)
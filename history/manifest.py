@@ -0,0 +1,109 @@
+import hashlib
+from collections.abc import Iterable, Iterator
+from pathlib import Path
+
+from django.utils import timezone
+
+from history.inputs import StationInput, open_input
+from history.models import IngestedFile
+
+PATHS_PER_QUERY = 500
+HASH_CHUNK_SIZE = 1 << 20
+
+
+def manifest_key(source: StationInput) -> str:
+    """the path a station file is recorded under in the manifest, followed
+    by its member name if it is in an archive"""
+    path = str(Path(source.path).resolve())
+    return path if source.member is None else f'{path}:{source.member}'
+
+
+def hash_input(source: StationInput) -> str:
+    """the hex SHA-256 digest of a station file's decompressed contents"""
+    digest = hashlib.sha256()
+    with open_input(source) as f:
+        while block := f.read(HASH_CHUNK_SIZE):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class HashingReader:
+    """wraps a binary file, updating digest with everything read through
+    it, so a file can be fingerprinted while it is parsed rather than read
+    twice"""
+
+    def __init__(self, file, digest):
+        self.file = file
+        self.digest = digest
+
+    def read(self, size: int = -1) -> bytes:
+        block = self.file.read(size)
+        self.digest.update(block)
+        return block
+
+
+class FileManifest:
+    """What the manifest knows about a set of station files, loaded in a
+    few queries.
+
+    A file is unchanged while its size and modification time, or those
+    recorded for it in its archive, match its entry. If either differs,
+    the file is hashed, and if only its modification time changed the
+    entry is updated so later runs can go by stat alone again.
+    """
+
+    def __init__(self, sources: Iterable[StationInput]):
+        keys = sorted({manifest_key(source) for source in sources})
+        self.entries = {}
+        for start in range(0, len(keys), PATHS_PER_QUERY):
+            self.entries.update(
+                (entry.path, entry) for entry in IngestedFile.objects.filter(
+                    path__in=keys[start:start + PATHS_PER_QUERY]))
+
+    def is_unchanged(self, source: StationInput) -> bool:
+        entry = self.entries.get(manifest_key(source))
+        if entry is None:
+            return False
+        if source.size != entry.size:
+            return False
+        if source.mtime_ns == entry.mtime_ns:
+            return True
+        if hash_input(source) != entry.sha256:
+            return False
+        entry.mtime_ns = source.mtime_ns
+        entry.save(update_fields=['mtime_ns'])
+        return True
+
+    def iter_changed(self, sources: Iterable[StationInput],
+                     skipped: list = None) -> Iterator[StationInput]:
+        """yield the station files that are new or changed, appending the
+        others to skipped if given"""
+        for source in sources:
+            if self.is_unchanged(source):
+                if skipped is not None:
+                    skipped.append(source)
+                continue
+            yield source
+
+
+def record_ingested_file(source: StationInput, sha256: str, station,
+                         records_ingested: int):
+    """record the fingerprint a station file had when it was ingested. A
+    single upsert, so concurrent workers never wait on each other's
+    reads"""
+    fields = ('size', 'mtime_ns', 'sha256', 'station', 'records_ingested',
+              'last_ingested')
+    IngestedFile.objects.bulk_create(
+        [
+            IngestedFile(path=manifest_key(source),
+                         size=source.size,
+                         mtime_ns=source.mtime_ns,
+                         sha256=sha256,
+                         station=station,
+                         records_ingested=records_ingested,
+                         last_ingested=timezone.now())
+        ],
+        update_conflicts=True,
+        unique_fields=('path', ),
+        update_fields=fields,
+    )
@@ -0,0 +1,73 @@
+# Generated by Django 4.1.7 on 2026-10-18 04:53
+
+from django.db import migrations, models
+from django.db.models import Count, Sum
+
+
+TOTAL_FIELDS = ('temperature_max_total', 'temperature_max_count',
+                'temperature_min_total', 'temperature_min_count',
+                'precipitation_total', 'precipitation_count')
+
+
+def backfill_totals(apps, schema_editor):
+    WeatherDay = apps.get_model('history', 'WeatherDay')
+    WeatherStats = apps.get_model('history', 'WeatherStats')
+
+    stats_by_key = {(stats.station_id, stats.year): stats
+                    for stats in WeatherStats.objects.all()}
+    for r in WeatherDay.objects.values('station_id', 'date__year').annotate(
+            temperature_max_total=Sum('temperature_max'),
+            temperature_max_count=Count('temperature_max'),
+            temperature_min_total=Sum('temperature_min'),
+            temperature_min_count=Count('temperature_min'),
+            precipitation_total=Sum('precipitation'),
+            precipitation_count=Count('precipitation')).order_by():
+        stats = stats_by_key.get((r['station_id'], r['date__year']))
+        if stats is None:
+            continue
+        for field in TOTAL_FIELDS:
+            setattr(stats, field, r[field] or 0)
+
+    WeatherStats.objects.bulk_update(stats_by_key.values(), TOTAL_FIELDS,
+                                     batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('history', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='weatherstats',
+            name='precipitation_count',
+            field=models.PositiveIntegerField(default=0, help_text='number of non-null precipitation values'),
+        ),
+        migrations.AddField(
+            model_name='weatherstats',
+            name='precipitation_total',
+            field=models.BigIntegerField(default=0, help_text='sum of non-null precipitation values'),
+        ),
+        migrations.AddField(
+            model_name='weatherstats',
+            name='temperature_max_count',
+            field=models.PositiveIntegerField(default=0, help_text='number of non-null temperature_max values'),
+        ),
+        migrations.AddField(
+            model_name='weatherstats',
+            name='temperature_max_total',
+            field=models.BigIntegerField(default=0, help_text='sum of non-null temperature_max values'),
+        ),
+        migrations.AddField(
+            model_name='weatherstats',
+            name='temperature_min_count',
+            field=models.PositiveIntegerField(default=0, help_text='number of non-null temperature_min values'),
+        ),
+        migrations.AddField(
+            model_name='weatherstats',
+            name='temperature_min_total',
+            field=models.BigIntegerField(default=0, help_text='sum of non-null temperature_min values'),
+        ),
+        migrations.RunPython(backfill_totals, migrations.RunPython.noop),
+    ]
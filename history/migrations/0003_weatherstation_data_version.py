@@ -0,0 +1,23 @@
+# Generated by Django 4.1.7 on 2026-10-18 05:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('history', '0002_weatherstats_totals'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='weatherstation',
+            name='data_version',
+            field=models.PositiveBigIntegerField(default=0, help_text='incremented whenever ingestion writes data for the station'),
+        ),
+        migrations.AddField(
+            model_name='weatherstation',
+            name='last_ingested',
+            field=models.DateTimeField(help_text='when ingestion last wrote data for the station', null=True),
+        ),
+    ]
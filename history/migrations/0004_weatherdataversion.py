@@ -0,0 +1,35 @@
+# Generated by Django 4.1.7 on 2026-10-18 05:04
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('history', '0003_weatherstation_data_version'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='weatherstation',
+            name='data_version',
+        ),
+        migrations.RemoveField(
+            model_name='weatherstation',
+            name='last_ingested',
+        ),
+        migrations.CreateModel(
+            name='WeatherDataVersion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('year', models.PositiveSmallIntegerField()),
+                ('version', models.PositiveBigIntegerField(default=1, help_text='incremented whenever ingestion writes days of the year')),
+                ('last_ingested', models.DateTimeField(help_text='when ingestion last wrote days of the year')),
+                ('station', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='history.weatherstation')),
+            ],
+            options={
+                'unique_together': {('station', 'year')},
+            },
+        ),
+    ]
@@ -0,0 +1,71 @@
+# Generated by Django 4.1.7 on 2026-10-18 05:11
+
+from django.db import migrations, models
+from django.db.models import Count, Max, Min, Sum
+import django.db.models.deletion
+
+
+VALUE_FIELDS = ('temperature_max', 'temperature_min', 'precipitation')
+
+
+def backfill_month_stats(apps, schema_editor):
+    WeatherDay = apps.get_model('history', 'WeatherDay')
+    WeatherMonthStats = apps.get_model('history', 'WeatherMonthStats')
+
+    month_stats = []
+    for r in WeatherDay.objects.values(
+            'station_id', 'date__year', 'date__month').annotate(
+                **{f'{field}_total': Sum(field) for field in VALUE_FIELDS},
+                **{f'{field}_count': Count(field) for field in VALUE_FIELDS},
+                **{f'{field}_lowest': Min(field) for field in VALUE_FIELDS},
+                **{f'{field}_highest': Max(field) for field in VALUE_FIELDS},
+            ).order_by().iterator():
+        station_id = r.pop('station_id')
+        year = r.pop('date__year')
+        month = r.pop('date__month')
+        for field in VALUE_FIELDS:
+            r[f'{field}_total'] = r[f'{field}_total'] or 0
+        month_stats.append(WeatherMonthStats(station_id=station_id,
+                                             year=year,
+                                             month=month,
+                                             **r))
+        if len(month_stats) == 1000:
+            WeatherMonthStats.objects.bulk_create(month_stats)
+            month_stats = []
+    WeatherMonthStats.objects.bulk_create(month_stats)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('history', '0004_weatherdataversion'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WeatherMonthStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('year', models.PositiveSmallIntegerField()),
+                ('month', models.PositiveSmallIntegerField()),
+                ('temperature_max_total', models.BigIntegerField(default=0, help_text='sum of non-null temperature_max values')),
+                ('temperature_max_count', models.PositiveIntegerField(default=0, help_text='number of non-null temperature_max values')),
+                ('temperature_max_lowest', models.SmallIntegerField(help_text='in tenths of a degree Celsius', null=True)),
+                ('temperature_max_highest', models.SmallIntegerField(help_text='in tenths of a degree Celsius', null=True)),
+                ('temperature_min_total', models.BigIntegerField(default=0, help_text='sum of non-null temperature_min values')),
+                ('temperature_min_count', models.PositiveIntegerField(default=0, help_text='number of non-null temperature_min values')),
+                ('temperature_min_lowest', models.SmallIntegerField(help_text='in tenths of a degree Celsius', null=True)),
+                ('temperature_min_highest', models.SmallIntegerField(help_text='in tenths of a degree Celsius', null=True)),
+                ('precipitation_total', models.BigIntegerField(default=0, help_text='sum of non-null precipitation values')),
+                ('precipitation_count', models.PositiveIntegerField(default=0, help_text='number of non-null precipitation values')),
+                ('precipitation_lowest', models.PositiveSmallIntegerField(help_text='in tenths of a millimeter', null=True)),
+                ('precipitation_highest', models.PositiveSmallIntegerField(help_text='in tenths of a millimeter', null=True)),
+                ('station', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='history.weatherstation')),
+            ],
+            options={
+                'ordering': ('station__code', 'year', 'month'),
+                'unique_together': {('station', 'year', 'month')},
+            },
+        ),
+        migrations.RunPython(backfill_month_stats, migrations.RunPython.noop),
+    ]
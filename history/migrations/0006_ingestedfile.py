@@ -0,0 +1,27 @@
+# Generated by Django 4.1.7 on 2026-10-18 05:31
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('history', '0005_weathermonthstats'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IngestedFile',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('path', models.CharField(help_text='absolute path of the file', max_length=1024, unique=True)),
+                ('size', models.PositiveBigIntegerField(help_text='in bytes')),
+                ('mtime_ns', models.BigIntegerField(help_text='modification time, in nanoseconds since the epoch')),
+                ('sha256', models.CharField(help_text='hex digest of the contents', max_length=64)),
+                ('records_ingested', models.PositiveIntegerField(default=0)),
+                ('last_ingested', models.DateTimeField(help_text='when the file was last ingested')),
+                ('station', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='history.weatherstation')),
+            ],
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.1.7 on 2026-10-18 05:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('history', '0006_ingestedfile'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='weatherdataversion',
+            name='days_checksum',
+            field=models.BigIntegerField(help_text='order independent checksum of the stored days of the year, kept by ingestion to skip unchanged years', null=True),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 4.1.7 on 2026-10-18 05:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('history', '0007_weatherdataversion_days_checksum'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='ingestedfile',
+            name='path',
+            field=models.CharField(help_text='absolute path of the file, followed by ":" and the member name for files in archives', max_length=1024, unique=True),
+        ),
+        migrations.AlterField(
+            model_name='ingestedfile',
+            name='sha256',
+            field=models.CharField(help_text='hex digest of the decompressed contents', max_length=64),
+        ),
+        migrations.AlterField(
+            model_name='ingestedfile',
+            name='size',
+            field=models.PositiveBigIntegerField(help_text='in bytes, as stored on disk or in the archive'),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 4.1.7 on 2026-10-18 05:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('history', '0008_ingestedfile_archive_members'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IngestionJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('path', models.CharField(help_text='absolute path of the file or directory to ingest', max_length=1024)),
+                ('options', models.JSONField(default=dict, help_text='ingest_history options to run with')),
+                ('status', models.CharField(choices=[('queued', 'Queued'), ('running', 'Running'), ('succeeded', 'Succeeded'), ('failed', 'Failed')], db_index=True, default='queued', max_length=10)),
+                ('worker', models.CharField(blank=True, help_text='host and process id of the worker that claimed the job', max_length=255)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('started', models.DateTimeField(null=True)),
+                ('finished', models.DateTimeField(null=True)),
+                ('files_processed', models.PositiveIntegerField(default=0)),
+                ('files_unchanged', models.PositiveIntegerField(default=0, help_text='files skipped as unchanged since they were last ingested')),
+                ('records_ingested', models.PositiveBigIntegerField(default=0)),
+                ('metrics', models.JSONField(default=dict, help_text='times, queries and row counts of the ingestion so far, overall and by phase')),
+                ('error', models.TextField(blank=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 4.1.7 on 2026-10-18 06:01
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('history', '0009_ingestionjob'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='weatherday',
+            options={'ordering': ('station_id', 'date')},
+        ),
+        migrations.AlterModelOptions(
+            name='weathermonthstats',
+            options={'ordering': ('station_id', 'year', 'month')},
+        ),
+        migrations.AlterModelOptions(
+            name='weatherstats',
+            options={'ordering': ('station_id', 'year')},
+        ),
+    ]
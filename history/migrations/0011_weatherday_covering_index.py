@@ -0,0 +1,23 @@
+# Generated by Django 4.1.7 on 2026-10-18 06:11
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('history', '0010_station_id_ordering'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='weatherday',
+            name='station',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='history.weatherstation'),
+        ),
+        migrations.AddIndex(
+            model_name='weatherday',
+            index=models.Index(fields=['station', 'date', 'temperature_max', 'temperature_min', 'precipitation'], name='weatherday_station_date_cover'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.1.7 on 2026-10-18 06:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('history', '0011_weatherday_covering_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ingestionjob',
+            name='heartbeat',
+            field=models.DateTimeField(help_text='when the worker running the job last reported that it still is', null=True),
+        ),
+    ]
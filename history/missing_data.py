@@ -0,0 +1,65 @@
+from collections import Counter, defaultdict
+
+import numpy as np
+
+from history.parsing import ColumnBatch
+
+MISSING_DATA_CHOICES = ('rows', 'summary')
+DEFAULT_SAMPLE_LIMIT = 10
+VALUE_FIELDS = ('temperature_max', 'temperature_min', 'precipitation')
+
+
+class MissingDataReport:
+    """Counts the rows of a station file with missing values, by field and
+    by year, so they can be logged as one summary rather than a record per
+    row. The first sample_limit rows, or all of them if it is None, are
+    still logged individually as samples.
+    """
+
+    def __init__(self, sample_limit: int = None):
+        self.sample_limit = sample_limit
+        self.rows = 0
+        self.by_field = Counter()
+        self.by_year = defaultdict(Counter)
+
+    def add(self, missing: ColumnBatch) -> ColumnBatch:
+        """count a batch of rows with missing values, returning the ones to
+        log as samples"""
+        if self.sample_limit is None:
+            samples = missing
+        else:
+            samples = missing[:max(self.sample_limit - self.rows, 0)]
+        self.rows += len(missing)
+
+        years = missing.dates.astype('datetime64[Y]').astype(np.int64) + 1970
+        for year, count in zip(*np.unique(years, return_counts=True)):
+            self.by_year[int(year)]['rows'] += int(count)
+        for field in VALUE_FIELDS:
+            is_missing = np.ma.getmaskarray(getattr(missing, field))
+            self.by_field[field] += int(is_missing.sum())
+            for year, count in zip(
+                    *np.unique(years[is_missing], return_counts=True)):
+                self.by_year[int(year)][field] += int(count)
+        return samples
+
+    def as_dict(self) -> dict:
+        """the counts as loggable values"""
+        return {
+            'rows_with_missing_data': self.rows,
+            **{
+                f'missing_{field}': self.by_field[field]
+                for field in VALUE_FIELDS
+            },
+            'samples_logged': (self.rows if self.sample_limit is None else
+                               min(self.rows, self.sample_limit)),
+            'years': {
+                year: {
+                    'rows_with_missing_data': counts['rows'],
+                    **{
+                        f'missing_{field}': counts[field]
+                        for field in VALUE_FIELDS
+                    },
+                }
+                for year, counts in sorted(self.by_year.items())
+            },
+        }
@@ -1,3 +1,5 @@
+from decimal import Decimal, ROUND_HALF_UP
+
 from django.db import models
 
 
@@ -15,10 +17,11 @@ class WeatherStation(models.Model):
 
 class WeatherDay(models.Model):
     """one day of weather info for one station"""
+    # indexed by the (station, date) indexes below, which start with it
     station = models.ForeignKey(WeatherStation,
                                 null=False,
                                 on_delete=models.CASCADE,
-                                db_index=True)
+                                db_index=False)
     date = models.DateField(null=False, db_index=True)
     temperature_max = models.SmallIntegerField(
         null=True, help_text='in tenths of a degree Celsius')
@@ -29,7 +32,15 @@ class WeatherDay(models.Model):
 
     class Meta:
         unique_together = ('station', 'date')
-        ordering = ('station__code', 'date')
+        ordering = ('station_id', 'date')
+        indexes = [
+            # covers the day endpoints and statistics refreshes, which read
+            #  the values of date ranges of a station, so they are
+            #  answered from the index without reading the table
+            models.Index(fields=('station', 'date', 'temperature_max',
+                                 'temperature_min', 'precipitation'),
+                         name='weatherday_station_date_cover'),
+        ]
 
     def __str__(self):
         return f'WeatherDay(station={self.station.code}, date={self.date})'
@@ -56,9 +67,182 @@ class WeatherStats(models.Model):
         max_digits=7,
         decimal_places=2)
 
+    # running totals of the year's WeatherDay values, in their original
+    #  units, which let the statistics above be updated from deltas
+    temperature_max_total = models.BigIntegerField(
+        default=0, help_text='sum of non-null temperature_max values')
+    temperature_max_count = models.PositiveIntegerField(
+        default=0, help_text='number of non-null temperature_max values')
+    temperature_min_total = models.BigIntegerField(
+        default=0, help_text='sum of non-null temperature_min values')
+    temperature_min_count = models.PositiveIntegerField(
+        default=0, help_text='number of non-null temperature_min values')
+    precipitation_total = models.BigIntegerField(
+        default=0, help_text='sum of non-null precipitation values')
+    precipitation_count = models.PositiveIntegerField(
+        default=0, help_text='number of non-null precipitation values')
+
     class Meta:
         unique_together = ('station', 'year')
-        ordering = ('station__code', 'year')
+        ordering = ('station_id', 'year')
 
     def __str__(self):
         return f'WeatherStats(station={self.station.code}, year={self.year})'
+
+    def update_from_totals(self):
+        """recalculate the statistics from the running totals"""
+        self.avg_temperature_max = (to_hundredths(
+            self.temperature_max_total, self.temperature_max_count * 10)
+                                    if self.temperature_max_count else None)
+        self.avg_temperature_min = (to_hundredths(
+            self.temperature_min_total, self.temperature_min_count * 10)
+                                    if self.temperature_min_count else None)
+        self.total_precipitation = (to_hundredths(
+            self.precipitation_total, 100)
+                                    if self.precipitation_count else None)
+
+
+class WeatherMonthStats(models.Model):
+    """sums, non-null counts and extremes of a month of weather for one
+    station, in the original units, from which statistics over any run of
+    whole months can be summed without reading WeatherDay"""
+    station = models.ForeignKey(WeatherStation,
+                                null=False,
+                                on_delete=models.CASCADE,
+                                db_index=True)
+    year = models.PositiveSmallIntegerField(null=False)
+    month = models.PositiveSmallIntegerField(null=False)
+
+    temperature_max_total = models.BigIntegerField(
+        default=0, help_text='sum of non-null temperature_max values')
+    temperature_max_count = models.PositiveIntegerField(
+        default=0, help_text='number of non-null temperature_max values')
+    temperature_max_lowest = models.SmallIntegerField(
+        null=True, help_text='in tenths of a degree Celsius')
+    temperature_max_highest = models.SmallIntegerField(
+        null=True, help_text='in tenths of a degree Celsius')
+    temperature_min_total = models.BigIntegerField(
+        default=0, help_text='sum of non-null temperature_min values')
+    temperature_min_count = models.PositiveIntegerField(
+        default=0, help_text='number of non-null temperature_min values')
+    temperature_min_lowest = models.SmallIntegerField(
+        null=True, help_text='in tenths of a degree Celsius')
+    temperature_min_highest = models.SmallIntegerField(
+        null=True, help_text='in tenths of a degree Celsius')
+    precipitation_total = models.BigIntegerField(
+        default=0, help_text='sum of non-null precipitation values')
+    precipitation_count = models.PositiveIntegerField(
+        default=0, help_text='number of non-null precipitation values')
+    precipitation_lowest = models.PositiveSmallIntegerField(
+        null=True, help_text='in tenths of a millimeter')
+    precipitation_highest = models.PositiveSmallIntegerField(
+        null=True, help_text='in tenths of a millimeter')
+
+    class Meta:
+        unique_together = ('station', 'year', 'month')
+        ordering = ('station_id', 'year', 'month')
+
+    def __str__(self):
+        return (f'WeatherMonthStats(station={self.station.code}, '
+                f'year={self.year}, month={self.month})')
+
+
+class WeatherDataVersion(models.Model):
+    """how many times ingestion has written a year of one station's data,
+    which lets API responses covering it be cached until it changes"""
+    station = models.ForeignKey(WeatherStation,
+                                null=False,
+                                on_delete=models.CASCADE,
+                                db_index=True)
+    year = models.PositiveSmallIntegerField(null=False)
+    version = models.PositiveBigIntegerField(
+        default=1,
+        help_text='incremented whenever ingestion writes days of the year')
+    last_ingested = models.DateTimeField(
+        null=False, help_text='when ingestion last wrote days of the year')
+    days_checksum = models.BigIntegerField(
+        null=True,
+        help_text='order independent checksum of the stored days of the '
+        'year, kept by ingestion to skip unchanged years')
+
+    class Meta:
+        unique_together = ('station', 'year')
+
+    def __str__(self):
+        return (f'WeatherDataVersion(station={self.station.code}, '
+                f'year={self.year}, version={self.version})')
+
+
+class IngestedFile(models.Model):
+    """the fingerprint of a station file as of its last ingestion, which
+    lets later runs skip the file while it is unchanged"""
+    path = models.CharField(max_length=1024,
+                            unique=True,
+                            help_text='absolute path of the file, followed '
+                            'by ":" and the member name for files in '
+                            'archives')
+    size = models.PositiveBigIntegerField(
+        help_text='in bytes, as stored on disk or in the archive')
+    mtime_ns = models.BigIntegerField(
+        help_text='modification time, in nanoseconds since the epoch')
+    sha256 = models.CharField(
+        max_length=64, help_text='hex digest of the decompressed contents')
+    station = models.ForeignKey(WeatherStation,
+                                null=False,
+                                on_delete=models.CASCADE,
+                                db_index=True)
+    records_ingested = models.PositiveIntegerField(default=0)
+    last_ingested = models.DateTimeField(
+        null=False, help_text='when the file was last ingested')
+
+    def __str__(self):
+        return f'IngestedFile(path={self.path})'
+
+
+class IngestionJob(models.Model):
+    """an ingestion of a path requested through the API, run by the
+    run_ingestion_jobs command, with its progress as it runs"""
+
+    class Status(models.TextChoices):
+        QUEUED = 'queued'
+        RUNNING = 'running'
+        SUCCEEDED = 'succeeded'
+        FAILED = 'failed'
+
+    path = models.CharField(max_length=1024,
+                            help_text='absolute path of the file or '
+                            'directory to ingest')
+    options = models.JSONField(
+        default=dict, help_text='ingest_history options to run with')
+    status = models.CharField(max_length=10,
+                              choices=Status.choices,
+                              default=Status.QUEUED,
+                              db_index=True)
+    worker = models.CharField(max_length=255,
+                              blank=True,
+                              help_text='host and process id of the worker '
+                              'that claimed the job')
+    created = models.DateTimeField(auto_now_add=True)
+    started = models.DateTimeField(null=True)
+    heartbeat = models.DateTimeField(
+        null=True, help_text='when the worker running the job last '
+        'reported that it still is')
+    finished = models.DateTimeField(null=True)
+    files_processed = models.PositiveIntegerField(default=0)
+    files_unchanged = models.PositiveIntegerField(
+        default=0, help_text='files skipped as unchanged since they were '
+        'last ingested')
+    records_ingested = models.PositiveBigIntegerField(default=0)
+    metrics = models.JSONField(
+        default=dict, help_text='times, queries and row counts of the '
+        'ingestion so far, overall and by phase')
+    error = models.TextField(blank=True)
+
+    def __str__(self):
+        return f'IngestionJob(id={self.pk}, status={self.status})'
+
+
+def to_hundredths(numerator, denominator) -> Decimal:
+    """exact division rounded half away from zero to 2 decimal places"""
+    return (Decimal(numerator) / denominator).quantize(Decimal('0.01'),
+                                                       ROUND_HALF_UP)
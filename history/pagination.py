@@ -0,0 +1,189 @@
+import base64
+import binascii
+import json
+from collections import OrderedDict
+
+import coreapi
+import coreschema
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import LimitOffsetPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+def encode_cursor(position, reverse: bool) -> str:
+    """an opaque token for a position in the keyset ordering"""
+    payload = json.dumps({'p': position, 'r': reverse}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode()
+
+
+def decode_cursor(token: str):
+    """the (position, reverse) pair for a token from encode_cursor"""
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(token.encode()))
+        if isinstance(payload['p'], list):
+            return payload['p'], bool(payload['r'])
+    except (binascii.Error, ValueError, KeyError, TypeError):
+        pass
+    raise NotFound('Invalid cursor')
+
+
+def keyset_filter(fields, position, reverse: bool) -> Q:
+    """rows strictly after (or before, if reverse) position in the
+    lexicographic ordering of fields"""
+    lookup = 'lt' if reverse else 'gt'
+    condition = Q()
+    for i, field in enumerate(fields):
+        condition |= Q(**dict(zip(fields[:i], position[:i])),
+                       **{f'{field}__{lookup}': position[i]})
+    return condition
+
+
+class OptionalCursorPagination(LimitOffsetPagination):
+    """limit/offset pagination, or keyset pagination when the request
+    includes a cursor param (empty for the first page).
+
+    Keyset pages are ordered by the view's keyset_ordering fields, which
+    must be unique together, and are fetched with a range predicate on
+    them instead of an OFFSET scan. No total count is returned, so deep
+    pages cost the same as the first one.
+    """
+    cursor_query_param = 'cursor'
+    cursor_query_description = (
+        'Opt into cursor pagination. Leave empty for the first page, then '
+        'follow the next and previous links. Cannot be combined with '
+        'offset, and no count is returned.')
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if self.cursor_query_param not in request.query_params:
+            self.use_cursor = False
+            return super().paginate_queryset(queryset, request, view)
+
+        self.use_cursor = True
+        self.limit = self.get_limit(request)
+        self.request = request
+        self.fields = view.keyset_ordering
+
+        token = request.query_params[self.cursor_query_param]
+        position, reverse = decode_cursor(token) if token else (None, False)
+        if position is not None and len(position) != len(self.fields):
+            raise NotFound('Invalid cursor')
+
+        if position is not None:
+            try:
+                queryset = queryset.filter(
+                    keyset_filter(self.fields, position, reverse))
+            except (ValidationError, ValueError, TypeError):
+                raise NotFound('Invalid cursor')
+        queryset = queryset.order_by(*(f'-{field}' if reverse else field
+                                       for field in self.fields))
+
+        # one extra row tells us whether there is another page
+        results = list(queryset[:self.limit + 1])
+        has_more = len(results) > self.limit
+        results = results[:self.limit]
+        if reverse:
+            results.reverse()
+
+        self.next_position = self.previous_position = None
+        if results:
+            if has_more or reverse:
+                self.next_position = self.get_position(results[-1])
+            if (has_more and reverse) or (position is not None
+                                          and not reverse):
+                self.previous_position = self.get_position(results[0])
+        elif position is not None:
+            # an empty page past either end can still lead back
+            if reverse:
+                self.next_position = position
+            else:
+                self.previous_position = position
+        return results
+
+    def get_position(self, instance) -> list:
+        """the keyset_ordering values of a model instance, or a row from
+        QuerySet.values(), as JSON-ready values"""
+        position = []
+        for field in self.fields:
+            if isinstance(instance, dict):
+                value = instance[field]
+            else:
+                value = instance
+                for attribute in field.split('__'):
+                    value = getattr(value, attribute)
+            position.append(
+                value.isoformat() if hasattr(value, 'isoformat') else value)
+        return position
+
+    def get_cursor_link(self, position, reverse: bool):
+        if position is None:
+            return None
+        url = self.request.build_absolute_uri()
+        url = replace_query_param(url, self.limit_query_param, self.limit)
+        url = remove_query_param(url, self.offset_query_param)
+        return replace_query_param(url, self.cursor_query_param,
+                                   encode_cursor(position, reverse))
+
+    def get_paginated_response(self, data):
+        if not self.use_cursor:
+            return super().get_paginated_response(data)
+        return Response(
+            OrderedDict([
+                ('next', self.get_cursor_link(self.next_position, False)),
+                ('previous', self.get_cursor_link(self.previous_position,
+                                                  True)),
+                ('results', data),
+            ]))
+
+    def get_schema_fields(self, view):
+        return super().get_schema_fields(view) + [
+            coreapi.Field(
+                name=self.cursor_query_param,
+                required=False,
+                location='query',
+                schema=coreschema.String(
+                    title='Cursor',
+                    description=self.cursor_query_description))
+        ]
+
+    def get_schema_operation_parameters(self, view):
+        return super().get_schema_operation_parameters(view) + [{
+            'name': self.cursor_query_param,
+            'required': False,
+            'in': 'query',
+            'description': self.cursor_query_description,
+            'schema': {
+                'type': 'string',
+            },
+        }]
+
+
+class AsyncLimitOffsetPagination(LimitOffsetPagination):
+    """LimitOffsetPagination for the async views, which counts and reads a
+    page with the async ORM"""
+
+    async def apaginate_queryset(self, queryset, request):
+        self.request = request
+        self.limit = self.get_limit(request)
+        if self.limit is None:
+            return None
+
+        self.offset = self.get_offset(request)
+        self.count = await queryset.acount()
+        if self.count == 0 or self.offset > self.count:
+            return []
+        return [
+            row async for row in queryset[self.offset:self.offset +
+                                          self.limit]
+        ]
+
+    def get_paginated_data(self, data) -> OrderedDict:
+        """the body of get_paginated_response"""
+        return OrderedDict([
+            ('count', self.count),
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data),
+        ])
@@ -0,0 +1,194 @@
+import datetime
+from collections import Counter
+from collections.abc import Iterable, Iterator
+from dataclasses import dataclass, fields
+
+import numpy as np
+
+MISSING_VALUE = -9999
+NUM_COLUMNS = 4
+DEFAULT_CHUNK_SIZE = 4 * 1024 * 1024
+DEFAULT_BATCH_SIZE = 5000
+
+# days between date.min (ordinal 1) and the numpy datetime64 epoch
+EPOCH_ORDINAL = datetime.date(1970, 1, 1).toordinal()
+
+
+@dataclass(frozen=True)
+class ColumnBatch:
+    """a block of parsed station rows stored as parallel columns.
+
+    date_ordinal holds proleptic Gregorian ordinals (date.toordinal()), the
+    value columns are masked arrays where -9999 in the file is masked out.
+    """
+    date_ordinal: np.ndarray
+    temperature_max: np.ma.MaskedArray
+    temperature_min: np.ma.MaskedArray
+    precipitation: np.ma.MaskedArray
+
+    def __len__(self):
+        return len(self.date_ordinal)
+
+    def __getitem__(self, item):
+        return ColumnBatch(*(column[item] for column in self.columns()))
+
+    def columns(self) -> tuple:
+        return tuple(getattr(self, f.name) for f in fields(self))
+
+    @property
+    def dates(self) -> np.ndarray:
+        """the date column as datetime64[D] values"""
+        return (self.date_ordinal - EPOCH_ORDINAL).astype('datetime64[D]')
+
+    def years(self) -> set[int]:
+        """the distinct calendar years present in the batch"""
+        return set(
+            np.unique(self.dates.astype('datetime64[Y]').astype(int) +
+                      1970).tolist())
+
+    def months(self) -> set[tuple[int, int]]:
+        """the distinct (year, month) pairs present in the batch"""
+        month_numbers = np.unique(
+            self.dates.astype('datetime64[M]').astype(int)).tolist()
+        return {(month // 12 + 1970, month % 12 + 1)
+                for month in month_numbers}
+
+    def missing(self) -> np.ndarray:
+        """boolean array flagging rows with at least one missing value"""
+        return (np.ma.getmaskarray(self.temperature_max)
+                | np.ma.getmaskarray(self.temperature_min)
+                | np.ma.getmaskarray(self.precipitation))
+
+    def iter_rows(self) -> Iterator[tuple]:
+        """yield (date, temperature_max, temperature_min, precipitation)
+        with python values and None for missing data"""
+        yield from zip(self.dates.tolist(), self.temperature_max.tolist(),
+                       self.temperature_min.tolist(),
+                       self.precipitation.tolist())
+
+    @classmethod
+    def from_rows(cls, rows: Iterable[tuple]):
+        """build a batch from (date, temperature_max, temperature_min,
+        precipitation) tuples, the inverse of iter_rows"""
+        rows = list(rows)
+        if not rows:
+            return cls(np.empty(0, dtype=np.int64),
+                       *(np.ma.masked_array(np.empty(0, dtype=np.int64))
+                         for _ in range(NUM_COLUMNS - 1)))
+        dates, *value_columns = zip(*rows)
+        return cls(
+            np.array([date.toordinal() for date in dates], dtype=np.int64),
+            *(np.ma.masked_equal(
+                np.array([
+                    MISSING_VALUE if value is None else value
+                    for value in column
+                ],
+                         dtype=np.int64), MISSING_VALUE)
+              for column in value_columns))
+
+    @classmethod
+    def concatenate(cls, batches):
+        columns = zip(*(batch.columns() for batch in batches))
+        return cls(
+            np.concatenate(next(columns)),
+            *(np.ma.concatenate(column) for column in columns))
+
+
+def decode_dates(raw_dates: np.ndarray) -> np.ndarray:
+    """convert YYYYMMDD integers to date ordinals, vectorized.
+
+    Raises ValueError on impossible dates, like strptime would.
+    """
+    years = raw_dates // 10000
+    months = raw_dates // 100 % 100
+    days = raw_dates % 100
+    month_starts = ((years - 1970).astype('datetime64[Y]').astype(
+        'datetime64[M]') + (months - 1))
+    dates = month_starts.astype('datetime64[D]') + (days - 1)
+    valid = ((months >= 1) & (months <= 12) & (days >= 1)
+             & (dates.astype('datetime64[M]') == month_starts))
+    if not valid.all():
+        raise ValueError(
+            f'invalid date in station file: {raw_dates[~valid][0]}')
+    return dates.astype(np.int64) + EPOCH_ORDINAL
+
+
+def decode_chunk(chunk: bytes) -> ColumnBatch:
+    """decode a block of complete lines into a ColumnBatch.
+
+    Raises ValueError unless every line holds exactly NUM_COLUMNS integers.
+    """
+    num_lines = chunk.count(b'\n') + (not chunk.endswith(b'\n'))
+    try:
+        values = np.fromstring(chunk, dtype=np.int64, sep=' ')
+    except ValueError:
+        values = None
+    # older numpy stops at the first value it cannot parse, with only a
+    #  DeprecationWarning, so the count catches the rows it dropped
+    if values is None or values.size != num_lines * NUM_COLUMNS:
+        raise ValueError('station file rows must have exactly '
+                         f'{NUM_COLUMNS} integer columns')
+    values = values.reshape(-1, NUM_COLUMNS)
+    return ColumnBatch(
+        decode_dates(values[:, 0]),
+        *(np.ma.masked_equal(values[:, i], MISSING_VALUE)
+          for i in range(1, NUM_COLUMNS)))
+
+
+def iter_chunks(file, chunk_size: int) -> Iterator[bytes]:
+    """yield blocks of a binary file which always end on a line boundary"""
+    remainder = b''
+    while block := file.read(chunk_size):
+        block = remainder + block
+        end = block.rfind(b'\n') + 1
+        if not end:
+            remainder = block
+            continue
+        remainder = block[end:]
+        yield block[:end]
+    if remainder.strip():
+        yield remainder
+
+
+def iter_column_batches(file,
+                        batch_size: int = DEFAULT_BATCH_SIZE,
+                        chunk_size: int = DEFAULT_CHUNK_SIZE,
+                        counts: Counter = None) -> Iterator[ColumnBatch]:
+    """decode a station file into fixed-size ColumnBatches.
+
+    Only the first row for any date is kept. Memory stays bounded by the
+    chunk size plus the set of distinct dates seen so far. If given,
+    counts is incremented by the bytes_read, rows_parsed and
+    rows_duplicate (rows skipped for an already seen date) of the file.
+    """
+    if counts is None:
+        counts = Counter()
+    seen = np.empty(0, dtype=np.int64)
+    pending = None
+
+    for chunk in iter_chunks(file, chunk_size):
+        counts['bytes_read'] += len(chunk)
+        batch = decode_chunk(chunk)
+        if not len(batch):
+            continue
+        counts['rows_parsed'] += len(batch)
+
+        # keep the first occurrence of every date in the chunk that was not
+        #  already seen in an earlier chunk
+        first_indexes = np.unique(batch.date_ordinal, return_index=True)[1]
+        keep = np.zeros(len(batch), dtype=bool)
+        keep[first_indexes] = True
+        keep &= ~np.isin(batch.date_ordinal, seen)
+        batch = batch[keep]
+        counts['rows_duplicate'] += len(keep) - len(batch)
+        seen = np.union1d(seen, batch.date_ordinal)
+
+        if pending is not None:
+            batch = ColumnBatch.concatenate((pending, batch))
+        num_full = len(batch) - len(batch) % batch_size
+        for start in range(0, num_full, batch_size):
+            yield batch[start:start + batch_size]
+        pending = batch[num_full:]
+
+    if pending is not None and len(pending):
+        yield pending
@@ -0,0 +1,48 @@
+import csv
+import io
+import json
+
+from rest_framework.renderers import BaseRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+
+def as_rows(data) -> list:
+    """the data of a response as a list of rows, a single object being one
+    row"""
+    if data is None:
+        return []
+    if isinstance(data, dict):
+        return [data]
+    return list(data)
+
+
+class CSVRenderer(BaseRenderer):
+    """renders a list of flat objects as CSV with a header row of the first
+    one's fields. The export view streams its rows itself"""
+    media_type = 'text/csv'
+    format = 'csv'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        rows = as_rows(data)
+        if not rows:
+            return b''
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, fieldnames=list(rows[0]),
+                                extrasaction='ignore')
+        writer.writeheader()
+        writer.writerows(rows)
+        return buffer.getvalue().encode(self.charset)
+
+
+class NDJSONRenderer(BaseRenderer):
+    """renders a list of objects as newline delimited JSON. The export view
+    streams its rows itself"""
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return ''.join(
+            json.dumps(row, cls=JSONEncoder) + '\n'
+            for row in as_rows(data)).encode(self.charset)
@@ -1,6 +1,18 @@
+import datetime
+from itertools import groupby
+from operator import itemgetter
+from pathlib import Path
+
+from django.conf import settings
 from rest_framework import serializers
 
-from history.models import WeatherDay, WeatherStats, WeatherStation
+from history.aggregation import GROUPINGS
+from history.ingestion import STATS_CHOICES
+from history.missing_data import MISSING_DATA_CHOICES
+from history.models import (IngestionJob, WeatherDay, WeatherStats,
+                            WeatherStation)
+from history.stations import station_cache
+from history.statistics import TOTAL_FIELDS, sum_month_totals
 
 
 class WeatherStationSerializer(serializers.ModelSerializer):
@@ -28,3 +40,313 @@ class WeatherStatsSerializer(serializers.ModelSerializer):
                   'avg_temperature_min', 'total_precipitation')
 
     station = WeatherStationSerializer()
+
+
+class ValuesSerializer:
+    """A read-only stand-in for a ModelSerializer on list endpoints.
+
+    Rows come from QuerySet.values(*values_fields) and to_representation
+    builds the same JSON as the matching ModelSerializer directly, rather
+    than running a serializer field per value of every row.
+    """
+    values_fields = ()
+
+    def __init__(self, rows):
+        self.rows = rows
+
+    @classmethod
+    def values(cls, queryset):
+        """the rows to serialize from a filtered queryset"""
+        return queryset.values(*cls.values_fields)
+
+    @property
+    def data(self):
+        return [self.to_representation(row) for row in self.rows]
+
+    def to_representation(self, row):
+        raise NotImplementedError
+
+
+class StationValuesSerializer(ValuesSerializer):
+    """A ValuesSerializer for rows with a station_id rather than the
+    station's code, so the query need not join the station table. Codes
+    are looked up in the station code cache and set on each row as
+    station__code."""
+
+    @property
+    def data(self):
+        rows = list(self.rows)
+        codes = station_cache.codes({row['station_id'] for row in rows})
+        for row in rows:
+            row['station__code'] = codes.get(row['station_id'])
+        return [self.to_representation(row) for row in rows]
+
+
+def decimal_to_string(value):
+    """match DRF's default rendering of DecimalFields"""
+    return None if value is None else f'{value:f}'
+
+
+class WeatherDayValuesSerializer(StationValuesSerializer):
+    """same output as WeatherDaySerializer"""
+    values_fields = ('station_id', 'date', 'temperature_max',
+                     'temperature_min', 'precipitation')
+    # the export streams rows of any number of stations, so joins the
+    #  station table for each row's code instead
+    export_fields = ('station__code', 'date', 'temperature_max',
+                     'temperature_min', 'precipitation')
+
+    def to_representation(self, row):
+        return {
+            'station': {
+                'code': row['station__code']
+            },
+            'date': row['date'].isoformat(),
+            'temperature_max': row['temperature_max'],
+            'temperature_min': row['temperature_min'],
+            'precipitation': row['precipitation'],
+        }
+
+
+class WeatherStatsValuesSerializer(StationValuesSerializer):
+    """same output as WeatherStatsSerializer"""
+    values_fields = ('station_id', 'year', 'avg_temperature_max',
+                     'avg_temperature_min', 'total_precipitation')
+
+    def to_representation(self, row):
+        return {
+            'station': {
+                'code': row['station__code']
+            },
+            'year': row['year'],
+            'avg_temperature_max': decimal_to_string(
+                row['avg_temperature_max']),
+            'avg_temperature_min': decimal_to_string(
+                row['avg_temperature_min']),
+            'total_precipitation': decimal_to_string(
+                row['total_precipitation']),
+        }
+
+
+class WeatherStatsFromMonthsValuesSerializer(StationValuesSerializer):
+    """same output as WeatherStatsSerializer, with the statistics
+    recomputed from the totals of WeatherMonthStats rows"""
+    values_fields = ('station_id', 'year') + TOTAL_FIELDS
+
+    @classmethod
+    def values(cls, queryset):
+        return sum_month_totals(queryset,
+                                'station_id').order_by('station_id', 'year')
+
+    def to_representation(self, row):
+        stats = WeatherStats(year=row['year'],
+                             **{field: row[field]
+                                for field in TOTAL_FIELDS})
+        stats.update_from_totals()
+        return {
+            'station': {
+                'code': row['station__code']
+            },
+            'year': row['year'],
+            'avg_temperature_max': decimal_to_string(
+                stats.avg_temperature_max),
+            'avg_temperature_min': decimal_to_string(
+                stats.avg_temperature_min),
+            'total_precipitation': decimal_to_string(
+                stats.total_precipitation),
+        }
+
+
+class WeatherAggregateQuerySerializer(serializers.Serializer):
+    """query params of the aggregation endpoint"""
+    station__code = serializers.ListField(
+        child=serializers.CharField(),
+        min_length=1,
+        help_text='Code of a station to aggregate. Can be repeated.')
+    date__gte = serializers.DateField(
+        required=False,
+        help_text='First day to aggregate. Defaults to the first stored day '
+        'of the stations.')
+    date__lte = serializers.DateField(
+        required=False,
+        help_text='Last day to aggregate. Defaults to the last stored day '
+        'of the stations.')
+    group_by = serializers.ChoiceField(
+        choices=GROUPINGS,
+        default='year',
+        help_text='"season" uses meteorological seasons, with December in '
+        'the following year\'s winter. "window" splits the range into '
+        'window_days long windows.')
+    window_days = serializers.IntegerField(
+        required=False,
+        min_value=1,
+        help_text='Length of each window when grouping by window.')
+    months = serializers.ListField(
+        child=serializers.IntegerField(min_value=1, max_value=12),
+        required=False,
+        help_text='Only aggregate days in these months, 1 to 12. Can be '
+        'repeated.')
+
+    def validate(self, data):
+        if (data.get('date__gte') and data.get('date__lte')
+                and data['date__gte'] > data['date__lte']):
+            raise serializers.ValidationError(
+                'date__gte must not be after date__lte')
+        if data['group_by'] == 'window' and 'window_days' not in data:
+            raise serializers.ValidationError(
+                'window_days is required when grouping by window')
+        return data
+
+
+class MeasureAggregateSerializer(serializers.Serializer):
+    avg = serializers.DecimalField(max_digits=12,
+                                   decimal_places=2,
+                                   allow_null=True)
+    min = serializers.DecimalField(max_digits=12,
+                                   decimal_places=2,
+                                   allow_null=True)
+    max = serializers.DecimalField(max_digits=12,
+                                   decimal_places=2,
+                                   allow_null=True)
+    sum = serializers.DecimalField(max_digits=12,
+                                   decimal_places=2,
+                                   allow_null=True)
+    count = serializers.IntegerField(help_text='number of non-null values')
+
+
+class WeatherAggregateSerializer(serializers.Serializer):
+    station = WeatherStationSerializer()
+    group = serializers.CharField(
+        help_text='YYYY, YYYY-MM, YYYY-season, the first day of a window, '
+        'or "total"')
+    first_date = serializers.DateField()
+    last_date = serializers.DateField()
+    temperature_max = MeasureAggregateSerializer(
+        help_text='in degrees Celsius')
+    temperature_min = MeasureAggregateSerializer(
+        help_text='in degrees Celsius')
+    precipitation = MeasureAggregateSerializer(help_text='in centimeters')
+
+
+class CommaSeparatedListField(serializers.ListField):
+    """a ListField which also accepts comma separated strings, like
+    django-filter's __in lookups, in query params, form data or JSON"""
+
+    def to_internal_value(self, data):
+        if isinstance(data, str):
+            data = [data]
+        if isinstance(data, list) and all(
+                isinstance(item, str) for item in data):
+            data = [
+                value for item in data for value in item.split(',') if value
+            ]
+        return super().to_internal_value(data)
+
+
+class WeatherDayBatchQuerySerializer(serializers.Serializer):
+    """filters of the batch endpoint, from query params or a POST body"""
+    station__code__in = CommaSeparatedListField(
+        child=serializers.CharField(),
+        min_length=1,
+        help_text='Codes of the stations to return, comma separated or '
+        'repeated, or a JSON list in a POST body.')
+    date = serializers.DateField(required=False)
+    date__gte = serializers.DateField(required=False)
+    date__lte = serializers.DateField(required=False)
+    year__gte = serializers.IntegerField(required=False,
+                                         min_value=1,
+                                         max_value=9998)
+    year__lte = serializers.IntegerField(required=False,
+                                         min_value=1,
+                                         max_value=9998)
+
+    def validate(self, data):
+        """reduce the date and year filters to a first and last date"""
+        first_dates = [data.get('date'), data.get('date__gte')]
+        last_dates = [data.get('date'), data.get('date__lte')]
+        if 'year__gte' in data:
+            first_dates.append(datetime.date(data['year__gte'], 1, 1))
+        if 'year__lte' in data:
+            last_dates.append(datetime.date(data['year__lte'], 12, 31))
+        first_dates = [date for date in first_dates if date is not None]
+        last_dates = [date for date in last_dates if date is not None]
+        return {
+            'station_codes': list(dict.fromkeys(data['station__code__in'])),
+            'first_date': max(first_dates, default=None),
+            'last_date': min(last_dates, default=None),
+        }
+
+
+class WeatherDayBatchValuesSerializer(ValuesSerializer):
+    """days of weather grouped by station, from rows ordered by station
+    then date, with the station codes from the station code cache"""
+    values_fields = ('station_id', 'date', 'temperature_max',
+                     'temperature_min', 'precipitation')
+
+    @property
+    def data(self):
+        rows = list(self.rows)
+        codes = station_cache.codes({row['station_id'] for row in rows})
+        return [{
+            'station': {
+                'code': codes.get(station_id)
+            },
+            'days': [self.to_representation(row) for row in rows],
+        } for station_id, rows in groupby(rows,
+                                          key=itemgetter('station_id'))]
+
+    def to_representation(self, row):
+        return {
+            'date': row['date'].isoformat(),
+            'temperature_max': row['temperature_max'],
+            'temperature_min': row['temperature_min'],
+            'precipitation': row['precipitation'],
+        }
+
+
+class WeatherDayOfStationSerializer(serializers.ModelSerializer):
+
+    class Meta:
+        model = WeatherDay
+        fields = ('date', 'temperature_max', 'temperature_min',
+                  'precipitation')
+
+
+class WeatherDayBatchSerializer(serializers.Serializer):
+    """describes the output of WeatherDayBatchValuesSerializer for the API
+    docs"""
+    station = WeatherStationSerializer()
+    days = WeatherDayOfStationSerializer(many=True)
+
+
+class IngestionJobRequestSerializer(serializers.Serializer):
+    """an ingestion to queue, with the ingest_history options it may use"""
+    path = serializers.CharField(
+        help_text='File or directory to ingest, relative to the server\'s '
+        'ingestion root.')
+    recursive = serializers.BooleanField(default=False)
+    force = serializers.BooleanField(default=False)
+    stats = serializers.ChoiceField(STATS_CHOICES, default='incremental')
+    missing_data = serializers.ChoiceField(MISSING_DATA_CHOICES,
+                                           default='rows')
+
+    def validate_path(self, value):
+        """the absolute path, which must exist inside the ingestion root"""
+        root = Path(settings.WEATHER_INGESTION_ROOT).resolve()
+        path = (root / value).resolve()
+        if not path.is_relative_to(root):
+            raise serializers.ValidationError(
+                'must be inside the ingestion root')
+        if not path.exists():
+            raise serializers.ValidationError('does not exist')
+        return str(path)
+
+
+class IngestionJobSerializer(serializers.ModelSerializer):
+
+    class Meta:
+        model = IngestionJob
+        fields = ('id', 'path', 'options', 'status', 'worker', 'created',
+                  'started', 'heartbeat', 'finished', 'files_processed',
+                  'files_unchanged', 'records_ingested', 'metrics', 'error')
+        read_only_fields = fields
@@ -0,0 +1,204 @@
+import datetime
+import os
+import tempfile
+from collections.abc import Iterable, Iterator
+from dataclasses import dataclass
+from itertools import islice
+from pathlib import Path
+
+import numpy as np
+from django.conf import settings
+
+from history.models import WeatherDay
+from history.parsing import (DEFAULT_BATCH_SIZE, EPOCH_ORDINAL, MISSING_VALUE,
+                             ColumnBatch)
+
+SERIES_FIELDS = ('temperature_max', 'temperature_min', 'precipitation')
+SERIES_SUFFIX = '.series'
+MAGIC = b'WXDS'
+FORMAT_VERSION = 1
+HEADER = np.dtype([
+    ('magic', 'S4'),
+    ('format_version', '<u4'),
+    ('first_ordinal', '<i8'),
+    ('days', '<i8'),
+])
+
+
+@dataclass(frozen=True)
+class StationSeries:
+    """a station's days as int16 columns, one row per field, indexed by
+    days since first_ordinal. Days without a value hold MISSING_VALUE."""
+    first_ordinal: int
+    columns: np.ndarray
+
+    @property
+    def days(self) -> int:
+        return self.columns.shape[1]
+
+    @property
+    def last_ordinal(self) -> int:
+        return self.first_ordinal + self.days - 1
+
+    def window(self, first_ordinal: int, last_ordinal: int) -> np.ndarray:
+        """a copy of the columns from first_ordinal to last_ordinal
+        inclusive, with MISSING_VALUE for days outside the series"""
+        window = np.full(
+            (len(SERIES_FIELDS), last_ordinal - first_ordinal + 1),
+            MISSING_VALUE,
+            dtype=np.int16)
+        start = max(first_ordinal, self.first_ordinal)
+        end = min(last_ordinal, self.last_ordinal)
+        if start <= end:
+            window[:, start - first_ordinal:end - first_ordinal + 1] = (
+                self.columns[:, start - self.first_ordinal:end -
+                             self.first_ordinal + 1])
+        return window
+
+
+def get_series_dir() -> Path:
+    return Path(settings.WEATHER_SERIES_DIR)
+
+
+def series_path(station_code: str) -> Path:
+    if not station_code or Path(station_code).name != station_code:
+        raise ValueError(f'invalid station code: {station_code!r}')
+    return get_series_dir() / f'{station_code}{SERIES_SUFFIX}'
+
+
+def read_series(station_code: str):
+    """the stored StationSeries of a station, memory-mapped read only, or
+    None if nothing has been stored for it"""
+    path = series_path(station_code)
+    try:
+        header = np.fromfile(path, dtype=HEADER, count=1)
+    except FileNotFoundError:
+        return None
+    if (len(header) != 1 or header['magic'][0] != MAGIC
+            or header['format_version'][0] != FORMAT_VERSION):
+        raise ValueError(f'{path} is not a weather series file')
+
+    first_ordinal, days = int(header['first_ordinal'][0]), int(
+        header['days'][0])
+    return StationSeries(
+        first_ordinal,
+        np.memmap(path,
+                  dtype=np.int16,
+                  mode='r',
+                  offset=HEADER.itemsize,
+                  shape=(len(SERIES_FIELDS), days)))
+
+
+def write_series(station_code: str, batch: ColumnBatch):
+    """merge a batch of a station's days into its stored series, replacing
+    the values already stored for those days"""
+    if not len(batch):
+        return
+    first_ordinal, columns = covering_columns(
+        station_code, int(batch.date_ordinal.min()),
+        int(batch.date_ordinal.max()))
+    fill_columns(columns, first_ordinal, batch)
+    save_columns(station_code, first_ordinal, columns)
+
+
+def write_series_from_days(station, first_ordinal: int, last_ordinal: int,
+                           chunk_size: int = DEFAULT_BATCH_SIZE):
+    """replace the days of a station's stored series from first_ordinal to
+    last_ordinal inclusive with its stored WeatherDay rows, read chunk_size
+    at a time"""
+    series_first_ordinal, columns = covering_columns(station.code,
+                                                     first_ordinal,
+                                                     last_ordinal)
+    columns[:, first_ordinal - series_first_ordinal:last_ordinal -
+            series_first_ordinal + 1] = MISSING_VALUE
+    rows = WeatherDay.objects.filter(
+        station=station,
+        date__gte=datetime.date.fromordinal(first_ordinal),
+        date__lte=datetime.date.fromordinal(last_ordinal)).values_list(
+            'date', *SERIES_FIELDS).order_by().iterator(chunk_size=chunk_size)
+    while batch := ColumnBatch.from_rows(islice(rows, chunk_size)):
+        fill_columns(columns, series_first_ordinal, batch)
+    save_columns(station.code, series_first_ordinal, columns)
+
+
+def covering_columns(station_code: str, first_ordinal: int,
+                     last_ordinal: int) -> tuple[int, np.ndarray]:
+    """the first ordinal and a copy of the columns of a station's stored
+    series, extended to cover first_ordinal to last_ordinal"""
+    existing = read_series(station_code)
+    if existing is None:
+        return first_ordinal, np.full(
+            (len(SERIES_FIELDS), last_ordinal - first_ordinal + 1),
+            MISSING_VALUE,
+            dtype=np.int16)
+    first_ordinal = min(first_ordinal, existing.first_ordinal)
+    last_ordinal = max(last_ordinal, existing.last_ordinal)
+    return first_ordinal, existing.window(first_ordinal, last_ordinal)
+
+
+def fill_columns(columns: np.ndarray, first_ordinal: int,
+                 batch: ColumnBatch):
+    offsets = batch.date_ordinal - first_ordinal
+    for row, field in enumerate(SERIES_FIELDS):
+        columns[row, offsets] = getattr(batch, field).filled(MISSING_VALUE)
+
+
+def save_columns(station_code: str, first_ordinal: int, columns: np.ndarray):
+    header = np.array([(MAGIC, FORMAT_VERSION, first_ordinal,
+                        columns.shape[1])],
+                      dtype=HEADER)
+    path = series_path(station_code)
+    path.parent.mkdir(parents=True, exist_ok=True)
+
+    # written beside the old file and swapped in, so readers, including
+    #  ones with the old file mapped, never see a partial series
+    fd, temporary_path = tempfile.mkstemp(dir=path.parent,
+                                          suffix=SERIES_SUFFIX + '.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            header.tofile(f)
+            columns.astype('<i2', copy=False).tofile(f)
+        os.replace(temporary_path, path)
+    except BaseException:
+        os.unlink(temporary_path)
+        raise
+
+
+def delete_series(station_code: str):
+    series_path(station_code).unlink(missing_ok=True)
+
+
+def ordinal_to_datetime64(ordinals) -> np.ndarray:
+    return (np.asarray(ordinals) - EPOCH_ORDINAL).astype('datetime64[D]')
+
+
+class SeriesRecorder:
+    """notes the range of dates of a station file's batches as they are
+    written, so the station's stored series can be updated from the
+    database once the file's transaction has committed, without keeping
+    the batches"""
+
+    def __init__(self, station):
+        self.station = station
+        self.first_ordinal = None
+        self.last_ordinal = None
+
+    def track(self, batches: Iterable[ColumnBatch]) -> Iterator[ColumnBatch]:
+        for batch in batches:
+            if len(batch):
+                first_ordinal = int(batch.date_ordinal.min())
+                last_ordinal = int(batch.date_ordinal.max())
+                if self.first_ordinal is None:
+                    self.first_ordinal = first_ordinal
+                    self.last_ordinal = last_ordinal
+                else:
+                    self.first_ordinal = min(self.first_ordinal,
+                                             first_ordinal)
+                    self.last_ordinal = max(self.last_ordinal, last_ordinal)
+            yield batch
+
+    def save(self):
+        """update the stored series from the committed days"""
+        if self.first_ordinal is not None:
+            write_series_from_days(self.station, self.first_ordinal,
+                                   self.last_ordinal)
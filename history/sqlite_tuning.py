@@ -0,0 +1,82 @@
+from contextlib import contextmanager
+
+from django.db import connections, transaction
+
+from history.models import WeatherDay, WeatherStation, WeatherStats
+
+# applied for the duration of a fast load. WAL with synchronous=NORMAL
+#  cannot corrupt the database on a crash, it can only lose the last commit
+FAST_LOAD_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'cache_size': -64 * 1024,  # negative values are in KiB
+    'temp_store': 'MEMORY',
+}
+
+
+def get_pragma(cursor, name):
+    cursor.execute(f'PRAGMA {name}')
+    return cursor.fetchone()[0]
+
+
+def set_pragma(cursor, name, value):
+    cursor.execute(f'PRAGMA {name} = {value}')
+
+
+@contextmanager
+def sqlite_fast_load(using='default'):
+    """run the block as one transaction under bulk-load friendly PRAGMAs.
+
+    If the block raises, everything it wrote is rolled back. The previous
+    PRAGMA values are always restored, and tables written by ingestion are
+    re-analyzed after a successful load so the query planner sees the new
+    row counts.
+    """
+    connection = connections[using]
+    if connection.vendor != 'sqlite':
+        raise ValueError('fast load mode requires SQLite')
+    if connection.in_atomic_block:
+        raise ValueError('fast load mode cannot run inside a transaction')
+
+    with connection.cursor() as cursor:
+        saved_pragmas = {
+            name: get_pragma(cursor, name)
+            for name in FAST_LOAD_PRAGMAS
+        }
+        for name, value in FAST_LOAD_PRAGMAS.items():
+            set_pragma(cursor, name, value)
+
+    try:
+        with transaction.atomic(using=using):
+            yield
+    finally:
+        with connection.cursor() as cursor:
+            for name, value in saved_pragmas.items():
+                set_pragma(cursor, name, value)
+
+    with connection.cursor() as cursor:
+        for model in (WeatherDay, WeatherStats):
+            cursor.execute(
+                f'ANALYZE {connection.ops.quote_name(model._meta.db_table)}')
+
+
+@contextmanager
+def write_transaction(using='default'):
+    """transaction.atomic() which, on SQLite, takes the database's write
+    lock before the block runs.
+
+    SQLite transactions start out reading. One that has read cannot wait
+    for another connection's write to finish before writing itself, and
+    fails with "database is locked" however long the busy timeout, so
+    blocks that read before writing, while other processes write, wait
+    for the lock up front instead.
+    """
+    connection = connections[using]
+    outermost = not connection.in_atomic_block
+    with transaction.atomic(using=using):
+        if outermost and connection.vendor == 'sqlite':
+            table = connection.ops.quote_name(WeatherStation._meta.db_table)
+            with connection.cursor() as cursor:
+                # writes nothing, but takes the lock
+                cursor.execute(f'UPDATE {table} SET id = id WHERE 0')
+        yield
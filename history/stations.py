@@ -0,0 +1,82 @@
+from collections.abc import Iterable
+from threading import Lock
+
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from history.models import WeatherStation
+
+
+class StationCodeCache:
+    """Maps station codes to ids and back, in this process, so requests can
+    filter and order weather rows on station_id without joining the
+    station table.
+
+    Codes not yet cached are looked up in one query and kept, and unknown
+    codes are looked up again each time, so stations ingested by other
+    processes are found on first use. Stations created or deleted in this
+    process update the cache through signals. A station deleted and
+    created again under the same code by another process keeps its old id
+    here until clear() is called or the process restarts.
+    """
+
+    def __init__(self):
+        self._ids = {}
+        self._codes = {}
+        self._lock = Lock()
+
+    def ids(self, codes: Iterable[str]) -> dict[str, int]:
+        """the ids of the stations with the given codes, leaving out
+        unknown codes"""
+        codes = set(codes)
+        missing = codes - self._ids.keys()
+        if missing:
+            self.add(
+                WeatherStation.objects.filter(code__in=missing).values_list(
+                    'code', 'pk'))
+        ids = self._ids
+        return {code: ids[code] for code in codes if code in ids}
+
+    def codes(self, ids: Iterable[int]) -> dict[int, str]:
+        """the codes of the stations with the given ids, leaving out
+        unknown ids"""
+        ids = set(ids)
+        missing = ids - self._codes.keys()
+        if missing:
+            self.add(
+                WeatherStation.objects.filter(pk__in=missing).values_list(
+                    'code', 'pk'))
+        codes = self._codes
+        return {pk: codes[pk] for pk in ids if pk in codes}
+
+    def add(self, code_ids: Iterable[tuple[str, int]]):
+        with self._lock:
+            for code, pk in code_ids:
+                # replacing any mapping of a renamed or recreated station
+                self._codes.pop(self._ids.get(code), None)
+                self._ids.pop(self._codes.get(pk), None)
+                self._ids[code] = pk
+                self._codes[pk] = code
+
+    def discard(self, code: str, pk: int):
+        with self._lock:
+            self._ids.pop(code, None)
+            self._codes.pop(pk, None)
+
+    def clear(self):
+        with self._lock:
+            self._ids.clear()
+            self._codes.clear()
+
+
+station_cache = StationCodeCache()
+
+
+@receiver(post_save, sender=WeatherStation)
+def cache_saved_station(sender, instance, **kwargs):
+    station_cache.add([(instance.code, instance.pk)])
+
+
+@receiver(post_delete, sender=WeatherStation)
+def forget_deleted_station(sender, instance, **kwargs):
+    station_cache.discard(instance.code, instance.pk)
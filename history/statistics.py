@@ -0,0 +1,287 @@
+import calendar
+import datetime
+from collections import Counter, defaultdict
+from collections.abc import Iterable, Iterator
+from functools import reduce
+from operator import or_
+
+import numpy as np
+from django.db import connections
+from django.db.models import BigIntegerField, Count, Max, Min, Q, Sum
+from django.db.models.functions import Coalesce, ExtractMonth, ExtractYear
+
+from history.models import (WeatherDay, WeatherMonthStats, WeatherStation,
+                            WeatherStats)
+from history.parsing import ColumnBatch
+
+VALUE_FIELDS = ('temperature_max', 'temperature_min', 'precipitation')
+TOTAL_FIELDS = tuple(f'{field}_{kind}' for field in VALUE_FIELDS
+                     for kind in ('total', 'count'))
+EXTREME_FIELDS = tuple(f'{field}_{kind}' for field in VALUE_FIELDS
+                       for kind in ('lowest', 'highest'))
+STATISTIC_FIELDS = ('avg_temperature_max', 'avg_temperature_min',
+                    'total_precipitation')
+DEFAULT_REFRESH_CHUNK_SIZE = 500
+
+
+def totals_by_year(batch: ColumnBatch) -> dict[int, Counter]:
+    """sum and count the non-null values of a batch per calendar year"""
+    years = batch.dates.astype('datetime64[Y]').astype(int) + 1970
+    unique_years, year_indexes = np.unique(years, return_inverse=True)
+    totals = {year: Counter() for year in unique_years.tolist()}
+
+    for field in VALUE_FIELDS:
+        column = getattr(batch, field)
+        present = ~np.ma.getmaskarray(column)
+        sums = np.bincount(year_indexes,
+                           weights=column.filled(0),
+                           minlength=len(unique_years))
+        counts = np.bincount(year_indexes,
+                             weights=present,
+                             minlength=len(unique_years))
+        for year, total, count in zip(unique_years.tolist(), sums.tolist(),
+                                      counts.tolist()):
+            totals[year][f'{field}_total'] += int(total)
+            totals[year][f'{field}_count'] += int(count)
+    return totals
+
+
+def aggregate_totals(weather_days):
+    """per station and year sums and counts straight from WeatherDay rows"""
+    return weather_days.values('station_id', 'date__year').annotate(
+        **{
+            f'{field}_total': Sum(field)
+            for field in VALUE_FIELDS
+        }, **{
+            f'{field}_count': Count(field)
+            for field in VALUE_FIELDS
+        }).order_by()
+
+
+class StatisticsDelta:
+    """accumulates how a station's yearly totals change as batches of days
+    are upserted, so WeatherStats can be updated without re-aggregating
+    every WeatherDay of the touched years.
+
+    Batches must be tracked before they are written, since the delta for
+    a row is its new values minus the values currently stored.
+    """
+
+    def __init__(self, station: WeatherStation):
+        self.station = station
+        self.by_year = defaultdict(Counter)
+
+    def track(self, batches: Iterable[ColumnBatch]) -> Iterator[ColumnBatch]:
+        """pass batches through, recording the change each will make"""
+        for batch in batches:
+            self.add(batch)
+            yield batch
+
+    def add(self, batch: ColumnBatch):
+        if not len(batch):
+            return
+        for year, totals in totals_by_year(batch).items():
+            self.by_year[year].update(totals)
+        existing = self.existing_rows(batch)
+        if len(existing):
+            for year, totals in totals_by_year(existing).items():
+                self.by_year[year].subtract(totals)
+
+    def existing_rows(self, batch: ColumnBatch) -> ColumnBatch:
+        """the stored rows for this station on the batch's dates"""
+        dates = batch.dates
+        rows = WeatherDay.objects.filter(
+            station=self.station,
+            date__gte=dates.min().item(),
+            date__lte=dates.max().item()).values_list(
+                'date', *VALUE_FIELDS).order_by()
+        existing = ColumnBatch.from_rows(rows)
+        return existing[np.isin(existing.date_ordinal, batch.date_ordinal)]
+
+    def apply(self):
+        """add the accumulated deltas to the station's WeatherStats"""
+        if not self.by_year:
+            return
+        stats_by_year = {
+            stats.year: stats
+            for stats in WeatherStats.objects.filter(
+                station=self.station, year__in=self.by_year)
+        }
+
+        stats_to_update = []
+        for year, delta in self.by_year.items():
+            stats = stats_by_year.get(year)
+            if stats is None:
+                stats = WeatherStats(station=self.station, year=year)
+            elif not any(delta.values()):
+                continue
+            for field, change in delta.items():
+                setattr(stats, field, getattr(stats, field) + change)
+            stats.update_from_totals()
+            stats_to_update.append(stats)
+
+        WeatherStats.objects.bulk_create(
+            stats_to_update,
+            update_conflicts=True,
+            update_fields=STATISTIC_FIELDS + TOTAL_FIELDS,
+            unique_fields=('station', 'year'),
+        )
+
+
+def hundredths_sql(numerator: str, denominator: str) -> str:
+    """SQL for numerator / denominator rounded half away from zero to 2
+    decimal places using integer arithmetic, matching
+    WeatherStats.update_from_totals on every backend"""
+    return (f'CASE WHEN {numerator} < 0 '
+            f'THEN -((-2 * {numerator} + {denominator}) / '
+            f'(2 * {denominator})) '
+            f'ELSE (2 * {numerator} + {denominator}) / (2 * {denominator}) '
+            'END / 100.0')
+
+
+def upsert_select(model, conflict_fields: tuple, select_by_field: dict,
+                  totals, using: str = 'default') -> int:
+    """insert a row of model per row of the totals queryset, updating rows
+    that conflict, with a single INSERT ... SELECT ... ON CONFLICT.
+
+    select_by_field maps each field written to a SQL expression over the
+    columns of totals. Returns the number of rows written.
+    """
+    connection = connections[using]
+    quote = connection.ops.quote_name
+    columns = {
+        field: quote(model._meta.get_field(field).column)
+        for field in select_by_field
+    }
+    updates = ', '.join(f'{column} = EXCLUDED.{column}'
+                        for field, column in columns.items()
+                        if field not in conflict_fields)
+    totals_sql, params = totals.query.sql_with_params()
+
+    # SQLite needs the WHERE clause to tell the upsert's ON CONFLICT
+    #  apart from a join constraint
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {quote(model._meta.db_table)} '
+            f'({", ".join(columns.values())}) '
+            f'SELECT {", ".join(select_by_field.values())} '
+            f'FROM ({totals_sql}) totals WHERE 1 = 1 '
+            f'ON CONFLICT ({", ".join(columns[f] for f in conflict_fields)}) '
+            f'DO UPDATE SET {updates}', params)
+        return cursor.rowcount
+
+
+def day_totals(weather_days, *extract):
+    """WeatherDay sums and non-null counts per station and the given
+    date parts, e.g. year=ExtractYear('date'), with 0 rather than null
+    sums"""
+    return weather_days.annotate(**dict(extract)).values(
+        'station_id', *dict(extract)).annotate(
+            **{
+                f'{field}_total': Coalesce(
+                    Sum(field), 0, output_field=BigIntegerField())
+                for field in VALUE_FIELDS
+            }, **{
+                f'{field}_count': Count(field)
+                for field in VALUE_FIELDS
+            }).order_by()
+
+
+def refresh_statistics(station_years: Iterable[tuple[int, int]],
+                       using: str = 'default',
+                       chunk_size: int = DEFAULT_REFRESH_CHUNK_SIZE) -> int:
+    """recompute WeatherStats for (station id, year) pairs from WeatherDay.
+
+    Each chunk of pairs is refreshed by a single INSERT ... SELECT ...
+    GROUP BY ... ON CONFLICT statement, so the database aggregates and
+    upserts the whole chunk in one round trip. Returns the number of
+    statistics rows written.
+    """
+    # each statistic is null when none of its values are present
+    statistics = {
+        'avg_temperature_max': ('temperature_max_count',
+                                hundredths_sql('10 * temperature_max_total',
+                                               'temperature_max_count')),
+        'avg_temperature_min': ('temperature_min_count',
+                                hundredths_sql('10 * temperature_min_total',
+                                               'temperature_min_count')),
+        'total_precipitation': ('precipitation_count',
+                                'precipitation_total / 100.0'),
+    }
+    select_by_field = {
+        'station': 'station_id',
+        'year': 'year',
+        **{field: field for field in TOTAL_FIELDS},
+        **{
+            field: f'CASE WHEN {count} = 0 THEN NULL ELSE {value} END'
+            for field, (count, value) in statistics.items()
+        },
+    }
+
+    station_years = sorted(set(station_years))
+    num_refreshed = 0
+    for start in range(0, len(station_years), chunk_size):
+        chunk = station_years[start:start + chunk_size]
+
+        # date ranges rather than a year lookup, so each station year is
+        #  read as a range of the covering (station, date, values) index.
+        #  The ranges are inclusive, as the day after December 9999 is
+        #  out of range
+        touched = reduce(or_, (Q(station_id=station_id,
+                                 date__gte=datetime.date(year, 1, 1),
+                                 date__lte=datetime.date(year, 12, 31))
+                               for station_id, year in chunk))
+        totals = day_totals(
+            WeatherDay.objects.using(using).filter(touched),
+            ('year', ExtractYear('date')))
+        num_refreshed += upsert_select(WeatherStats, ('station', 'year'),
+                                       select_by_field, totals, using)
+    return num_refreshed
+
+
+def refresh_monthly_statistics(
+        station_months: Iterable[tuple[int, int, int]],
+        using: str = 'default',
+        chunk_size: int = DEFAULT_REFRESH_CHUNK_SIZE) -> int:
+    """recompute WeatherMonthStats for (station id, year, month) triples
+    from WeatherDay, a chunk of triples per statement like
+    refresh_statistics. Returns the number of rows written."""
+    fields = ('station', 'year', 'month') + TOTAL_FIELDS + EXTREME_FIELDS
+    select_by_field = {field: field for field in fields}
+    select_by_field['station'] = 'station_id'
+
+    station_months = sorted(set(station_months))
+    num_refreshed = 0
+    for start in range(0, len(station_months), chunk_size):
+        chunk = station_months[start:start + chunk_size]
+        touched = reduce(or_, (Q(station_id=station_id,
+                                 date__gte=datetime.date(year, month, 1),
+                                 date__lte=last_of_month(year, month))
+                               for station_id, year, month in chunk))
+        totals = day_totals(
+            WeatherDay.objects.using(using).filter(touched),
+            ('year', ExtractYear('date')),
+            ('month', ExtractMonth('date'))).annotate(
+                **{
+                    f'{field}_lowest': Min(field)
+                    for field in VALUE_FIELDS
+                }, **{
+                    f'{field}_highest': Max(field)
+                    for field in VALUE_FIELDS
+                })
+        num_refreshed += upsert_select(WeatherMonthStats,
+                                       ('station', 'year', 'month'),
+                                       select_by_field, totals, using)
+    return num_refreshed
+
+
+def last_of_month(year: int, month: int) -> datetime.date:
+    return datetime.date(year, month, calendar.monthrange(year, month)[1])
+
+
+def sum_month_totals(month_stats, *group_by):
+    """sums and non-null counts per group_by fields and year, added up
+    from WeatherMonthStats rows"""
+    return month_stats.values(*group_by, 'year').annotate(
+        **{field: Sum(field)
+           for field in TOTAL_FIELDS}).order_by()
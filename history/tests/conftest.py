@@ -0,0 +1,20 @@
+import pytest
+
+from history.stations import station_cache
+
+
+@pytest.fixture(autouse=True)
+def series_dir(settings, tmp_path, monkeypatch):
+    """keep the columnar series written by ingestion out of the project,
+    including in ingestion worker processes"""
+    series_dir = tmp_path / 'series'
+    settings.WEATHER_SERIES_DIR = series_dir
+    monkeypatch.setenv('WEATHER_SERIES_DIR', str(series_dir))
+    return series_dir
+
+
+@pytest.fixture(autouse=True)
+def clear_station_cache():
+    """station ids cached by one test may belong to other stations in the
+    next, once its database changes are rolled back"""
+    station_cache.clear()
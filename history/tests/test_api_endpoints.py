@@ -1,11 +1,87 @@
+import datetime
+import json
+from pathlib import Path
+
 import pytest as pytest
+from asgiref.sync import async_to_sync
+from django.core import signals
+from django.core.cache import caches
 from django.core.management import call_command
+from django.db import close_old_connections, connection
+from django.test.utils import CaptureQueriesContext
+
+from history.aggregation import count_groups, group_days
+from history.asgi import AsyncStreamingHttpResponse, StreamingASGIHandler
+from history.async_views import AsyncWeatherDayExportView
+from history.cache import (API_CACHE_ALIAS, LRUCache,
+                           get_cache_statistics, reset_cache_statistics)
+from history.conditional import mark_data_ingested
+from history.models import (IngestionJob, WeatherDay, WeatherStation,
+                            WeatherStats)
+from history.pagination import encode_cursor
+from history.renderers import CSVRenderer, NDJSONRenderer
+from history.stations import station_cache
+from history.serializers import (WeatherDaySerializer,
+                                 WeatherDayValuesSerializer,
+                                 WeatherStatsSerializer,
+                                 WeatherStatsValuesSerializer)
+from history.views import (WeatherAggregateView, WeatherDayBatchView,
+                           WeatherDayExportView)
+
+
+def asgi_get(path, query_string='', headers=()):
+    """the status, headers and body chunks of a GET request served by
+    the ASGI application, keeping the test's database connection open as
+    the test client does"""
+    messages = []
+
+    async def receive():
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def send(message):
+        messages.append(message)
+
+    scope = {
+        'type': 'http',
+        'asgi': {
+            'version': '3.0'
+        },
+        'http_version': '1.1',
+        'method': 'GET',
+        'scheme': 'http',
+        'path': path,
+        'raw_path': path.encode(),
+        'query_string': query_string.encode(),
+        'headers': [(b'host', b'testserver'), *headers],
+        'server': ('testserver', 80),
+        'client': ('127.0.0.1', 50000),
+    }
+    signals.request_started.disconnect(close_old_connections)
+    signals.request_finished.disconnect(close_old_connections)
+    try:
+        async_to_sync(StreamingASGIHandler())(scope, receive, send)
+    finally:
+        signals.request_started.connect(close_old_connections)
+        signals.request_finished.connect(close_old_connections)
+
+    start, *body = messages
+    headers = {
+        name.decode(): value.decode()
+        for name, value in start['headers']
+    }
+    return start['status'], headers, body
+
+
+def join_body(body) -> bytes:
+    return b''.join(message.get('body', b'') for message in body)
 
 
 @pytest.mark.django_db
 class TestAPIEndpoints:
 
     def setup_method(self, method):
+        caches[API_CACHE_ALIAS].clear()
+        reset_cache_statistics()
         call_command('ingest_history',
                      'history/tests/files_for_testing/directory')
 
@@ -197,3 +273,987 @@ class TestAPIEndpoints:
                 '/api/weather/stats?station__code=file_to_load2&year=1989')
 
             assert response.data['count'] == 1
+
+    class TestStatsFromMonthlyRollups:
+
+        @pytest.mark.parametrize('query', [
+            '', '?limit=1', '?limit=1&offset=1', '?station__code=file_to_load',
+            '?year=1989', '?year=1990'
+        ])
+        def test_match_stored_yearly_statistics(self, client, query):
+            separator = '&' if query else '?'
+            yearly = client.get(f'/api/weather/stats{query}')
+            monthly = client.get(
+                f'/api/weather/stats{query}{separator}source=monthly')
+
+            assert monthly.status_code == 200
+            assert monthly.data['count'] == yearly.data['count']
+            assert monthly.json()['results'] == yearly.json()['results']
+
+        def test_cursor_pages_match(self, client):
+            yearly = client.get('/api/weather/stats?limit=1&cursor=').json()
+            monthly = client.get(
+                '/api/weather/stats?limit=1&cursor=&source=monthly').json()
+
+            assert monthly['results'] == yearly['results']
+            assert client.get(monthly['next']).json()['results'] == (
+                client.get(yearly['next']).json()['results'])
+
+        def test_unknown_source_rejected(self, client):
+            response = client.get('/api/weather/stats?source=daily')
+
+            assert response.status_code == 400
+
+    class TestCursorPagination:
+
+        def get_codes_and_dates(self, response):
+            return [(row['station']['code'], row['date'])
+                    for row in response.data['results']]
+
+        def test_pages_forward_and_back_without_count(self, client):
+            first = client.get('/api/weather/?cursor=&limit=4')
+            second = client.get(first.data['next'])
+            back = client.get(second.data['previous'])
+
+            assert 'count' not in first.data
+            assert first.data['previous'] is None
+            assert self.get_codes_and_dates(first) == [
+                ('file_to_load', '1989-03-13'),
+                ('file_to_load', '1989-03-14'),
+                ('file_to_load', '1989-03-15'),
+                ('file_to_load', '1989-03-16'),
+            ]
+            assert self.get_codes_and_dates(second) == [
+                ('file_to_load2', '1989-03-13'),
+                ('file_to_load2', '1989-03-14'),
+            ]
+            assert second.data['next'] is None
+            assert self.get_codes_and_dates(back) == self.get_codes_and_dates(
+                first)
+            assert back.data['previous'] is None
+            assert back.data['next'] is not None
+
+        def test_results_match_offset_pagination(self, client):
+            offset_pages = [
+                client.get(f'/api/weather/?limit=2&offset={offset}')
+                for offset in (0, 2, 4)
+            ]
+            cursor_pages = [client.get('/api/weather/?limit=2&cursor=')]
+            while cursor_pages[-1].data['next']:
+                cursor_pages.append(client.get(cursor_pages[-1].data['next']))
+
+            assert [page.data['results'] for page in cursor_pages
+                    ] == [page.data['results'] for page in offset_pages]
+
+        def test_filters_apply_to_cursor_pages(self, client):
+            first = client.get(
+                '/api/weather/?cursor=&limit=1&date=1989-03-13')
+            second = client.get(first.data['next'])
+
+            assert self.get_codes_and_dates(first) == [('file_to_load',
+                                                        '1989-03-13')]
+            assert self.get_codes_and_dates(second) == [('file_to_load2',
+                                                         '1989-03-13')]
+            assert second.data['next'] is None
+
+        def test_stats_keyed_on_station_and_year(self, client):
+            first = client.get('/api/weather/stats?cursor=&limit=1')
+            second = client.get(first.data['next'])
+
+            assert first.data['results'][0]['station']['code'] == (
+                'file_to_load')
+            assert second.data['results'][0]['station']['code'] == (
+                'file_to_load2')
+            assert second.data['next'] is None
+
+        def test_invalid_cursor_is_not_found(self, client):
+            bad_token = client.get('/api/weather/?cursor=notacursor')
+            bad_position = client.get(
+                '/api/weather/?cursor=' +
+                encode_cursor(['file_to_load', 'notadate'], False))
+
+            assert bad_token.status_code == 404
+            assert bad_position.status_code == 404
+
+    class TestQueriesPerPage:
+        # each request also looks up the data version of the stations and
+        #  years it covers
+
+        @pytest.mark.parametrize('url', ['/api/weather/', '/api/weather/stats'])
+        def test_offset_page_is_a_count_and_a_select(
+                self, client, django_assert_num_queries, url):
+            with django_assert_num_queries(3):
+                client.get(f'{url}?limit=1000')
+
+        @pytest.mark.parametrize('url', ['/api/weather/', '/api/weather/stats'])
+        def test_cursor_page_is_a_single_select(self, client,
+                                                django_assert_num_queries,
+                                                url):
+            with django_assert_num_queries(2):
+                client.get(f'{url}?limit=1000&cursor=')
+
+    class TestValuesSerializers:
+
+        @pytest.mark.parametrize(
+            'model, serializer_class, values_serializer_class',
+            [(WeatherDay, WeatherDaySerializer, WeatherDayValuesSerializer),
+             (WeatherStats, WeatherStatsSerializer,
+              WeatherStatsValuesSerializer)])
+        def test_same_output_as_model_serializer(self, model,
+                                                 serializer_class,
+                                                 values_serializer_class):
+            queryset = model.objects.all()
+
+            assert values_serializer_class(
+                queryset.values(*values_serializer_class.values_fields)
+            ).data == serializer_class(queryset, many=True).data
+
+    class TestWeatherDayExportView:
+
+        def get_content(self, response):
+            return b''.join(response.streaming_content).decode()
+
+        def test_streams_csv_by_default(self, client):
+            response = client.get('/api/weather/export')
+
+            assert response.streaming
+            assert response['Content-Type'] == 'text/csv; charset=utf-8'
+            assert self.get_content(response).splitlines() == [
+                'station,date,temperature_max,temperature_min,precipitation',
+                'file_to_load,1989-03-13,122,-44,',
+                'file_to_load,1989-03-14,189,,53',
+                'file_to_load,1989-03-15,,6,0',
+                'file_to_load,1989-03-16,94,-33,0',
+                'file_to_load2,1989-03-13,122,-44,',
+                'file_to_load2,1989-03-14,189,,53',
+            ]
+
+        def test_streams_ndjson_in_list_row_shape(self, client):
+            response = client.get(
+                '/api/weather/export?format=ndjson&station__code=file_to_load2'
+            )
+            list_response = client.get(
+                '/api/weather/?station__code=file_to_load2')
+
+            assert response['Content-Type'] == (
+                'application/x-ndjson; charset=utf-8')
+            assert [
+                json.loads(line)
+                for line in self.get_content(response).splitlines()
+            ] == list_response.data['results']
+
+        def test_date_range_filters(self, client):
+            response = client.get('/api/weather/export?date__gte=1989-03-14'
+                                  '&date__lte=1989-03-15&station__code='
+                                  'file_to_load')
+
+            assert self.get_content(response).splitlines()[1:] == [
+                'file_to_load,1989-03-14,189,,53',
+                'file_to_load,1989-03-15,,6,0',
+            ]
+
+        @pytest.mark.parametrize('query,field', [
+            ('date=notadate', 'date'),
+            ('year=abc', 'year'),
+            ('format=ndjson&year=abc', 'year'),
+        ])
+        def test_invalid_filters_rejected_as_json(self, client, query,
+                                                  field):
+            response = client.get(f'/api/weather/export?{query}')
+
+            assert response.status_code == 400
+            assert response['Content-Type'] == 'application/json'
+            assert field in response.json()
+
+        def test_unknown_format_not_found_as_json(self, client):
+            response = client.get('/api/weather/export?format=xml')
+
+            assert response.status_code == 404
+            assert response['Content-Type'] == 'application/json'
+            assert 'detail' in response.json()
+
+        @pytest.mark.parametrize('accept', ['text/csv', 'application/x-ndjson'])
+        def test_options_described_as_json(self, client, accept):
+            response = client.options('/api/weather/export',
+                                      HTTP_ACCEPT=accept)
+
+            assert response.status_code == 200
+            assert response['Content-Type'] == 'application/json'
+            assert response.json()['renders'] == [
+                'text/csv', 'application/x-ndjson'
+            ]
+
+        def test_renderers_render_lists_of_objects(self):
+            rows = [{'station': 'A', 'temperature_max': 1.5},
+                    {'station': 'B', 'temperature_max': None}]
+
+            assert CSVRenderer().render(rows) == (
+                b'station,temperature_max\r\nA,1.5\r\nB,\r\n')
+            assert NDJSONRenderer().render(rows) == (
+                b'{"station": "A", "temperature_max": 1.5}\n'
+                b'{"station": "B", "temperature_max": null}\n')
+            assert CSVRenderer().render(None) == NDJSONRenderer().render(
+                None) == b''
+
+        def test_rows_sent_in_chunks(self, client, monkeypatch):
+            monkeypatch.setattr(WeatherDayExportView, 'chunk_size', 4)
+
+            response = client.get('/api/weather/export?format=ndjson')
+
+            assert [
+                chunk.count(b'\n') for chunk in response.streaming_content
+            ] == [4, 2]
+
+    class TestConditionalGet:
+
+        @pytest.mark.parametrize('url', [
+            '/api/weather/', '/api/weather/stats', '/api/weather/export',
+            '/api/weather/aggregate?station__code=file_to_load',
+            '/api/weather/batch?station__code__in=file_to_load'
+        ])
+        def test_not_modified_without_running_the_query(
+                self, client, django_assert_num_queries, url):
+            response = client.get(url)
+
+            with django_assert_num_queries(1):
+                not_modified = client.get(
+                    url, HTTP_IF_NONE_MATCH=response['ETag'])
+
+            assert response.status_code == 200
+            assert not_modified.status_code == 304
+            assert not_modified['ETag'] == response['ETag']
+
+        def test_last_modified_honoured(self, client):
+            response = client.get('/api/weather/')
+
+            not_modified = client.get(
+                '/api/weather/',
+                HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+
+            assert not_modified.status_code == 304
+
+        def test_etag_depends_on_query(self, client):
+            first = client.get('/api/weather/?limit=1')
+            second = client.get('/api/weather/?limit=2')
+
+            assert first['ETag'] != second['ETag']
+
+        def test_ingestion_invalidates_only_touched_stations(self, client):
+            station1 = client.get('/api/weather/?station__code=file_to_load')
+            station2 = client.get('/api/weather/?station__code=file_to_load2')
+            everything = client.get('/api/weather/')
+
+            call_command(
+                'ingest_history',
+                'history/tests/files_for_testing/directory/file_to_load2.txt',
+                force=True)
+
+            assert client.get(
+                '/api/weather/?station__code=file_to_load',
+                HTTP_IF_NONE_MATCH=station1['ETag']).status_code == 304
+            assert client.get(
+                '/api/weather/?station__code=file_to_load2',
+                HTTP_IF_NONE_MATCH=station2['ETag']).status_code == 200
+            assert client.get(
+                '/api/weather/',
+                HTTP_IF_NONE_MATCH=everything['ETag']).status_code == 200
+
+    class TestResponseCache:
+
+        @pytest.mark.parametrize('url', ['/api/weather/', '/api/weather/stats'])
+        def test_repeated_request_served_from_cache(
+                self, client, django_assert_num_queries, url):
+            miss = client.get(f'{url}?limit=2')
+
+            # only the data version is looked up
+            with django_assert_num_queries(1):
+                hit = client.get(f'{url}?limit=2')
+
+            assert miss['X-Cache'] == 'MISS'
+            assert hit['X-Cache'] == 'HIT'
+            assert hit.content == miss.content
+            assert hit['Content-Type'] == miss['Content-Type']
+
+        def test_key_ignores_param_order(self, client):
+            client.get('/api/weather/stats?station__code=file_to_load&year=1989')
+
+            response = client.get(
+                '/api/weather/stats?year=1989&station__code=file_to_load')
+
+            assert response['X-Cache'] == 'HIT'
+
+        def test_errors_not_cached(self, client):
+            client.get('/api/weather/?cursor=invalid')
+
+            response = client.get('/api/weather/?cursor=invalid')
+
+            assert response.status_code == 404
+            assert get_cache_statistics()['misses'] == 2
+            assert get_cache_statistics()['entries'] == 0
+
+        def test_ingestion_invalidates_only_touched_stations_and_years(
+                self, client, tmp_path):
+            urls = {
+                'other year': '/api/weather/stats?station__code=file_to_load'
+                              '&year=1989',
+                'all years': '/api/weather/stats?station__code=file_to_load',
+                'other station': '/api/weather/stats'
+                                 '?station__code=file_to_load2',
+            }
+            for url in urls.values():
+                client.get(url)
+
+            (tmp_path / 'file_to_load.txt').write_text(
+                '19900101\t  10\t  -10\t    0\n')
+            call_command('ingest_history', str(tmp_path))
+
+            assert {
+                name: client.get(url)['X-Cache']
+                for name, url in urls.items()
+            } == {
+                'other year': 'HIT',
+                'all years': 'MISS',
+                'other station': 'HIT',
+            }
+
+        def test_counters_exposed(self, client):
+            client.get('/api/weather/')
+            client.get('/api/weather/')
+            client.get('/api/weather/?limit=1')
+
+            response = client.get('/api/weather/cache')
+
+            assert response.data['hits'] == 1
+            assert response.data['misses'] == 2
+            assert response.data['entries'] == 2
+
+    class TestLRUCache:
+
+        def test_least_recently_used_evicted_by_size(self):
+            cache = LRUCache('test-lru', {'OPTIONS': {'MAX_SIZE': 300}})
+            cache.clear()
+            cache.set('a', b'a' * 100)
+            cache.set('b', b'b' * 100)
+            cache.get('a')
+
+            cache.set('c', b'c' * 100)
+
+            assert cache.get('a') is not None
+            assert cache.get('b') is None
+            assert cache.get('c') is not None
+            assert cache.statistics()['evictions'] == 1
+            assert cache.statistics()['size'] <= 300
+
+        def test_entries_larger_than_the_cache_not_stored(self):
+            cache = LRUCache('test-lru-large', {'OPTIONS': {'MAX_SIZE': 50}})
+
+            cache.set('a', b'a' * 100)
+
+            assert cache.get('a') is None
+            assert cache.statistics()['size'] == 0
+
+    class TestWeatherAggregateView:
+
+        def test_year_matches_weather_stats(self, client):
+            response = client.get('/api/weather/aggregate'
+                                  '?station__code=file_to_load&group_by=year')
+
+            stats = WeatherStats.objects.get(station__code='file_to_load')
+            assert response.status_code == 200
+            assert response.json() == [{
+                'station': {
+                    'code': 'file_to_load'
+                },
+                'group': '1989',
+                'first_date': '1989-03-13',
+                'last_date': '1989-03-16',
+                'temperature_max': {
+                    'avg': '13.50',
+                    'min': '9.40',
+                    'max': '18.90',
+                    'sum': '40.50',
+                    'count': 3
+                },
+                'temperature_min': {
+                    'avg': '-2.37',
+                    'min': '-4.40',
+                    'max': '0.60',
+                    'sum': '-7.10',
+                    'count': 3
+                },
+                'precipitation': {
+                    'avg': '0.18',
+                    'min': '0.00',
+                    'max': '0.53',
+                    'sum': '0.53',
+                    'count': 3
+                },
+            }]
+            assert (response.json()[0]['temperature_max']['avg'] ==
+                    str(stats.avg_temperature_max))
+            assert (response.json()[0]['precipitation']['sum'] ==
+                    str(stats.total_precipitation))
+
+        def test_windows_over_a_date_range_per_station(self, client):
+            response = client.get(
+                '/api/weather/aggregate?station__code=file_to_load'
+                '&station__code=file_to_load2&date__gte=1989-03-14'
+                '&date__lte=1989-03-16&group_by=window&window_days=2')
+
+            assert [(row['station']['code'], row['group'], row['last_date'],
+                     row['temperature_max']['count'])
+                    for row in response.json()] == [
+                        ('file_to_load', '1989-03-14', '1989-03-15', 1),
+                        ('file_to_load', '1989-03-16', '1989-03-16', 1),
+                        ('file_to_load2', '1989-03-14', '1989-03-15', 1),
+                        ('file_to_load2', '1989-03-16', '1989-03-16', 0),
+                    ]
+            assert response.json()[-1]['temperature_max']['avg'] is None
+
+        def test_seasons_and_month_filter(self, client, tmp_path):
+            (tmp_path / 'seasonal.txt').write_text(
+                '19891130\t  10\t  0\t    0\n'
+                '19891201\t  20\t  0\t    0\n'
+                '19900228\t  40\t  0\t    0\n'
+                '19900301\t  80\t  0\t    0\n')
+            call_command('ingest_history', str(tmp_path))
+
+            seasons = client.get('/api/weather/aggregate'
+                                 '?station__code=seasonal&group_by=season')
+            winter = client.get(
+                '/api/weather/aggregate?station__code=seasonal'
+                '&group_by=total&months=12&months=1&months=2')
+
+            assert [(row['group'], row['first_date'], row['last_date'],
+                     row['temperature_max']['avg'])
+                    for row in seasons.json()] == [
+                        ('1989-SON', '1989-11-30', '1989-11-30', '1.00'),
+                        ('1990-DJF', '1989-12-01', '1990-02-28', '3.00'),
+                        ('1990-MAM', '1990-03-01', '1990-03-01', '8.00'),
+                    ]
+            assert [(row['group'], row['temperature_max']['count'])
+                    for row in winter.json()] == [('total', 2)]
+
+        @pytest.mark.parametrize('query', [
+            '',
+            '?station__code=unknown',
+            '?station__code=file_to_load&group_by=window',
+            '?station__code=file_to_load&group_by=decade',
+            '?station__code=file_to_load&date__gte=1990-01-01'
+            '&date__lte=1989-01-01',
+            '?station__code=file_to_load&months=13',
+        ])
+        def test_invalid_params_rejected(self, client, query):
+            response = client.get(f'/api/weather/aggregate{query}')
+
+            assert response.status_code == 400
+
+        @pytest.mark.parametrize('query', [
+            'date__gte=0001-01-01&date__lte=9999-12-31&group_by=month',
+            'date__gte=1900-01-01&date__lte=2100-12-31&group_by=window'
+            '&window_days=1',
+        ])
+        def test_too_many_groups_rejected(self, client, query):
+            response = client.get(
+                f'/api/weather/aggregate?station__code=file_to_load&{query}')
+
+            assert response.status_code == 400
+
+        def test_group_limit_counts_every_station(self, client, monkeypatch):
+            monkeypatch.setattr(WeatherAggregateView, 'max_groups', 3)
+            url = ('/api/weather/aggregate?station__code=file_to_load'
+                   '&date__gte=1989-01-01&date__lte=1989-03-31'
+                   '&group_by=month')
+
+            assert client.get(url).status_code == 200
+            assert client.get(
+                f'{url}&station__code=file_to_load2').status_code == 400
+
+        def test_too_many_station_days_rejected(self, client):
+            response = client.get(
+                '/api/weather/aggregate?station__code=file_to_load'
+                '&station__code=file_to_load2&date__gte=0001-01-01'
+                '&date__lte=9999-12-31&group_by=total')
+
+            assert response.status_code == 400
+            assert 'station days requested' in response.json()[0]
+
+        def test_day_limit_counts_every_station(self, client, monkeypatch):
+            monkeypatch.setattr(WeatherAggregateView, 'max_station_days', 90)
+            url = ('/api/weather/aggregate?station__code=file_to_load'
+                   '&date__gte=1989-01-01&date__lte=1989-03-31'
+                   '&group_by=total')
+
+            assert client.get(url).status_code == 200
+            assert client.get(
+                f'{url}&station__code=file_to_load2').status_code == 400
+
+        @pytest.mark.parametrize('group_by,window_days', [
+            ('total', None),
+            ('year', None),
+            ('season', None),
+            ('month', None),
+            ('window', 7),
+        ])
+        def test_group_count_matches_groups(self, group_by, window_days):
+            first_ordinal = datetime.date(1988, 12, 15).toordinal()
+            last_ordinal = datetime.date(1991, 3, 1).toordinal()
+
+            assert count_groups(first_ordinal, last_ordinal, group_by,
+                                window_days) == len(
+                                    group_days(first_ordinal, last_ordinal,
+                                               group_by, window_days)[2])
+
+        def test_reingestion_reflected(self, client, tmp_path):
+            url = ('/api/weather/aggregate'
+                   '?station__code=file_to_load&group_by=total')
+            client.get(url)
+            (tmp_path / 'file_to_load.txt').write_text(
+                '19890313\t  -100\t  -200\t    0\n')
+
+            call_command('ingest_history', str(tmp_path))
+
+            assert client.get(
+                url).json()[0]['temperature_max']['min'] == '-10.00'
+
+    class TestBatchFilters:
+
+        def test_station_code_in_and_date_range(self, client):
+            response = client.get(
+                '/api/weather/?station__code__in=file_to_load,file_to_load2'
+                '&date__gte=1989-03-14&date__lte=1989-03-15')
+
+            assert [(row['station']['code'], row['date'])
+                    for row in response.data['results']] == [
+                        ('file_to_load', '1989-03-14'),
+                        ('file_to_load', '1989-03-15'),
+                        ('file_to_load2', '1989-03-14'),
+                    ]
+
+        def test_stats_year_range(self, client):
+            assert client.get('/api/weather/stats?station__code__in='
+                              'file_to_load&year__gte=1989&year__lte=1989'
+                              ).data['count'] == 1
+            assert client.get(
+                '/api/weather/stats?year__gte=1990').data['count'] == 0
+
+    class TestWeatherDayBatchView:
+        expected = [{
+            'station': {
+                'code': 'file_to_load'
+            },
+            'days': [{
+                'date': '1989-03-14',
+                'temperature_max': 189,
+                'temperature_min': None,
+                'precipitation': 53
+            }],
+        }, {
+            'station': {
+                'code': 'file_to_load2'
+            },
+            'days': [{
+                'date': '1989-03-14',
+                'temperature_max': 189,
+                'temperature_min': None,
+                'precipitation': 53
+            }],
+        }]
+
+        @pytest.mark.parametrize('query', [
+            'station__code__in=file_to_load2,file_to_load&date=1989-03-14',
+            'station__code__in=file_to_load&station__code__in=file_to_load2'
+            '&date__gte=1989-03-14&date__lte=1989-03-14',
+        ])
+        def test_grouped_by_station_in_one_query(
+                self, client, django_assert_num_queries, query):
+            # plus the data version lookup
+            with django_assert_num_queries(2):
+                response = client.get(f'/api/weather/batch?{query}')
+
+            assert response.json() == self.expected
+
+        def test_post_json_in_one_query(self, client,
+                                        django_assert_num_queries):
+            with django_assert_num_queries(1):
+                response = client.post(
+                    '/api/weather/batch', {
+                        'station__code__in': ['file_to_load2', 'file_to_load'],
+                        'date': '1989-03-14'
+                    },
+                    content_type='application/json')
+
+            assert response.json() == self.expected
+
+        def test_post_form(self, client):
+            response = client.post(
+                '/api/weather/batch', {
+                    'station__code__in': ['file_to_load', 'file_to_load2'],
+                    'date__gte': '1989-03-14',
+                    'date__lte': '1989-03-14'
+                })
+
+            assert response.json() == self.expected
+
+        def test_year_range_and_unknown_stations(self, client):
+            response = client.get('/api/weather/batch?station__code__in='
+                                  'file_to_load,unknown&year__gte=1989'
+                                  '&year__lte=1989')
+
+            assert [(group['station']['code'], len(group['days']))
+                    for group in response.json()] == [('file_to_load', 4)]
+            assert client.get('/api/weather/batch?station__code__in='
+                              'file_to_load&year__gte=1990').json() == []
+
+        def test_too_many_days_rejected(self, client, monkeypatch):
+            monkeypatch.setattr(WeatherDayBatchView, 'max_days', 5)
+
+            response = client.get('/api/weather/batch?station__code__in='
+                                  'file_to_load,file_to_load2')
+
+            assert response.status_code == 400
+
+        @pytest.mark.parametrize('query', [
+            '', 'station__code__in=', 'station__code__in=file_to_load&date=x',
+            'station__code__in=file_to_load&year__gte=99999',
+            'station__code__in=file_to_load&year__gte=0',
+            'station__code__in=file_to_load&year__lte=0',
+            'station__code__in=file_to_load&year__lte=9999'
+        ])
+        def test_invalid_params_rejected(self, client, query):
+            response = client.get(f'/api/weather/batch?{query}')
+
+            assert response.status_code == 400
+
+    class TestAsyncViews:
+
+        def get_json(self, path, query_string=''):
+            status, _, body = asgi_get(path, query_string)
+            assert status == 200
+            return json.loads(join_body(body))
+
+        @pytest.mark.parametrize('path,sync_path,query_string', [
+            ('/api/weather/async', '/api/weather/', 'limit=2&offset=2'),
+            ('/api/weather/async', '/api/weather/',
+             'station__code__in=file_to_load2&date__gte=1989-03-14'),
+            ('/api/weather/async', '/api/weather/',
+             'station__code=file_to_load&year__gte=1989&year__lte=1989'),
+            ('/api/weather/async/stats', '/api/weather/stats', ''),
+            ('/api/weather/async/stats', '/api/weather/stats',
+             'source=monthly&year=1989'),
+        ])
+        def test_same_results_as_sync_views(self, client, path, sync_path,
+                                            query_string):
+            data = self.get_json(path, query_string)
+            sync_data = client.get(f'{sync_path}?{query_string}').json()
+
+            assert data['count'] == sync_data['count']
+            assert data['results'] == sync_data['results']
+
+        def test_page_links(self):
+            data = self.get_json('/api/weather/async', 'limit=2&offset=2')
+
+            assert data['next'] == (
+                'http://testserver/api/weather/async?limit=2&offset=4')
+            assert data['previous'] == (
+                'http://testserver/api/weather/async?limit=2')
+
+        @pytest.mark.parametrize('path,query_string', [
+            ('/api/weather/async', 'date=x'),
+            ('/api/weather/async/stats', 'source=daily'),
+            ('/api/weather/async/export', 'date__gte=x'),
+        ])
+        def test_invalid_params_rejected(self, path, query_string):
+            status, _, _ = asgi_get(path, query_string)
+
+            assert status == 400
+
+        def test_export_matches_sync_export(self, client):
+            sync_response = client.get('/api/weather/export?format=ndjson')
+
+            status, headers, body = asgi_get('/api/weather/async/export',
+                                             'format=ndjson')
+
+            assert status == 200
+            assert headers['Content-Type'] == (
+                'application/x-ndjson; charset=utf-8')
+            assert join_body(body) == b''.join(
+                sync_response.streaming_content)
+
+        def test_export_format_from_accept_header(self):
+            _, headers, _ = asgi_get('/api/weather/async/export',
+                                     headers=[(b'accept',
+                                               b'application/x-ndjson')])
+
+            assert headers['Content-Type'] == (
+                'application/x-ndjson; charset=utf-8')
+            assert asgi_get('/api/weather/async/export',
+                            'format=xml')[0] == 404
+
+        def test_export_streamed_in_chunks(self, monkeypatch):
+            monkeypatch.setattr(AsyncWeatherDayExportView, 'chunk_size', 4)
+
+            _, _, body = asgi_get('/api/weather/async/export',
+                                  'format=ndjson')
+
+            assert [(message.get('body', b'').count(b'\n'),
+                     message.get('more_body', False))
+                    for message in body] == [(4, True), (2, True), (0, False)]
+
+        def test_async_response_read_in_full_outside_asgi(self):
+
+            async def content():
+                yield 'a'
+                yield b'b'
+
+            response = AsyncStreamingHttpResponse(content())
+
+            assert response.getvalue() == b'ab'
+
+
+@pytest.mark.django_db
+class TestIngestionJobViews:
+
+    @pytest.fixture(autouse=True)
+    def ingestion_root(self, settings):
+        settings.WEATHER_INGESTION_ROOT = 'history/tests/files_for_testing'
+
+    def test_staff_only(self, client, django_user_model):
+        job = IngestionJob.objects.create(path='directory', options={})
+        user = django_user_model.objects.create_user(username='user',
+                                                     password='password')
+
+        for login in (None, user):
+            if login is not None:
+                client.force_login(login)
+            response = client.post('/api/weather/jobs', {
+                'path': 'directory',
+                'force': True
+            },
+                                   content_type='application/json')
+            assert response.status_code == 403
+            assert client.get('/api/weather/jobs').status_code == 403
+            assert client.get(
+                f'/api/weather/jobs/{job.pk}').status_code == 403
+        assert IngestionJob.objects.count() == 1
+
+    def test_post_queues_job(self, admin_client):
+        response = admin_client.post('/api/weather/jobs', {
+            'path': 'directory',
+            'force': True
+        },
+                                     content_type='application/json')
+
+        assert response.status_code == 202
+        job = IngestionJob.objects.get()
+        assert response['Location'] == (
+            f'http://testserver/api/weather/jobs/{job.pk}')
+        assert response.json()['status'] == 'queued'
+        assert job.path == str(
+            Path('history/tests/files_for_testing/directory').resolve())
+        assert job.options == {
+            'recursive': False,
+            'force': True,
+            'stats': 'incremental',
+            'missing_data': 'rows'
+        }
+        assert not WeatherDay.objects.exists()
+
+    @pytest.mark.parametrize('path', ['../../..', 'missing', '/etc'])
+    def test_paths_outside_root_or_missing_rejected(self, admin_client, path):
+        response = admin_client.post('/api/weather/jobs', {'path': path},
+                                     content_type='application/json')
+
+        assert response.status_code == 400
+        assert 'path' in response.json()
+        assert not IngestionJob.objects.exists()
+
+    def test_status_shows_progress_once_run(self, admin_client):
+        job_url = admin_client.post('/api/weather/jobs', {
+            'path': 'directory'
+        },
+                                    content_type='application/json')[
+                                        'Location']
+
+        call_command('run_ingestion_jobs', exit_when_idle=True)
+
+        job = admin_client.get(job_url).json()
+        assert job['status'] == 'succeeded'
+        assert job['files_processed'] == 2
+        assert job['records_ingested'] == 6
+        assert job['metrics']['rows_inserted'] == 6
+        assert 'load' in job['metrics']['phases']
+        assert job['started'] <= job['finished']
+        assert admin_client.get('/api/weather/jobs?status=succeeded').json()[
+            'count'] == 1
+        assert admin_client.get('/api/weather/jobs?status=queued').json()[
+            'count'] == 0
+
+
+@pytest.mark.django_db
+class TestStationCodeFiltering:
+
+    def setup_method(self, method):
+        call_command('ingest_history',
+                     'history/tests/files_for_testing/directory')
+
+    def get_page_queries(self, client, url) -> list[str]:
+        with CaptureQueriesContext(connection) as queries:
+            assert client.get(url).status_code == 200
+        return [
+            query['sql'] for query in queries.captured_queries
+            if 'history_weatherday' in query['sql']
+        ]
+
+    def explain(self, sql) -> str:
+        with connection.cursor() as cursor:
+            if connection.vendor == 'sqlite':
+                cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+                return '\n'.join(row[-1] for row in cursor.fetchall())
+            # the test tables are small enough for PostgreSQL to prefer
+            #  reading them whole and sorting, so plan as for large ones
+            cursor.execute('SET LOCAL enable_seqscan = off')
+            cursor.execute('SET LOCAL enable_bitmapscan = off')
+            cursor.execute(f'EXPLAIN {sql}')
+            return '\n'.join(row[0] for row in cursor.fetchall())
+
+    @pytest.mark.parametrize('url', [
+        '/api/weather/?station__code=file_to_load&cursor=&limit=2',
+        '/api/weather/?station__code=file_to_load&date__gte=1989-03-14'
+        '&cursor=&limit=2',
+        '/api/weather/?station__code__in=file_to_load,file_to_load2'
+        '&cursor=&limit=2',
+        '/api/weather/?station__code=file_to_load&limit=2&offset=1',
+    ])
+    def test_filtered_page_is_an_index_scan_without_join_or_sort(
+            self, client, url):
+        [*_, page_query] = self.get_page_queries(client, url)
+
+        assert 'history_weatherstation' not in page_query
+        plan = self.explain(page_query)
+        assert 'TEMP B-TREE' not in plan
+        assert 'Sort' not in plan
+        if connection.vendor == 'sqlite':
+            assert 'USING INDEX' in plan or 'USING COVERING INDEX' in plan
+
+    def test_station_codes_resolved_from_cache(self, client,
+                                               django_assert_num_queries):
+        client.get('/api/weather/?station__code=file_to_load&cursor=')
+
+        # the data version and the page
+        with django_assert_num_queries(2):
+            response = client.get(
+                '/api/weather/?station__code__in=file_to_load,file_to_load2'
+                '&cursor=&limit=3')
+
+        assert [row['station']['code'] for row in response.json()['results']
+                ] == ['file_to_load'] * 3
+
+    def test_unknown_station_matches_nothing(self, client):
+        assert client.get('/api/weather/?station__code=unknown').json()[
+            'count'] == 0
+
+    def test_station_ingested_by_another_process_found(self, client):
+        assert client.get('/api/weather/stats?station__code=late').json()[
+            'count'] == 0
+
+        # bulk_create sends no signals, as if another process ingested it
+        [station] = WeatherStation.objects.bulk_create(
+            [WeatherStation(code='late')])
+        WeatherStats.objects.create(station=station, year=1989)
+        mark_data_ingested([(station.pk, 1989)])
+
+        assert client.get('/api/weather/stats?station__code=late').json()[
+            'results'][0]['station']['code'] == 'late'
+
+    def test_renamed_station_cached_under_new_code(self):
+        station = WeatherStation.objects.get(code='file_to_load')
+        assert station_cache.ids(['file_to_load']) == {
+            'file_to_load': station.pk
+        }
+
+        station.code = 'renamed'
+        station.save()
+
+        assert station_cache.ids(['file_to_load', 'renamed']) == {
+            'renamed': station.pk
+        }
+        assert station_cache.codes([station.pk]) == {station.pk: 'renamed'}
+
+
+@pytest.mark.django_db
+class TestYearRangeFilters:
+
+    def setup_method(self, method):
+        station = WeatherStation.objects.create(code='boundaries')
+        WeatherDay.objects.bulk_create([
+            WeatherDay(station=station, date=date, precipitation=0)
+            for date in (datetime.date(1988, 12, 31),
+                         datetime.date(1989, 1, 1),
+                         datetime.date(1989, 12, 31),
+                         datetime.date(1990, 1, 1))
+        ])
+        mark_data_ingested([(station.pk, 1988), (station.pk, 1989),
+                            (station.pk, 1990)])
+
+    def get_dates(self, client, url) -> list[str]:
+        response = client.get(url)
+        assert response.status_code == 200
+        return [row['date'] for row in response.json()['results']]
+
+    @pytest.mark.parametrize('query,dates', [
+        ('year=1989', ['1989-01-01', '1989-12-31']),
+        ('year__gte=1989', ['1989-01-01', '1989-12-31', '1990-01-01']),
+        ('year__lte=1989', ['1988-12-31', '1989-01-01', '1989-12-31']),
+        ('year__gte=1989&year__lte=1989', ['1989-01-01', '1989-12-31']),
+        ('date__gte=1989-01-01&date__lt=1990-01-01',
+         ['1989-01-01', '1989-12-31']),
+    ])
+    def test_days_within_years(self, client, query, dates):
+        assert self.get_dates(
+            client,
+            f'/api/weather/?station__code=boundaries&{query}') == dates
+
+    def test_export_filtered_on_year(self, client):
+        response = client.get(
+            '/api/weather/export?format=ndjson&station__code=boundaries'
+            '&year=1990')
+
+        assert [
+            json.loads(line)['date']
+            for line in b''.join(response.streaming_content).splitlines()
+        ] == ['1990-01-01']
+
+    @pytest.mark.parametrize('query', ['year=x', 'year=0', 'year__lte=9999'])
+    def test_invalid_years_rejected(self, client, query):
+        assert client.get(f'/api/weather/?{query}').status_code == 400
+
+    def test_year_filter_is_a_range_scan_of_the_date(self, client):
+        with CaptureQueriesContext(connection) as queries:
+            client.get('/api/weather/?station__code=boundaries&year=1989'
+                       '&cursor=')
+        [page_query] = [
+            query['sql'] for query in queries.captured_queries
+            if 'history_weatherday' in query['sql']
+        ]
+
+        assert '"date" >= \'1989-01-01\'' in page_query
+        assert '"date" < \'1990-01-01\'' in page_query
+        assert 'extract' not in page_query.lower()
+        if connection.vendor == 'sqlite':
+            with connection.cursor() as cursor:
+                cursor.execute(f'EXPLAIN QUERY PLAN {page_query}')
+                plan = '\n'.join(row[-1] for row in cursor.fetchall())
+            assert 'COVERING INDEX weatherday_station_date_cover' in plan
+            assert '(station_id=? AND date>? AND date<?)' in plan
+            assert 'TEMP B-TREE' not in plan
+
+    def test_date_lt_limits_the_data_version_years(self, client):
+        url = ('/api/weather/?station__code=boundaries'
+               '&date__lt=1990-01-01')
+        etag = client.get(url)['ETag']
+
+        mark_data_ingested([(station_cache.ids(['boundaries'])['boundaries'],
+                             1990)])
+
+        assert client.get(url)['ETag'] == etag
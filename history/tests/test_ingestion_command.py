@@ -1,11 +1,54 @@
+import bz2
+import datetime
+import gzip
+import hashlib
+import io
+import logging
+import logging.config
+import lzma
+import os
+import pstats
+import tarfile
+import zipfile
+from decimal import Decimal
 from pathlib import Path
 
 from django.core.management import call_command, CommandError
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Count, Q
+from django.test.utils import CaptureQueriesContext
 import pytest
 
+from benchmarks.synthetic import (write_synthetic_station,
+                                  write_synthetic_stations)
+from history.changes import rows_checksum
+from history.ingest_metrics import IngestMetrics
+from history.inputs import station_code_for
 from history.management.commands.ingest_history import Command
 
-from history.models import WeatherStation, WeatherDay, WeatherStats
+from history.loaders import PostgresCopyLoader, get_loader
+from history.models import (IngestedFile, WeatherDataVersion, WeatherDay,
+                            WeatherMonthStats, WeatherStation, WeatherStats)
+from history.parsing import MISSING_VALUE, ColumnBatch, iter_column_batches
+from history.series import SeriesRecorder, read_series
+from history.watching import DirectoryWatcher
+from history.statistics import EXTREME_FIELDS, TOTAL_FIELDS, sum_month_totals
+
+
+@pytest.fixture(params=['orm', 'copy'])
+def loader(request):
+    """run a test once per WeatherDay loader the database supports"""
+    if request.param == 'copy' and connection.vendor != 'postgresql':
+        pytest.skip('the copy loader requires PostgreSQL')
+    return request.param
+
+
+def write_station_file(directory, rows) -> str:
+    """write rows of column strings as STATION.txt in directory, returning
+    its path"""
+    path = directory / 'STATION.txt'
+    path.write_text(''.join('\t'.join(row) + '\n' for row in rows))
+    return str(path)
 
 
 class TestIngestHistoryCommandCalls:
@@ -29,11 +72,23 @@ class TestIngestHistoryCommandCalls:
 
         assert WeatherStation.objects.filter(code='EMPTYFILE0').exists()
 
+    def test_copy_loader_requires_postgresql(self, db):
+        if connection.vendor == 'postgresql':
+            pytest.skip('only relevant to other databases')
+
+        with pytest.raises(CommandError) as e:
+            call_command('ingest_history',
+                         'history/tests/files_for_testing/EMPTYFILE0.txt',
+                         loader='copy')
+
+        assert 'the copy loader requires PostgreSQL' in str(e)
+
     def test_correct_values_and_statistics_stored_and_duplicates_overwritten(
-            self, db):
+            self, db, loader):
         call_command(
             'ingest_history',
-            'history/tests/files_for_testing/directory/file_to_load2.txt')
+            'history/tests/files_for_testing/directory/file_to_load2.txt',
+            loader=loader)
 
         assert WeatherDay.objects.count() == 2
         assert WeatherDay.objects.filter(
@@ -63,6 +118,855 @@ class TestIngestHistoryCommandCalls:
             total_precipitation=.53,
         ).exists()
 
+    def test_batch_size_does_not_change_what_is_stored(self, db, loader):
+        call_command('ingest_history',
+                     'history/tests/files_for_testing/directory',
+                     batch_size=1,
+                     loader=loader)
+
+        assert WeatherDay.objects.count() == 6
+        assert WeatherStats.objects.filter(
+            station__code='file_to_load2',
+            year=1989,
+            avg_temperature_max=15.55,
+            avg_temperature_min=-4.40,
+            total_precipitation=.53,
+        ).exists()
+
+    @pytest.mark.parametrize('batch_size', [0, -1])
+    def test_batch_size_must_be_positive(self, db, batch_size):
+        with pytest.raises(CommandError) as e:
+            call_command('ingest_history',
+                         'history/tests/files_for_testing/directory',
+                         batch_size=batch_size)
+
+        assert '--batch-size must be at least 1' in str(e)
+        assert not IngestedFile.objects.exists()
+
+    def test_malformed_line_fails_the_file(self, db, tmp_path):
+        path = tmp_path / 'STATION.txt'
+        path.write_text('19890101\t1\t2\t3\n'
+                        'n/a\t4\t5\t6\n'
+                        '19890103\t7\t8\t9\n')
+
+        with pytest.raises(ValueError):
+            call_command('ingest_history', str(path))
+
+        assert not WeatherDay.objects.exists()
+        assert not IngestedFile.objects.exists()
+
+    def test_loads_share_a_transaction(self, db, loader):
+        station = WeatherStation.objects.create(code='STATION')
+        with transaction.atomic():
+            for path in ('file_to_load.txt', 'file_to_load2.txt'):
+                with open(f'history/tests/files_for_testing/directory/{path}',
+                          'rb') as file:
+                    get_loader(loader).load(station,
+                                            iter_column_batches(file))
+
+        assert WeatherDay.objects.count() == 4
+
+    def test_reingesting_overwrites_existing_rows(self, db, loader):
+        station = WeatherStation.objects.create(code='file_to_load')
+        WeatherDay.objects.create(station=station,
+                                  date=datetime.date(1989, 3, 16),
+                                  temperature_max=1,
+                                  temperature_min=1,
+                                  precipitation=1)
+
+        call_command(
+            'ingest_history',
+            'history/tests/files_for_testing/directory/file_to_load.txt',
+            loader=loader)
+
+        assert WeatherDay.objects.count() == 4
+        assert WeatherDay.objects.filter(date=datetime.date(1989, 3, 16),
+                                         temperature_max=94,
+                                         temperature_min=-33,
+                                         precipitation=0).exists()
+
+
+    def test_synthetic_files_ingested_with_missing_values_and_duplicates(
+            self, db, tmp_path):
+        written = write_synthetic_stations(tmp_path,
+                                           num_stations=2,
+                                           num_years=2,
+                                           missing=0.1,
+                                           duplicates=0.05)
+
+        call_command('ingest_history', str(tmp_path))
+
+        assert written['rows'] > written['days'] == 2 * 730
+        assert WeatherDay.objects.count() == written['days']
+        assert WeatherDay.objects.filter(temperature_max=None).exists()
+        assert WeatherStats.objects.count() == 4
+
+
+class TestIncrementalStatistics:
+
+    def stored_statistics(self):
+        return list(WeatherStats.objects.values_list(
+            'year', 'avg_temperature_max', 'avg_temperature_min',
+            'total_precipitation', 'temperature_max_total',
+            'temperature_max_count', 'temperature_min_total',
+            'temperature_min_count', 'precipitation_total',
+            'precipitation_count'))
+
+    @pytest.mark.parametrize('stats', ['incremental', 'recompute', 'deferred'])
+    def test_totals_stored_alongside_statistics(self, db, stats):
+        call_command(
+            'ingest_history',
+            'history/tests/files_for_testing/directory/file_to_load2.txt',
+            stats=stats)
+
+        assert self.stored_statistics() == [
+            (1989, Decimal('15.55'), Decimal('-4.40'), Decimal('0.53'), 311,
+             2, -44, 1, 53, 1),
+        ]
+
+    def test_reingesting_changed_rows_matches_a_full_recompute(
+            self, db, tmp_path):
+        original = [
+            ('19891230', '10', '-10', '1'),
+            ('19891231', '20', '-20', '2'),
+            ('19900101', '30', '-30', '-9999'),
+        ]
+        corrected = [
+            ('19891231', '-9999', '-25', '4'),
+            ('19900101', '31', '-30', '3'),
+            ('19900102', '40', '-40', '0'),
+        ]
+        call_command('ingest_history',
+                     write_station_file(tmp_path, original))
+        call_command('ingest_history',
+                     write_station_file(tmp_path, corrected))
+        incremental = self.stored_statistics()
+
+        WeatherStats.objects.all().delete()
+        call_command('ingest_history',
+                     write_station_file(tmp_path, corrected),
+                     stats='recompute',
+                     force=True)
+
+        assert incremental == self.stored_statistics() == [
+            (1989, Decimal('1.00'), Decimal('-1.75'), Decimal('0.05'), 10, 1,
+             -35, 2, 5, 2),
+            (1990, Decimal('3.55'), Decimal('-3.50'), Decimal('0.03'), 71, 2,
+             -70, 2, 3, 2),
+        ]
+
+    @pytest.mark.parametrize('stats', ['incremental', 'recompute', 'deferred'])
+    def test_averages_rounded_half_away_from_zero(self, db, tmp_path,
+                                                  stats):
+        rows = [('19900101', '1', '-1', '0'), ('19900102', '0', '0', '0'),
+                ('19900103', '0', '0', '0'), ('19900104', '0', '0', '0')]
+
+        call_command('ingest_history',
+                     write_station_file(tmp_path, rows),
+                     stats=stats)
+
+        assert WeatherStats.objects.values_list(
+            'avg_temperature_max', 'avg_temperature_min').get() == (
+                Decimal('0.03'), Decimal('-0.03'))
+
+    def test_deferred_statistics_refreshed_once_at_end_of_run(self, db):
+        with CaptureQueriesContext(connection) as captured:
+            call_command('ingest_history',
+                         'history/tests/files_for_testing/directory',
+                         stats='deferred')
+
+        assert len([
+            query for query in captured.captured_queries
+            if 'INSERT INTO "history_weatherstats"' in query['sql']
+        ]) == 1
+        assert WeatherStats.objects.filter(
+            station__code='file_to_load2',
+            year=1989,
+            avg_temperature_max=15.55,
+            avg_temperature_min=-4.40,
+            total_precipitation=.53,
+        ).exists()
+        call_command('verify_statistics')
+
+    @pytest.mark.parametrize('workers', [1, 2])
+    def test_deferred_statistics_of_files_before_a_failure_refreshed(
+            self, transactional_db, tmp_path, workers):
+        # zip members are ingested in order, and the negative
+        #  precipitation fails the second station's file
+        with zipfile.ZipFile(tmp_path / 'stations.zip', 'w') as archive:
+            archive.writestr('GOOD.txt', '19890101\t100\t10\t5\n')
+            archive.writestr('BAD.txt', '19890101\t100\t10\t-5\n')
+
+        with pytest.raises(IntegrityError):
+            call_command('ingest_history', str(tmp_path / 'stations.zip'),
+                         stats='deferred', workers=workers)
+
+        assert IngestedFile.objects.get().station.code == 'GOOD'
+        assert WeatherStats.objects.get().station.code == 'GOOD'
+        assert WeatherMonthStats.objects.get().station.code == 'GOOD'
+        call_command('verify_statistics')
+
+    def test_failed_file_leaves_nothing_written(self, db, tmp_path):
+        # the negative precipitation fails the second batch
+        rows = [('19890101', '100', '10', '5'),
+                ('19900102', '100', '10', '-5')]
+        path = write_station_file(tmp_path, rows)
+        with pytest.raises(IntegrityError):
+            call_command('ingest_history', path, batch_size=1)
+
+        assert not WeatherDay.objects.exists()
+        assert not IngestedFile.objects.exists()
+
+        rows[1] = ('19900102', '100', '10', '5')
+        call_command('ingest_history', write_station_file(tmp_path, rows),
+                     batch_size=1)
+
+        assert list(WeatherStats.objects.values_list('year', flat=True)) == [
+            1989, 1990
+        ]
+        call_command('verify_statistics')
+
+    def test_unchanged_years_are_not_rewritten(self, db, tmp_path):
+        rows = [('19891231', '20', '-20', '2'), ('19900101', '30', '-30', '3')]
+        call_command('ingest_history', write_station_file(tmp_path, rows))
+        WeatherStats.objects.filter(year=1989).update(avg_temperature_max=99)
+
+        rows[1] = ('19900101', '31', '-30', '3')
+        call_command('ingest_history', write_station_file(tmp_path, rows))
+
+        assert WeatherStats.objects.get(year=1989).avg_temperature_max == 99
+        assert WeatherStats.objects.get(
+            year=1990).avg_temperature_max == Decimal('3.10')
+
+
+class TestMonthlyStatistics:
+
+    def stored_month_stats(self):
+        return list(WeatherMonthStats.objects.order_by(
+            'year', 'month').values_list('year', 'month', *TOTAL_FIELDS,
+                                         *EXTREME_FIELDS))
+
+    @pytest.mark.parametrize('stats', ['incremental', 'recompute', 'deferred'])
+    def test_rollups_stored_per_month(self, db, tmp_path, stats):
+        (tmp_path / 'STATION.txt').write_text(
+            '19891230\t  10\t  -10\t    1\n'
+            '19891231\t  20\t  -9999\t    2\n'
+            '19900101\t  30\t  -30\t    -9999\n')
+
+        call_command('ingest_history', str(tmp_path), stats=stats)
+
+        assert self.stored_month_stats() == [
+            (1989, 12, 30, 2, -10, 1, 3, 2, 10, 20, -10, -10, 1, 2),
+            (1990, 1, 30, 1, -30, 1, 0, 0, 30, 30, -30, -30, None, None),
+        ]
+
+    @pytest.mark.parametrize('stats', ['incremental', 'recompute', 'deferred'])
+    def test_last_days_of_the_calendar_ingested(self, db, tmp_path, stats):
+        (tmp_path / 'STATION.txt').write_text(
+            '99991130\t  10\t  -10\t    1\n'
+            '99991231\t  20\t  -20\t    2\n')
+
+        call_command('ingest_history', str(tmp_path), stats=stats)
+
+        assert self.stored_month_stats() == [
+            (9999, 11, 10, 1, -10, 1, 1, 1, 10, 10, -10, -10, 1, 1),
+            (9999, 12, 20, 1, -20, 1, 2, 1, 20, 20, -20, -20, 2, 2),
+        ]
+        assert WeatherStats.objects.get().year == 9999
+        call_command('verify_statistics')
+
+    def test_reingesting_lowers_extremes(self, db, tmp_path):
+        path = tmp_path / 'STATION.txt'
+        path.write_text('19900101\t  30\t  -30\t    5\n'
+                        '19900102\t  10\t  -10\t    0\n')
+        call_command('ingest_history', str(path))
+
+        path.write_text('19900101\t  5\t  -5\t    0\n')
+        call_command('ingest_history', str(path))
+
+        assert self.stored_month_stats() == [
+            (1990, 1, 15, 2, -15, 2, 0, 2, 5, 10, -10, -5, 0, 0),
+        ]
+
+    def test_summed_months_match_yearly_statistics(self, db):
+        call_command('ingest_history',
+                     'history/tests/files_for_testing/directory')
+
+        assert sorted(
+            tuple(r[field] for field in ('station_id', 'year') + TOTAL_FIELDS)
+            for r in sum_month_totals(WeatherMonthStats.objects.all(),
+                                      'station_id')) == sorted(
+                WeatherStats.objects.values_list('station_id', 'year',
+                                                 *TOTAL_FIELDS))
+
+
+class TestParallelIngestion:
+
+    def test_workers_must_be_positive(self):
+        with pytest.raises(CommandError) as e:
+            call_command('ingest_history',
+                         'history/tests/files_for_testing/directory',
+                         workers=0)
+
+        assert '--workers must be at least 1' in str(e)
+
+    def test_station_locked_for_each_file(self, db):
+        if not connection.features.has_select_for_update:
+            pytest.skip('the database does not lock rows')
+
+        with CaptureQueriesContext(connection) as queries:
+            call_command(
+                'ingest_history',
+                'history/tests/files_for_testing/directory/file_to_load.txt')
+
+        assert [
+            query['sql'] for query in queries.captured_queries
+            if 'FROM "history_weatherstation"' in query['sql']
+        ][0].endswith('FOR UPDATE')
+
+    def test_totals_and_rows_match_serial_run(self, transactional_db,
+                                              caplog):
+        caplog.set_level(logging.INFO)
+        call_command('ingest_history',
+                     'history/tests/files_for_testing/directory')
+        # ordered by code, as parallel workers may create the stations in
+        #  either order
+        serial_rows = list(WeatherDay.objects.values_list(
+            'station__code', 'date', 'temperature_max', 'temperature_min',
+            'precipitation').order_by('station__code', 'date'))
+        serial_stats = list(WeatherStats.objects.values_list(
+            'station__code', 'year', 'avg_temperature_max',
+            'avg_temperature_min',
+            'total_precipitation').order_by('station__code', 'year'))
+        WeatherStation.objects.all().delete()
+
+        call_command('ingest_history',
+                     'history/tests/files_for_testing/directory',
+                     workers=2)
+
+        serial_summary, parallel_summary = [
+            record.msg for record in caplog.records
+            if record.msg.get('msg') == 'ingestion finished'
+        ]
+        assert parallel_summary['records_ingested'] == serial_summary[
+            'records_ingested'] == 6
+        assert parallel_summary['files_processed'] == serial_summary[
+            'files_processed'] == 2
+        assert parallel_summary['rows_upserted'] == serial_summary[
+            'rows_upserted'] == 6
+        assert list(WeatherDay.objects.values_list(
+            'station__code', 'date', 'temperature_max', 'temperature_min',
+            'precipitation').order_by('station__code', 'date')) == serial_rows
+        assert list(WeatherStats.objects.values_list(
+            'station__code', 'year', 'avg_temperature_max',
+            'avg_temperature_min',
+            'total_precipitation').order_by('station__code',
+                                            'year')) == serial_stats
+
+
+class TestIngestMetrics:
+
+    def get_logged(self, caplog, msg):
+        return [
+            record.msg for record in caplog.records
+            if isinstance(record.msg, dict) and record.msg.get('msg') == msg
+        ]
+
+    @pytest.mark.parametrize('stats', ['incremental', 'deferred'])
+    def test_phases_and_counts_logged_per_file_and_run(
+            self, db, caplog, stats):
+        caplog.set_level(logging.INFO)
+
+        call_command('ingest_history',
+                     'history/tests/files_for_testing/directory',
+                     stats=stats)
+
+        files = self.get_logged(caplog, 'file ingested')
+        [run] = self.get_logged(caplog, 'ingestion finished')
+        assert len(files) == 2
+        assert {'parse', 'load', 'statistics', 'monthly_statistics',
+                'versions'} <= run['phases'].keys()
+        for metrics in files + [run]:
+            assert {'parse', 'load', 'versions'} <= metrics['phases'].keys()
+            assert metrics['seconds'] == pytest.approx(
+                sum(phase['seconds']
+                    for phase in metrics['phases'].values()),
+                abs=1e-4)
+            assert metrics['queries'] == sum(
+                phase['queries'] for phase in metrics['phases'].values())
+            assert metrics['rows_parsed'] - metrics[
+                'rows_duplicate'] == metrics['rows_upserted']
+        assert run['rows_upserted'] == 6
+        assert run['bytes_read'] == sum(
+            path.stat().st_size for path in Path(
+                'history/tests/files_for_testing/directory').glob('*.txt'))
+        assert run['phases']['load']['queries'] > 0
+        assert run['wall_seconds'] >= run['seconds']
+
+    def test_nested_phases_are_not_double_counted(self, monkeypatch):
+        clock = iter(range(100))
+        monkeypatch.setattr('history.ingest_metrics.time.perf_counter',
+                            lambda: next(clock))
+        metrics = IngestMetrics()
+
+        def produce():
+            yield 1
+            yield 2
+
+        with metrics.phase('load'):
+            assert list(metrics.track(produce(), 'parse')) == [1, 2]
+
+        # each parse step, including the one finding the end, takes one
+        #  tick, as do the three stretches of load between them
+        assert metrics.seconds == {'parse': 3, 'load': 4}
+
+    def test_profile_written(self, db, tmp_path):
+        path = tmp_path / 'ingest.prof'
+
+        call_command('ingest_history',
+                     'history/tests/files_for_testing/directory',
+                     profile=str(path))
+
+        assert pstats.Stats(str(path)).total_calls > 0
+
+    def test_profile_cannot_be_combined_with_workers(self, tmp_path):
+        with pytest.raises(CommandError) as e:
+            call_command('ingest_history',
+                         'history/tests/files_for_testing/directory',
+                         workers=2,
+                         profile=str(tmp_path / 'ingest.prof'))
+
+        assert '--profile cannot be combined with --workers' in str(e)
+
+
+class TestMissingDataReporting:
+
+    def get_logged(self, caplog, msg):
+        return [
+            record.msg for record in caplog.records
+            if isinstance(record.msg, dict) and record.msg.get('msg') == msg
+        ]
+
+    def write_station(self, tmp_path):
+        path = tmp_path / 'SYN00000000.txt'
+        write_synthetic_station(path, num_years=2, missing=0.1)
+        return path
+
+    def test_rows_mode_logs_every_row(self, db, tmp_path, caplog):
+        path = self.write_station(tmp_path)
+
+        call_command('ingest_history', str(path))
+
+        rows = self.get_logged(caplog, 'ingesting a row with missing data')
+        assert rows and len(rows) == WeatherDay.objects.filter(
+            Q(temperature_max=None) | Q(temperature_min=None)
+            | Q(precipitation=None)).count()
+        assert not self.get_logged(caplog, 'missing data summary')
+
+    def test_summary_mode_logs_counts_by_year_and_sample_rows(
+            self, db, tmp_path, caplog):
+        path = self.write_station(tmp_path)
+
+        call_command('ingest_history', str(path), missing_data='summary',
+                     missing_data_samples=3)
+
+        rows = self.get_logged(caplog, 'ingesting a row with missing data')
+        assert len(rows) == 3
+        [summary] = self.get_logged(caplog, 'missing data summary')
+        assert summary['station'] == 'SYN00000000'
+        assert summary['samples_logged'] == 3
+        assert summary['years'].keys() == {1950, 1951}
+        for year, counts in summary['years'].items():
+            days = WeatherDay.objects.filter(date__year=year)
+            for field in ('temperature_max', 'temperature_min',
+                          'precipitation'):
+                assert counts[f'missing_{field}'] == days.filter(
+                    **{field: None}).count()
+        assert summary['rows_with_missing_data'] == sum(
+            counts['rows_with_missing_data']
+            for counts in summary['years'].values())
+
+    def test_background_handler_passes_records_on(self):
+        stream = io.StringIO()
+        logging.config.dictConfig({
+            'version': 1,
+            'handlers': {
+                'stream': {
+                    'class': 'logging.StreamHandler',
+                    'stream': stream,
+                },
+                'background': {
+                    '()': 'weather.log_handlers.BackgroundHandler',
+                    'handlers': ['cfg://handlers.stream'],
+                },
+            },
+            'loggers': {
+                'test_background': {
+                    'handlers': ['background'],
+                    'propagate': False,
+                },
+            },
+            'incremental': False,
+            'disable_existing_loggers': False,
+        })
+        logger = logging.getLogger('test_background')
+        [handler] = logger.handlers
+        try:
+            logger.warning('queued')
+            handler.flush()
+
+            assert stream.getvalue() == 'queued\n'
+        finally:
+            logger.removeHandler(handler)
+            handler.close()
+
+
+class TestChangedRows:
+
+    def ingest(self, path, caplog, **options):
+        caplog.clear()
+        call_command('ingest_history', path, **options)
+        [metrics] = [
+            record.msg for record in caplog.records
+            if isinstance(record.msg, dict)
+            and record.msg.get('msg') == 'file ingested'
+        ]
+        return metrics
+
+    def test_only_new_and_modified_rows_written(self, db, tmp_path,
+                                                caplog):
+        caplog.set_level(logging.INFO)
+        rows = [('19891230', '10', '-10', '1'),
+                ('19891231', '20', '-20', '2'),
+                ('19900101', '30', '-30', '3')]
+        write_station_file(tmp_path, rows)
+        first = self.ingest(str(tmp_path), caplog)
+        versions = dict(
+            WeatherDataVersion.objects.values_list('year', 'version'))
+
+        rows[1] = ('19891231', '-9999', '-20', '2')
+        rows.append(('19900102', '40', '-40', '4'))
+        path = write_station_file(tmp_path, rows)
+        with CaptureQueriesContext(connection) as queries:
+            second = self.ingest(path, caplog)
+
+        assert first['rows_inserted'] == first['rows_upserted'] == 3
+        assert (second['rows_inserted'], second['rows_updated'],
+                second['rows_unchanged'],
+                second['rows_upserted']) == (1, 1, 2, 2)
+        assert not [
+            query for query in queries
+            if query['sql'].startswith('INSERT INTO "history_weatherday"')
+            and "'1989-12-30'" in query['sql']
+        ]
+        assert WeatherDay.objects.get(
+            date=datetime.date(1989, 12, 31)).temperature_max is None
+        # bumped with the days, and again once the series is updated
+        assert WeatherDataVersion.objects.get(
+            year=1990).version == versions[1990] + 2
+
+    def test_unchanged_years_skipped_by_checksum(self, db, tmp_path,
+                                                 caplog):
+        caplog.set_level(logging.INFO)
+        rows = [('19891231', '20', '-20', '2'),
+                ('19900101', '30', '-30', '3')]
+        write_station_file(tmp_path, rows)
+        self.ingest(str(tmp_path), caplog)
+        versions = dict(
+            WeatherDataVersion.objects.values_list('year', 'version'))
+
+        rows.append(('19910101', '40', '-40', '4'))
+        metrics = self.ingest(write_station_file(tmp_path, rows), caplog)
+
+        # the stored checksums, then the days of 1991 only
+        assert metrics['phases']['compare']['queries'] == 2
+        assert metrics['rows_unchanged'] == 2
+        assert metrics['rows_inserted'] == 1
+        assert dict(
+            WeatherDataVersion.objects.filter(
+                year__lt=1991).values_list('year', 'version')) == versions
+        assert WeatherStats.objects.filter(year=1991).exists()
+
+    def test_force_writes_every_row(self, db, tmp_path, caplog):
+        caplog.set_level(logging.INFO)
+        path = write_station_file(tmp_path,
+                                  [('19900101', '30', '-30', '3')])
+        self.ingest(path, caplog)
+
+        metrics = self.ingest(path, caplog, force=True)
+
+        assert metrics['rows_upserted'] == 1
+        assert 'compare' not in metrics['phases']
+
+    def test_checksum_ignores_order_but_not_values(self):
+        batch = ColumnBatch.from_rows([
+            (datetime.date(1990, 1, 1), 10, -10, 0),
+            (datetime.date(1990, 1, 2), 20, None, 5),
+        ])
+        swapped = ColumnBatch.from_rows([
+            (datetime.date(1990, 1, 1), 20, None, 5),
+            (datetime.date(1990, 1, 2), 10, -10, 0),
+        ])
+
+        assert rows_checksum(batch) == rows_checksum(batch[::-1])
+        assert rows_checksum(batch) != rows_checksum(swapped)
+        assert rows_checksum(batch) != rows_checksum(batch[:1])
+
+
+class TestIngestionManifest:
+
+    def get_finished(self, caplog):
+        return [
+            record.msg for record in caplog.records
+            if isinstance(record.msg, dict)
+            and record.msg.get('msg') == 'ingestion finished'
+        ][-1]
+
+    def test_files_recorded_with_fingerprint_and_station(self, db):
+        call_command('ingest_history',
+                     'history/tests/files_for_testing/directory')
+
+        path = Path('history/tests/files_for_testing/directory/'
+                    'file_to_load.txt')
+        entry = IngestedFile.objects.get(path=str(path.resolve()))
+        assert entry.station.code == 'file_to_load'
+        assert entry.size == path.stat().st_size
+        assert entry.mtime_ns == path.stat().st_mtime_ns
+        assert entry.sha256 == hashlib.sha256(path.read_bytes()).hexdigest()
+        assert entry.records_ingested == 4
+        assert IngestedFile.objects.count() == 2
+
+    def test_unchanged_files_skipped_unless_forced(self, db, caplog):
+        caplog.set_level(logging.INFO)
+        directory = 'history/tests/files_for_testing/directory'
+        call_command('ingest_history', directory)
+
+        with CaptureQueriesContext(connection) as queries:
+            call_command('ingest_history', directory)
+        assert self.get_finished(caplog)['files_unchanged'] == 2
+        assert self.get_finished(caplog)['files_processed'] == 0
+        assert len(queries) == 1
+
+        call_command('ingest_history', directory, force=True)
+        assert self.get_finished(caplog)['files_processed'] == 2
+
+    def test_changed_and_touched_files(self, db, tmp_path, caplog):
+        caplog.set_level(logging.INFO)
+        changed = tmp_path / 'changed.txt'
+        touched = tmp_path / 'touched.txt'
+        for path in (changed, touched):
+            path.write_text('19850101\t   10\t   -5\t    0\n')
+        call_command('ingest_history', str(tmp_path))
+
+        changed.write_text('19850101\t   20\t   -5\t    0\n')
+        os.utime(touched, ns=(0, 1_000_000_000))
+        call_command('ingest_history', str(tmp_path))
+
+        assert self.get_finished(caplog)['files_processed'] == 1
+        assert WeatherDay.objects.get(
+            station__code='changed').temperature_max == 20
+        # the new modification time is remembered, so the file is not
+        #  hashed again
+        assert IngestedFile.objects.get(
+            station__code='touched').mtime_ns == 1_000_000_000
+
+
+class TestCompressedAndArchivedInput:
+
+    source = Path('history/tests/files_for_testing/directory/file_to_load.txt')
+
+    def stored_days(self):
+        return dict(
+            WeatherDay.objects.values('station__code').annotate(
+                days=Count('pk')).values_list('station__code', 'days'))
+
+    def write_inputs(self, directory):
+        """the test file compressed each way and inside each archive kind,
+        under different station codes"""
+        contents = self.source.read_bytes()
+        directory.mkdir(parents=True, exist_ok=True)
+        (directory / 'GZ.txt.gz').write_bytes(gzip.compress(contents))
+        (directory / 'BZ.txt.bz2').write_bytes(bz2.compress(contents))
+        (directory / 'XZ.txt.xz').write_bytes(lzma.compress(contents))
+        with zipfile.ZipFile(directory / 'stations.zip', 'w',
+                             zipfile.ZIP_DEFLATED) as archive:
+            archive.writestr('nested/ZIPPED.txt', contents)
+            archive.writestr('ZIPPEDGZ.txt.gz', gzip.compress(contents))
+        with tarfile.open(directory / 'stations.tar.gz', 'w:gz') as archive:
+            for name in ('TARRED1.txt', 'TARRED2.txt'):
+                info = tarfile.TarInfo(name)
+                info.size = len(contents)
+                info.mtime = 1_000_000
+                archive.addfile(info, io.BytesIO(contents))
+
+    def test_compressed_files_and_archive_members_ingested(
+            self, db, tmp_path):
+        self.write_inputs(tmp_path / 'inputs')
+
+        call_command('ingest_history', str(tmp_path / 'inputs'))
+
+        assert self.stored_days() == {
+            code: 4
+            for code in ('GZ', 'BZ', 'XZ', 'ZIPPED', 'ZIPPEDGZ', 'TARRED1',
+                         'TARRED2')
+        }
+        assert IngestedFile.objects.filter(
+            path=f'{(tmp_path / "inputs/stations.tar.gz").resolve()}'
+            ':TARRED2.txt',
+            sha256=hashlib.sha256(
+                self.source.read_bytes()).hexdigest()).exists()
+
+    def test_unchanged_members_skipped(self, db, tmp_path, caplog):
+        caplog.set_level(logging.INFO)
+        self.write_inputs(tmp_path / 'inputs')
+        call_command('ingest_history', str(tmp_path / 'inputs'))
+
+        call_command('ingest_history', str(tmp_path / 'inputs'))
+
+        [_, finished] = [
+            record.msg for record in caplog.records
+            if isinstance(record.msg, dict)
+            and record.msg.get('msg') == 'ingestion finished'
+        ]
+        assert finished['files_processed'] == 0
+        assert finished['files_unchanged'] == 7
+
+    def test_subdirectories_ingested_when_recursive(self, db, tmp_path):
+        directory = tmp_path / 'inputs'
+        self.write_inputs(directory / 'one' / 'two')
+        (directory / 'PLAIN.txt').write_bytes(self.source.read_bytes())
+
+        call_command('ingest_history', str(directory))
+        assert self.stored_days() == {'PLAIN': 4}
+
+        call_command('ingest_history', str(directory), recursive=True)
+        assert len(self.stored_days()) == 8
+
+    def test_tar_members_spread_across_workers(self, transactional_db,
+                                               tmp_path):
+        write_synthetic_stations(tmp_path / 'files', num_stations=4,
+                                 num_years=1)
+        with tarfile.open(tmp_path / 'stations.tar.xz', 'w:xz') as archive:
+            archive.add(tmp_path / 'files', arcname='files')
+
+        call_command('ingest_history', str(tmp_path / 'stations.tar.xz'),
+                     workers=2)
+
+        assert self.stored_days() == {
+            f'SYN{i:08d}': 365
+            for i in range(4)
+        }
+
+    @pytest.mark.parametrize('name, code', [
+        ('USC00011084.txt', 'USC00011084'),
+        ('USC00011084.txt.gz', 'USC00011084'),
+        ('ghcnd/USC00011084.dly.XZ', 'USC00011084'),
+        ('USC00011084', 'USC00011084'),
+    ])
+    def test_station_code_from_member_name(self, name, code):
+        assert station_code_for(name) == code
+
+
+class TestWatchMode:
+
+    source = Path('history/tests/files_for_testing/directory/file_to_load.txt')
+
+    def write_settled(self, path, contents=None):
+        """a file last modified long enough ago to have settled"""
+        path.write_bytes(self.source.read_bytes()
+                         if contents is None else contents)
+        os.utime(path, (1_000_000, 1_000_000))
+
+    def ready_names(self, watcher, **kwargs):
+        return sorted(pending.path.name
+                      for pending in watcher.next_batch(timeout=0, **kwargs))
+
+    @pytest.mark.parametrize('use_inotify', [False, True])
+    def test_settled_files_handed_out_in_batches(self, tmp_path, use_inotify):
+        for code in ('A', 'B', 'C'):
+            self.write_settled(tmp_path / f'{code}.txt')
+        watcher = DirectoryWatcher(tmp_path, settle_seconds=60,
+                                   poll_interval=0.01,
+                                   use_inotify=use_inotify)
+
+        assert len(self.ready_names(watcher, max_files=2)) == 2
+        assert watcher.backlog == 1
+        assert len(self.ready_names(watcher)) == 1
+        assert self.ready_names(watcher) == []
+        watcher.close()
+
+    @pytest.mark.parametrize('use_inotify', [False, True])
+    def test_new_and_modified_files_handed_out_again(self, tmp_path,
+                                                     use_inotify):
+        self.write_settled(tmp_path / 'A.txt')
+        watcher = DirectoryWatcher(tmp_path, settle_seconds=60,
+                                   poll_interval=0.01,
+                                   use_inotify=use_inotify)
+        assert self.ready_names(watcher) == ['A.txt']
+
+        self.write_settled(tmp_path / 'A.txt', b'changed')
+        self.write_settled(tmp_path / 'B.txt')
+        watcher.wait_for_changes(0.1)
+
+        assert self.ready_names(watcher) == ['A.txt', 'B.txt']
+        watcher.close()
+
+    def test_files_still_being_written_left_alone(self, tmp_path):
+        (tmp_path / 'A.txt').write_bytes(self.source.read_bytes())
+        watcher = DirectoryWatcher(tmp_path, settle_seconds=60,
+                                   use_inotify=False)
+
+        assert self.ready_names(watcher) == []
+        assert watcher.backlog == 1
+
+        watcher.settle_seconds = 0
+        assert self.ready_names(watcher) == ['A.txt']
+
+    def test_watch_ingests_batches_until_interrupted(
+            self, db, tmp_path, caplog, monkeypatch):
+        caplog.set_level(logging.INFO)
+        directory = tmp_path / 'inputs'
+        directory.mkdir()
+        for code in ('A', 'B', 'C'):
+            self.write_settled(directory / f'{code}.txt')
+
+        # stop after the files present at the start are ingested
+        next_batch = DirectoryWatcher.next_batch
+
+        def next_batch_until_idle(watcher, max_files, timeout=None):
+            ready = next_batch(watcher, max_files, timeout=0)
+            if not ready:
+                raise KeyboardInterrupt
+            return ready
+
+        monkeypatch.setattr(DirectoryWatcher, 'next_batch',
+                            next_batch_until_idle)
+
+        call_command('ingest_history', str(directory), watch=True,
+                     watch_batch_size=2, watch_polling=True)
+
+        logged = [
+            record.msg for record in caplog.records
+            if isinstance(record.msg, dict)
+        ]
+        [watching] = [msg for msg in logged if msg['msg'] == 'watching']
+        assert watching['watcher'] == 'polling'
+        batches = [
+            msg for msg in logged if msg['msg'] == 'watch batch ingested'
+        ]
+        assert [batch['files_processed'] for batch in batches] == [2, 1]
+        assert [batch['backlog_files'] for batch in batches] == [1, 0]
+        assert all(batch['latency_seconds'] >= batch['ingest_seconds']
+                   for batch in batches)
+        assert batches[0]['rows_inserted'] == 8
+        [stopped] = [msg for msg in logged if msg['msg'] == 'watch stopped']
+        assert stopped['batches'] == 2
+        assert WeatherDay.objects.count() == 12
+
+    def test_watch_requires_directory(self, db):
+        with pytest.raises(CommandError, match='requires a directory'):
+            call_command('ingest_history', str(self.source), watch=True)
+
 
 class TestIterFilesToProcess:
 
@@ -96,3 +1000,229 @@ class TestIterRowsToProcess:
                 ['19890315', None, '6', '0'],
                 ['19890316', '94', '-33', '0'],
             ]
+
+
+class TestIterBatchesToProcess:
+
+    def test_no_batches_to_process_when_arg_is_empty_file(self):
+        assert list(Command().iter_batches_to_process(
+            'history/tests/files_for_testing/EMPTYFILE0.txt')) == []
+
+    def test_every_row_with_missing_vals_as_null_when_arg_has_rows(self):
+        batches = list(Command().iter_batches_to_process(
+            'history/tests/files_for_testing/directory/file_to_load.txt'))
+
+        assert len(batches) == 1
+        assert list(batches[0].iter_rows()) == [
+            (datetime.date(1989, 3, 13), 122, -44, None),
+            (datetime.date(1989, 3, 14), 189, None, 53),
+            (datetime.date(1989, 3, 15), None, 6, 0),
+            (datetime.date(1989, 3, 16), 94, -33, 0),
+        ]
+        assert batches[0].missing().tolist() == [True, True, True, False]
+        assert batches[0].years() == {1989}
+
+    def test_batches_are_fixed_size_and_duplicates_skipped_across_chunks(self):
+        file = io.BytesIO(b'19891231\t1\t2\t3\n'
+                          b'19900101\t4\t5\t6\n'
+                          b'19891231\t7\t8\t9\n'
+                          b'19900102\t-9999\t5\t6\n'
+                          b'19900101\t7\t8\t9\n'
+                          b'19900103\t1\t2\t3')
+
+        batches = list(iter_column_batches(file, batch_size=2,
+                                           chunk_size=20))
+
+        assert [len(batch) for batch in batches] == [2, 2]
+        assert [row for batch in batches for row in batch.iter_rows()] == [
+            (datetime.date(1989, 12, 31), 1, 2, 3),
+            (datetime.date(1990, 1, 1), 4, 5, 6),
+            (datetime.date(1990, 1, 2), None, 5, 6),
+            (datetime.date(1990, 1, 3), 1, 2, 3),
+        ]
+
+    @pytest.mark.parametrize('line', [b'n/a\t4\t5\t6\n',
+                                      b'19890102\t4x\t5\t6\n',
+                                      b'19890102\t4\t5\n',
+                                      b'\n'])
+    def test_malformed_line_in_the_middle_raises(self, line):
+        file = io.BytesIO(b'19890101\t1\t2\t3\n' + line +
+                          b'19890103\t7\t8\t9\n' * 3)
+
+        with pytest.raises(ValueError) as e:
+            list(iter_column_batches(file))
+
+        assert 'exactly 4 integer columns' in str(e)
+
+    def test_invalid_date_raises(self):
+        with pytest.raises(ValueError) as e:
+            list(iter_column_batches(io.BytesIO(b'19890230\t1\t2\t3\n')))
+
+        assert '19890230' in str(e)
+
+
+class TestPostgresCopyLoader:
+
+    def test_batch_rendered_in_copy_text_format_with_nulls(self):
+        batch = next(iter_column_batches(
+            io.BytesIO(b'19890313\t122\t-44\t-9999\n'
+                       b'19890314\t-9999\t6\t0\n')))
+
+        buffer = PostgresCopyLoader.batch_to_copy_buffer(
+            WeatherStation(pk=7, code='X'), batch)
+
+        assert buffer.read() == ('7\t1989-03-13\t122\t-44\t\\N\n'
+                                 '7\t1989-03-14\t\\N\t6\t0\n')
+
+
+@pytest.mark.skipif(connection.vendor != 'sqlite',
+                    reason='fast load mode requires SQLite')
+class TestSqliteFastLoad:
+
+    def get_journal_mode(self):
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA journal_mode')
+            return cursor.fetchone()[0]
+
+    def test_data_stored_and_pragmas_restored(self, transactional_db):
+        journal_mode = self.get_journal_mode()
+
+        call_command('ingest_history',
+                     'history/tests/files_for_testing/directory',
+                     fast_load=True)
+
+        assert WeatherDay.objects.count() == 6
+        assert WeatherStats.objects.count() == 2
+        assert read_series('file_to_load').days == 4
+        assert self.get_journal_mode() == journal_mode
+
+    def test_failed_run_leaves_database_unchanged(self, transactional_db,
+                                                  monkeypatch, series_dir):
+        ingest_file = Command.ingest_file
+        calls = []
+
+        def fail_on_second_file(self, source, file=None, **kwargs):
+            calls.append(source)
+            if len(calls) == 2:
+                raise RuntimeError('simulated failure')
+            return ingest_file(self, source, file, **kwargs)
+
+        monkeypatch.setattr(Command, 'ingest_file', fail_on_second_file)
+
+        with pytest.raises(RuntimeError):
+            call_command('ingest_history',
+                         'history/tests/files_for_testing/directory',
+                         fast_load=True)
+
+        assert len(calls) == 2
+        assert not WeatherStation.objects.exists()
+        assert not WeatherDay.objects.exists()
+        # series are only written once the run's transaction commits
+        assert not list(series_dir.glob('*'))
+
+    def test_cannot_combine_with_workers(self):
+        with pytest.raises(CommandError) as e:
+            call_command('ingest_history',
+                         'history/tests/files_for_testing/directory',
+                         fast_load=True,
+                         workers=2)
+
+        assert '--fast-load cannot be combined with --workers' in str(e)
+
+
+class TestSeries:
+
+    def test_ingestion_writes_series_matching_stored_days(self, db):
+        call_command('ingest_history',
+                     'history/tests/files_for_testing/directory')
+
+        for station in WeatherStation.objects.all():
+            series = read_series(station.code)
+            days = WeatherDay.objects.filter(station=station)
+            assert series.first_ordinal == days.earliest(
+                'date').date.toordinal()
+            assert series.last_ordinal == days.latest('date').date.toordinal()
+            for day in days:
+                assert [
+                    None if value == MISSING_VALUE else value
+                    for value in series.columns[:, day.date.toordinal() -
+                                                series.first_ordinal].tolist()
+                ] == [day.temperature_max, day.temperature_min,
+                      day.precipitation]
+
+    def test_reingesting_merges_into_series(self, db, tmp_path):
+        call_command(
+            'ingest_history',
+            'history/tests/files_for_testing/directory/file_to_load.txt')
+        (tmp_path / 'file_to_load.txt').write_text(
+            '19890314\t  1\t  2\t    3\n'
+            '19890320\t  4\t  -9999\t    5\n')
+
+        call_command('ingest_history', str(tmp_path))
+
+        series = read_series('file_to_load')
+        assert series.first_ordinal == datetime.date(1989, 3,
+                                                     13).toordinal()
+        assert series.columns.T.tolist() == [
+            [122, -44, MISSING_VALUE],
+            [1, 2, 3],
+            [MISSING_VALUE, 6, 0],
+            [94, -33, 0],
+            *[[MISSING_VALUE] * 3] * 3,
+            [4, MISSING_VALUE, 5],
+        ]
+
+    def test_build_series_rebuilds_from_stored_days(self, db, series_dir):
+        call_command('ingest_history',
+                     'history/tests/files_for_testing/directory')
+        written = read_series('file_to_load').columns.tolist()
+        for path in series_dir.iterdir():
+            path.unlink()
+
+        call_command('build_series', station=['file_to_load'])
+
+        assert read_series('file_to_load').columns.tolist() == written
+        assert read_series('file_to_load2') is None
+
+    def test_build_series_bumps_data_versions(self, db):
+        call_command('ingest_history',
+                     'history/tests/files_for_testing/directory')
+        versions = dict(
+            WeatherDataVersion.objects.values_list('station__code',
+                                                   'version'))
+
+        call_command('build_series', station=['file_to_load'])
+
+        assert dict(
+            WeatherDataVersion.objects.values_list(
+                'station__code', 'version')) == {
+                    'file_to_load': versions['file_to_load'] + 1,
+                    'file_to_load2': versions['file_to_load2'],
+                }
+
+    @pytest.mark.parametrize('fast_load', [False, True])
+    def test_data_versions_bumped_after_series_saved(self, transactional_db,
+                                                     monkeypatch,
+                                                     fast_load):
+        if fast_load and connection.vendor != 'sqlite':
+            pytest.skip('fast load mode requires SQLite')
+        versions_when_saved = []
+        save = SeriesRecorder.save
+
+        def record_version_and_save(recorder):
+            versions_when_saved.append(
+                WeatherDataVersion.objects.get(
+                    station=recorder.station).version)
+            save(recorder)
+
+        monkeypatch.setattr(SeriesRecorder, 'save', record_version_and_save)
+
+        call_command(
+            'ingest_history',
+            'history/tests/files_for_testing/directory/file_to_load.txt',
+            fast_load=fast_load)
+
+        # an aggregate cached under the version current while the old
+        #  series was still in place is not served once it is replaced
+        assert WeatherDataVersion.objects.get().version > versions_when_saved[
+            0]
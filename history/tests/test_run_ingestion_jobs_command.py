@@ -0,0 +1,205 @@
+import datetime
+import os
+import time
+from pathlib import Path
+
+from django.core.management import call_command, CommandError
+from django.utils import timezone
+import pytest
+
+from benchmarks.synthetic import write_synthetic_station
+from history.jobs import (JobHeartbeat, JobProgress, claim_next_job,
+                          enqueue_ingestion, fail_stale_jobs)
+from history.ingestion import ingest
+from history.management.commands._ingest_workers import run_ingestion_job
+from history.management.commands.ingest_history import Command
+from history.models import IngestionJob, WeatherDay
+
+DIRECTORY = str(Path('history/tests/files_for_testing/directory').resolve())
+
+
+def run_ingestion_job_or_exit(job_id):
+    """run a job in a pool process, or end the process abruptly, as if
+    killed, for jobs of paths ending in exit"""
+    if IngestionJob.objects.get(pk=job_id).path.endswith('exit'):
+        os._exit(1)
+    run_ingestion_job(job_id)
+
+
+@pytest.mark.django_db
+class TestRunIngestionJobsCommand:
+
+    def test_jobs_claimed_oldest_first_and_only_once(self):
+        first = enqueue_ingestion(DIRECTORY)
+        second = enqueue_ingestion(DIRECTORY, {'force': True})
+
+        claimed = claim_next_job('worker-a')
+        assert claimed.pk == first.pk
+        assert claimed.status == IngestionJob.Status.RUNNING
+        assert claimed.worker == 'worker-a'
+        assert claimed.started is not None
+        assert claim_next_job('worker-b').pk == second.pk
+        assert claim_next_job('worker-c') is None
+
+    def test_unknown_options_rejected(self):
+        with pytest.raises(ValueError, match='workers'):
+            enqueue_ingestion(DIRECTORY, {'workers': 4})
+
+    def test_runs_queued_jobs_until_idle(self):
+        jobs = [
+            enqueue_ingestion(DIRECTORY),
+            enqueue_ingestion(DIRECTORY, {'stats': 'deferred'}),
+        ]
+
+        call_command('run_ingestion_jobs', exit_when_idle=True)
+
+        first, second = [
+            IngestionJob.objects.get(pk=job.pk) for job in jobs
+        ]
+        assert {first.status, second.status} == {
+            IngestionJob.Status.SUCCEEDED
+        }
+        assert (first.files_processed, first.records_ingested) == (2, 6)
+        # the second run finds the files unchanged
+        assert (second.files_processed, second.files_unchanged) == (0, 2)
+        assert WeatherDay.objects.count() == 6
+
+    def test_failed_job_recorded_and_worker_continues(self):
+        failing = enqueue_ingestion(
+            'history/tests/files_for_testing/missing')
+        succeeding = enqueue_ingestion(DIRECTORY)
+
+        call_command('run_ingestion_jobs', exit_when_idle=True)
+
+        failing.refresh_from_db()
+        succeeding.refresh_from_db()
+        assert failing.status == IngestionJob.Status.FAILED
+        assert failing.error == ('CommandError: provided path does not '
+                                 'exist')
+        assert failing.finished is not None
+        assert succeeding.status == IngestionJob.Status.SUCCEEDED
+
+    def test_progress_saved_after_each_file(self, monkeypatch):
+        job = enqueue_ingestion(DIRECTORY)
+        seen = []
+        ingest_file = Command.ingest_file
+
+        def ingest_file_and_check_progress(self, source, file=None,
+                                           **kwargs):
+            seen.append(
+                IngestionJob.objects.values_list('files_processed',
+                                                 flat=True).get(pk=job.pk))
+            return ingest_file(self, source, file, **kwargs)
+
+        monkeypatch.setattr(Command, 'ingest_file',
+                            ingest_file_and_check_progress)
+
+        ingest(DIRECTORY, JobProgress(job, interval=0).update)
+
+        assert seen == [0, 1]
+        job.refresh_from_db()
+        assert job.files_processed == 2
+        assert job.metrics['rows_upserted'] == 6
+
+    def test_concurrency_must_be_positive(self):
+        with pytest.raises(CommandError):
+            call_command('run_ingestion_jobs', concurrency=0)
+
+    def test_stale_after_must_exceed_heartbeat_interval(self):
+        with pytest.raises(CommandError):
+            call_command('run_ingestion_jobs', stale_after=1)
+
+    def test_jobs_without_recent_heartbeat_failed(self):
+        now = timezone.now()
+        long_ago = now - datetime.timedelta(minutes=10)
+        lost = enqueue_ingestion(DIRECTORY)
+        never_beat = enqueue_ingestion(DIRECTORY)
+        alive = enqueue_ingestion(DIRECTORY)
+        IngestionJob.objects.filter(pk=lost.pk).update(
+            status=IngestionJob.Status.RUNNING, started=long_ago,
+            heartbeat=long_ago)
+        IngestionJob.objects.filter(pk=never_beat.pk).update(
+            status=IngestionJob.Status.RUNNING, started=long_ago)
+        IngestionJob.objects.filter(pk=alive.pk).update(
+            status=IngestionJob.Status.RUNNING, started=long_ago,
+            heartbeat=now)
+
+        assert fail_stale_jobs(300) == [lost.pk, never_beat.pk]
+
+        lost.refresh_from_db()
+        alive.refresh_from_db()
+        assert lost.status == IngestionJob.Status.FAILED
+        assert lost.error == 'WorkerLost: no heartbeat for 300 seconds'
+        assert lost.finished is not None
+        assert alive.status == IngestionJob.Status.RUNNING
+
+    def test_stale_jobs_failed_before_claiming(self):
+        long_ago = timezone.now() - datetime.timedelta(minutes=10)
+        lost = enqueue_ingestion(DIRECTORY)
+        IngestionJob.objects.filter(pk=lost.pk).update(
+            status=IngestionJob.Status.RUNNING, started=long_ago,
+            heartbeat=long_ago)
+
+        call_command('run_ingestion_jobs', exit_when_idle=True)
+
+        lost.refresh_from_db()
+        assert lost.status == IngestionJob.Status.FAILED
+
+
+class TestConcurrentJobs:
+
+    def test_heartbeat_recorded_while_running(self, transactional_db):
+        enqueue_ingestion(DIRECTORY)
+        job = claim_next_job('worker')
+
+        with JobHeartbeat(job, interval=0.01):
+            time.sleep(0.2)
+
+        assert IngestionJob.objects.get(pk=job.pk).heartbeat > job.heartbeat
+
+    def test_jobs_of_killed_processes_failed_and_pool_replaced(
+            self, transactional_db, tmp_path, monkeypatch):
+        monkeypatch.setattr(
+            'history.management.commands.run_ingestion_jobs.'
+            'run_ingestion_job', run_ingestion_job_or_exit)
+        for i, name in enumerate(('one', 'two', 'three')):
+            (tmp_path / name).mkdir()
+            write_synthetic_station(tmp_path / name / f'SYN{i:08d}.txt', 1)
+        exiting = enqueue_ingestion(str(tmp_path / 'exit'))
+        jobs = [
+            enqueue_ingestion(str(tmp_path / name))
+            for name in ('one', 'two', 'three')
+        ]
+
+        call_command('run_ingestion_jobs', concurrency=2,
+                     exit_when_idle=True)
+
+        exiting.refresh_from_db()
+        assert exiting.status == IngestionJob.Status.FAILED
+        assert exiting.error.startswith('BrokenProcessPool')
+        # run in a new pool once the first one broke
+        assert IngestionJob.objects.get(
+            pk=jobs[-1].pk).status == IngestionJob.Status.SUCCEEDED
+        assert not IngestionJob.objects.filter(
+            status=IngestionJob.Status.RUNNING).exists()
+
+    def test_jobs_run_in_parallel_processes(self, transactional_db,
+                                            tmp_path):
+        # jobs run at once should not share stations
+        for i, name in enumerate(('one', 'two', 'three')):
+            (tmp_path / name).mkdir()
+            write_synthetic_station(tmp_path / name / f'SYN{i:08d}.txt', 1)
+        jobs = [
+            enqueue_ingestion(str(tmp_path / name))
+            for name in ('one', 'two', 'three')
+        ]
+
+        call_command('run_ingestion_jobs', concurrency=2,
+                     exit_when_idle=True)
+
+        assert {
+            job.status
+            for job in IngestionJob.objects.filter(
+                pk__in=[job.pk for job in jobs])
+        } == {IngestionJob.Status.SUCCEEDED}
+        assert WeatherDay.objects.count() == 3 * 365
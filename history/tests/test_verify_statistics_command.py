@@ -0,0 +1,63 @@
+from decimal import Decimal
+
+from django.core.management import call_command, CommandError
+import pytest
+
+from history.models import WeatherDataVersion, WeatherStation, WeatherStats
+
+
+@pytest.mark.django_db
+class TestVerifyStatisticsCommand:
+
+    def setup_method(self, method):
+        call_command('ingest_history',
+                     'history/tests/files_for_testing/directory')
+
+    def test_passes_after_ingestion(self):
+        call_command('verify_statistics')
+
+    def test_reports_mismatched_statistics(self):
+        WeatherStats.objects.filter(station__code='file_to_load').update(
+            temperature_max_total=0)
+
+        with pytest.raises(CommandError) as e:
+            call_command('verify_statistics')
+
+        assert '1 of 2 statistics do not match a full recompute' in str(e)
+
+    def test_only_checks_requested_stations(self):
+        WeatherStats.objects.filter(station__code='file_to_load').update(
+            temperature_max_total=0)
+
+        call_command('verify_statistics', station=['file_to_load2'])
+
+    def test_fix_overwrites_mismatched_and_removes_stray_statistics(self):
+        WeatherStats.objects.filter(station__code='file_to_load').update(
+            avg_temperature_max=0, temperature_max_total=0)
+        WeatherStats.objects.create(
+            station=WeatherStation.objects.get(code='file_to_load'),
+            year=1900)
+
+        call_command('verify_statistics', fix=True)
+
+        assert WeatherStats.objects.get(
+            station__code='file_to_load').avg_temperature_max == Decimal(
+                '13.50')
+        assert not WeatherStats.objects.filter(year=1900).exists()
+        call_command('verify_statistics')
+
+    def test_fix_bumps_the_data_versions_of_fixed_statistics(self):
+        versions = dict(
+            WeatherDataVersion.objects.values_list('station__code',
+                                                   'version'))
+        WeatherStats.objects.filter(station__code='file_to_load').update(
+            temperature_max_total=0)
+
+        call_command('verify_statistics', fix=True)
+
+        assert dict(
+            WeatherDataVersion.objects.values_list(
+                'station__code', 'version')) == {
+                    'file_to_load': versions['file_to_load'] + 1,
+                    'file_to_load2': versions['file_to_load2'],
+                }
@@ -3,7 +3,13 @@ from drf_yasg.views import get_schema_view
 from drf_yasg import openapi
 from rest_framework import permissions
 
-from history.views import WeatherDayListView, WeatherStatsListView
+from history.async_views import (AsyncWeatherDayExportView,
+                                 AsyncWeatherDayListView,
+                                 AsyncWeatherStatsListView)
+from history.views import (CacheStatisticsView, IngestionJobDetailView,
+                           IngestionJobListView, WeatherAggregateView,
+                           WeatherDayBatchView, WeatherDayExportView,
+                           WeatherDayListView, WeatherStatsListView)
 
 schema_view = get_schema_view(
     openapi.Info(
@@ -25,5 +31,14 @@ urlpatterns = [
             schema_view.with_ui('redoc', cache_timeout=0),
             name='schema-redoc'),
     path('stats', WeatherStatsListView.as_view()),
+    path('export', WeatherDayExportView.as_view()),
+    path('aggregate', WeatherAggregateView.as_view()),
+    path('batch', WeatherDayBatchView.as_view()),
+    path('cache', CacheStatisticsView.as_view()),
+    path('jobs', IngestionJobListView.as_view()),
+    path('jobs/<int:pk>', IngestionJobDetailView.as_view()),
+    path('async/stats', AsyncWeatherStatsListView.as_view()),
+    path('async/export', AsyncWeatherDayExportView.as_view()),
+    path('async', AsyncWeatherDayListView.as_view()),
     path('', WeatherDayListView.as_view()),
 ]
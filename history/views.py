@@ -1,20 +1,397 @@
-from rest_framework.generics import ListAPIView
+import csv
+import io
+import json
 
-from history.models import WeatherDay, WeatherStats
-from history.serializers import WeatherDaySerializer, WeatherStatsSerializer
+from django.http import StreamingHttpResponse
+from django.utils.decorators import method_decorator
+from drf_yasg import openapi
+from drf_yasg.utils import swagger_auto_schema
+from rest_framework import status
+from rest_framework.exceptions import ValidationError
+from rest_framework.generics import ListAPIView, RetrieveAPIView
+from rest_framework.permissions import IsAdminUser
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+from rest_framework.views import APIView
 
+from history.aggregation import aggregate_series, count_groups
+from history.cache import CachedResponseMixin, get_cache_statistics
+from history.conditional import ConditionalGetMixin
+from history.filters import WeatherDayFilterSet
+from history.jobs import enqueue_ingestion
+from history.models import (IngestionJob, WeatherDay, WeatherMonthStats,
+                            WeatherStation, WeatherStats)
+from history.pagination import OptionalCursorPagination
+from history.renderers import CSVRenderer, NDJSONRenderer
+from history.series import read_series
+from history.stations import station_cache
+from history.serializers import (IngestionJobRequestSerializer,
+                                 IngestionJobSerializer,
+                                 WeatherAggregateQuerySerializer,
+                                 WeatherAggregateSerializer,
+                                 WeatherDayBatchQuerySerializer,
+                                 WeatherDayBatchSerializer,
+                                 WeatherDayBatchValuesSerializer,
+                                 WeatherDaySerializer,
+                                 WeatherDayValuesSerializer,
+                                 WeatherStatsFromMonthsValuesSerializer,
+                                 WeatherStatsSerializer,
+                                 WeatherStatsValuesSerializer)
 
-class WeatherDayListView(ListAPIView):
+
+class ValuesListAPIView(ListAPIView):
+    """ListAPIView which reads rows with QuerySet.values() and renders them
+    with a ValuesSerializer. serializer_class still describes the output
+    for the API docs."""
+
+    values_serializer_class = None
+
+    def get_values_serializer_class(self):
+        return self.values_serializer_class
+
+    def list(self, request, *args, **kwargs):
+        values_serializer_class = self.get_values_serializer_class()
+        queryset = values_serializer_class.values(
+            self.filter_queryset(self.get_queryset()))
+
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(
+                values_serializer_class(page).data)
+
+        return Response(values_serializer_class(queryset).data)
+
+
+class WeatherDayListView(ConditionalGetMixin, CachedResponseMixin,
+                         ValuesListAPIView):
     """Lists information on a day of weather by station"""
 
     queryset = WeatherDay.objects.all()
     serializer_class = WeatherDaySerializer
-    filterset_fields = ('station__code', 'date')
+    values_serializer_class = WeatherDayValuesSerializer
+    filterset_class = WeatherDayFilterSet
+    pagination_class = OptionalCursorPagination
+    # the (station, date) unique index, so a page of a filtered station is
+    #  read in order from the index without sorting
+    keyset_ordering = ('station_id', 'date')
 
 
-class WeatherStatsListView(ListAPIView):
+class MonthlyRollupsMixin:
+    """Lets a stats view recompute the yearly statistics from the monthly
+    rollups with ?source=monthly"""
+
+    def use_monthly_rollups(self) -> bool:
+        source = self.request.query_params.get('source', 'yearly')
+        if source not in ('yearly', 'monthly'):
+            raise ValidationError(
+                {'source': ['must be "yearly" or "monthly"']})
+        return source == 'monthly'
+
+    def get_queryset(self):
+        if self.use_monthly_rollups():
+            return WeatherMonthStats.objects.all()
+        return super().get_queryset()
+
+    def get_values_serializer_class(self):
+        if self.use_monthly_rollups():
+            return WeatherStatsFromMonthsValuesSerializer
+        return super().get_values_serializer_class()
+
+
+@method_decorator(name='get',
+                  decorator=swagger_auto_schema(manual_parameters=[
+                      openapi.Parameter(
+                          'source',
+                          openapi.IN_QUERY,
+                          description='"monthly" recomputes the statistics '
+                          'from the monthly rollups rather than reading '
+                          'the stored yearly statistics. Both give the '
+                          'same results.',
+                          type=openapi.TYPE_STRING,
+                          enum=['yearly', 'monthly'])
+                  ]))
+class WeatherStatsListView(MonthlyRollupsMixin, ConditionalGetMixin,
+                           CachedResponseMixin, ValuesListAPIView):
     """Lists statistical information on a year of weather by station"""
 
     queryset = WeatherStats.objects.all()
     serializer_class = WeatherStatsSerializer
-    filterset_fields = ('station__code', 'year')
+    values_serializer_class = WeatherStatsValuesSerializer
+    filterset_fields = {
+        'station__code': ['exact', 'in'],
+        'year': ['exact', 'gte', 'lte'],
+    }
+    pagination_class = OptionalCursorPagination
+    keyset_ordering = ('station_id', 'year')
+
+
+class WeatherDayExportView(ConditionalGetMixin, ListAPIView):
+    """Streams every matching day of weather as CSV (the default) or
+    newline delimited JSON, chosen with ?format=csv|ndjson or the Accept
+    header. Rows are read from a server-side cursor where the database
+    supports one, so results of any size use constant memory."""
+
+    queryset = WeatherDay.objects.all()
+    serializer_class = WeatherDaySerializer
+    filterset_class = WeatherDayFilterSet
+    pagination_class = None
+    renderer_classes = (CSVRenderer, NDJSONRenderer)
+    csv_header = ('station', 'date', 'temperature_max', 'temperature_min',
+                  'precipitation')
+    chunk_size = 2000
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args,
+                                             **kwargs)
+        # the export renderers only negotiate the streamed formats, so
+        #  every other response, e.g. the errors of invalid filters or
+        #  unknown formats, or OPTIONS metadata, is JSON as on the other
+        #  endpoints
+        if isinstance(response, Response):
+            response.accepted_renderer = JSONRenderer()
+            response.accepted_media_type = JSONRenderer.media_type
+        return response
+
+    def list(self, request, *args, **kwargs):
+        # ordered by the (station, date) unique index rather than station
+        #  code, so the first rows can be sent without sorting the result
+        rows = self.filter_queryset(self.get_queryset()).order_by(
+            'station_id', 'date').values_list(
+                *WeatherDayValuesSerializer.export_fields).iterator(
+                    chunk_size=self.chunk_size)
+
+        if request.accepted_renderer.format == 'ndjson':
+            content = self.iter_ndjson(rows)
+            filename = 'weather.ndjson'
+        else:
+            content = self.iter_csv(rows)
+            filename = 'weather.csv'
+
+        response = StreamingHttpResponse(
+            content,
+            content_type=(f'{request.accepted_renderer.media_type}; '
+                          f'charset={request.accepted_renderer.charset}'))
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
+
+    def iter_chunks(self, rows, encode_row, header=None):
+        """yield the encoded rows chunk_size at a time"""
+        buffer = io.StringIO()
+        if header is not None:
+            buffer.write(header)
+        for i, row in enumerate(rows, 1):
+            buffer.write(encode_row(row))
+            if i % self.chunk_size == 0:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+        yield buffer.getvalue()
+
+    def iter_csv(self, rows):
+        encode_row = csv_row_encoder()
+        return self.iter_chunks(rows,
+                                encode_row,
+                                header=encode_row(self.csv_header))
+
+    def iter_ndjson(self, rows):
+        return self.iter_chunks(rows, ndjson_row_encoder())
+
+
+def csv_row_encoder():
+    """a function encoding a row as a line of CSV"""
+    line = io.StringIO()
+    writer = csv.writer(line)
+
+    def encode_row(row):
+        line.seek(0)
+        line.truncate()
+        writer.writerow(row)
+        return line.getvalue()
+
+    return encode_row
+
+
+def ndjson_row_encoder():
+    """a function encoding a values_list() row of the export as a line of
+    JSON shaped like WeatherDayValuesSerializer's output"""
+    serializer = WeatherDayValuesSerializer(())
+    fields = WeatherDayValuesSerializer.export_fields
+
+    def encode_row(row):
+        return json.dumps(serializer.to_representation(dict(zip(fields,
+                                                                 row)))) + '\n'
+
+    return encode_row
+
+
+@method_decorator(name='get',
+                  decorator=swagger_auto_schema(
+                      query_serializer=WeatherAggregateQuerySerializer,
+                      responses={200: WeatherAggregateSerializer(many=True)}))
+class WeatherAggregateView(ConditionalGetMixin, CachedResponseMixin,
+                           ListAPIView):
+    """Aggregates the days of weather of stations over a date range, by
+    year, season, month, fixed-length window or in total, optionally only
+    counting days in some months. Computed from each station's columnar
+    series rather than the database."""
+
+    serializer_class = WeatherAggregateSerializer
+    filter_backends = ()
+    pagination_class = None
+    max_groups = 50000
+    max_station_days = 5_000_000
+
+    def list(self, request, *args, **kwargs):
+        query = WeatherAggregateQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        params = query.validated_data
+
+        station_codes = list(dict.fromkeys(params['station__code']))
+        unknown = set(station_codes) - set(
+            WeatherStation.objects.filter(code__in=station_codes).values_list(
+                'code', flat=True))
+        if unknown:
+            raise ValidationError(
+                {'station__code': [f'unknown station: {code}'
+                                   for code in sorted(unknown)]})
+
+        series_by_station = {code: read_series(code) for code in station_codes}
+        stored = [series for series in series_by_station.values()
+                  if series is not None]
+        # an open ended range stops at the stations' stored days
+        first_ordinal = (params['date__gte'].toordinal()
+                         if 'date__gte' in params else min(
+                             (series.first_ordinal for series in stored),
+                             default=None))
+        last_ordinal = (params['date__lte'].toordinal()
+                        if 'date__lte' in params else max(
+                            (series.last_ordinal for series in stored),
+                            default=None))
+        if first_ordinal is None or last_ordinal is None:
+            return Response([])
+
+        # every station gets every group, so the work and the response
+        #  grow with their product
+        num_groups = len(station_codes) * count_groups(
+            first_ordinal, last_ordinal, params['group_by'],
+            params.get('window_days'))
+        if num_groups > self.max_groups:
+            raise ValidationError(
+                f'{num_groups} groups requested, more than '
+                f'{self.max_groups}. Narrow the date range, group by longer '
+                'periods or request fewer stations.')
+        # every station's days in the range are read, however few groups
+        #  they are reduced to
+        num_station_days = len(station_codes) * (last_ordinal -
+                                                  first_ordinal + 1)
+        if num_station_days > self.max_station_days:
+            raise ValidationError(
+                f'{num_station_days} station days requested, more than '
+                f'{self.max_station_days}. Narrow the date range or request '
+                'fewer stations.')
+
+        results = aggregate_series(series_by_station, first_ordinal,
+                                   last_ordinal, params['group_by'],
+                                   params.get('window_days'),
+                                   params.get('months'))
+        return Response(self.get_serializer(results, many=True).data)
+
+
+@method_decorator(name='get',
+                  decorator=swagger_auto_schema(
+                      query_serializer=WeatherDayBatchQuerySerializer,
+                      responses={200: WeatherDayBatchSerializer(many=True)}))
+@method_decorator(name='post',
+                  decorator=swagger_auto_schema(
+                      request_body=WeatherDayBatchQuerySerializer,
+                      responses={200: WeatherDayBatchSerializer(many=True)}))
+class WeatherDayBatchView(ConditionalGetMixin, CachedResponseMixin,
+                          ListAPIView):
+    """Lists days of weather for many stations at once, grouped by
+    station. Filters are taken from the query params, or from a POST body
+    for station lists too long for a URL. All stations are read with a
+    single query on the (station, date) index."""
+
+    queryset = WeatherDay.objects.all()
+    serializer_class = WeatherDayBatchSerializer
+    filter_backends = ()
+    pagination_class = None
+    max_days = 50000
+
+    def list(self, request, *args, **kwargs):
+        return self.batch(request.query_params)
+
+    def post(self, request, *args, **kwargs):
+        return self.batch(request.data)
+
+    def batch(self, data):
+        query = WeatherDayBatchQuerySerializer(data=data)
+        query.is_valid(raise_exception=True)
+        params = query.validated_data
+
+        days = self.get_queryset().filter(station_id__in=station_cache.ids(
+            params['station_codes']).values())
+        if params['first_date'] is not None:
+            days = days.filter(date__gte=params['first_date'])
+        if params['last_date'] is not None:
+            days = days.filter(date__lte=params['last_date'])
+
+        # one extra row tells us whether there are too many
+        rows = list(
+            days.order_by('station_id', 'date').values(
+                *WeatherDayBatchValuesSerializer.values_fields)[:self.max_days
+                                                                + 1])
+        if len(rows) > self.max_days:
+            raise ValidationError(
+                f'more than {self.max_days} days match. Narrow the date '
+                'range or use the export endpoint.')
+        return Response(WeatherDayBatchValuesSerializer(rows).data)
+
+
+class CacheStatisticsView(APIView):
+    """Shows the hit, miss and eviction counts of the response cache in
+    the process serving the request"""
+
+    def get(self, request, *args, **kwargs):
+        return Response(get_cache_statistics())
+
+
+@method_decorator(name='post',
+                  decorator=swagger_auto_schema(
+                      request_body=IngestionJobRequestSerializer,
+                      responses={202: IngestionJobSerializer}))
+class IngestionJobListView(ListAPIView):
+    """Lists ingestion jobs, newest first, or queues an ingestion of a
+    file or directory with a POST. Jobs are run in the background by the
+    run_ingestion_jobs command, so the POST returns at once with the
+    queued job, whose URL is in the Location header. Jobs read and
+    rewrite server files, so only staff users can see or queue them."""
+
+    queryset = IngestionJob.objects.order_by('-pk')
+    serializer_class = IngestionJobSerializer
+    permission_classes = (IsAdminUser, )
+    filterset_fields = {
+        'status': ['exact'],
+    }
+
+    def post(self, request, *args, **kwargs):
+        job_request = IngestionJobRequestSerializer(data=request.data)
+        job_request.is_valid(raise_exception=True)
+        options = dict(job_request.validated_data)
+        job = enqueue_ingestion(options.pop('path'), options)
+        return Response(self.get_serializer(job).data,
+                        status=status.HTTP_202_ACCEPTED,
+                        headers={
+                            'Location':
+                            request.build_absolute_uri(
+                                f'{request.path}/{job.pk}')
+                        })
+
+
+class IngestionJobDetailView(RetrieveAPIView):
+    """Shows the status of an ingestion job, with its progress so far: the
+    files and records done, and the time spent in each phase"""
+
+    queryset = IngestionJob.objects.all()
+    serializer_class = IngestionJobSerializer
+    permission_classes = (IsAdminUser, )
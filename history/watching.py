@@ -0,0 +1,248 @@
+import ctypes
+import ctypes.util
+import os
+import select
+import stat
+import struct
+import sys
+import time
+from collections.abc import Iterable, Iterator
+from dataclasses import dataclass
+from pathlib import Path
+
+DEFAULT_SETTLE_SECONDS = 2.0
+DEFAULT_POLL_INTERVAL = 1.0
+DEFAULT_WATCH_BATCH_SIZE = 100
+
+# from <sys/inotify.h>
+IN_MODIFY = 0x2
+IN_ATTRIB = 0x4
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_Q_OVERFLOW = 0x4000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+EVENT_HEADER = struct.Struct('iIII')
+
+
+class Inotify:
+    """Linux inotify through libc, reporting the paths created, written or
+    moved into the watched directories. Raises OSError where inotify is
+    not available."""
+
+    def __init__(self):
+        if not sys.platform.startswith('linux'):
+            raise OSError('inotify is only available on Linux')
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self.add_watch_function = libc.inotify_add_watch
+        self.add_watch_function.argtypes = (ctypes.c_int, ctypes.c_char_p,
+                                            ctypes.c_uint32)
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        self.directories = {}
+
+    def add_watch(self, directory: Path):
+        wd = self.add_watch_function(self.fd, os.fsencode(directory),
+                                     WATCH_MASK)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(),
+                          f'cannot watch {directory}')
+        self.directories[wd] = Path(directory)
+
+    def read(self, timeout: float) -> tuple[set[Path], bool]:
+        """wait up to timeout seconds for events, returning the paths they
+        name, and whether the kernel's queue overflowed so events were
+        lost"""
+        paths, overflowed = set(), False
+        if not select.select([self.fd], [], [], timeout)[0]:
+            return paths, overflowed
+        while True:
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                return paths, overflowed
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+                offset += EVENT_HEADER.size
+                name = data[offset:offset + length].rstrip(b'\0')
+                offset += length
+                if mask & IN_Q_OVERFLOW:
+                    overflowed = True
+                elif wd in self.directories and name:
+                    paths.add(self.directories[wd] / os.fsdecode(name))
+
+    def close(self):
+        os.close(self.fd)
+
+
+@dataclass
+class PendingFile:
+    """a new or modified file waiting until it stops changing"""
+    path: Path
+    size: int
+    mtime_ns: int
+    first_seen: float
+
+
+class DirectoryWatcher:
+    """Finds files in a directory that are new or have changed, once they
+    have not been modified for settle_seconds, so files still being
+    written are left alone.
+
+    Changes are noticed with inotify where available, or by rescanning
+    the directory every poll_interval seconds. Every file present when
+    watching starts counts as new.
+    """
+
+    def __init__(self,
+                 directory,
+                 recursive: bool = False,
+                 settle_seconds: float = DEFAULT_SETTLE_SECONDS,
+                 poll_interval: float = DEFAULT_POLL_INTERVAL,
+                 use_inotify: bool = True):
+        self.directory = Path(directory)
+        self.recursive = recursive
+        self.settle_seconds = settle_seconds
+        self.poll_interval = poll_interval
+        # (size, mtime_ns) of every file as it was last handed out
+        self.handed_out = {}
+        self.pending = {}
+
+        self.inotify = None
+        if use_inotify:
+            try:
+                self.inotify = Inotify()
+            except (OSError, AttributeError):
+                pass
+        for directory in self.iter_directories(self.directory):
+            self.watch_directory(directory)
+        self.scan_all()
+
+    @property
+    def kind(self) -> str:
+        return 'polling' if self.inotify is None else 'inotify'
+
+    @property
+    def backlog(self) -> int:
+        """the number of files waiting to settle or to be handed out"""
+        return len(self.pending)
+
+    def iter_directories(self, directory: Path) -> Iterator[Path]:
+        yield directory
+        if self.recursive:
+            for path in directory.iterdir():
+                if path.is_dir():
+                    yield from self.iter_directories(path)
+
+    def iter_file_stats(self, directory: Path) -> Iterator[tuple]:
+        """(path, stat) of the files in directory, and in subdirectories
+        if recursive, with one stat call per file"""
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if entry.is_dir():
+                    if self.recursive:
+                        yield from self.iter_file_stats(Path(entry.path))
+                elif entry.is_file():
+                    try:
+                        yield Path(entry.path), entry.stat()
+                    except FileNotFoundError:
+                        continue
+
+    def watch_directory(self, directory: Path):
+        if self.inotify is not None:
+            self.inotify.add_watch(directory)
+
+    def scan_all(self):
+        for path, file_stat in self.iter_file_stats(self.directory):
+            self.note(path, file_stat)
+
+    def scan(self, paths: Iterable[Path]):
+        """note which of the paths differ from when they were last handed
+        out"""
+        for path in paths:
+            try:
+                file_stat = path.stat()
+            except FileNotFoundError:
+                self.pending.pop(path, None)
+                continue
+            if stat.S_ISDIR(file_stat.st_mode):
+                # a directory created or moved in while recursing, whose
+                #  files may have arrived before its watch was added
+                if self.recursive:
+                    for directory in self.iter_directories(path):
+                        self.watch_directory(directory)
+                    for path, file_stat in self.iter_file_stats(path):
+                        self.note(path, file_stat)
+            elif stat.S_ISREG(file_stat.st_mode):
+                self.note(path, file_stat)
+
+    def note(self, path: Path, file_stat: os.stat_result):
+        fingerprint = (file_stat.st_size, file_stat.st_mtime_ns)
+        if self.handed_out.get(path) == fingerprint:
+            return
+        pending = self.pending.get(path)
+        if pending is None:
+            self.pending[path] = PendingFile(path, *fingerprint,
+                                             time.monotonic())
+        else:
+            pending.size, pending.mtime_ns = fingerprint
+
+    def wait_for_changes(self, timeout: float):
+        """wait up to timeout seconds, noting the files changed meanwhile"""
+        if self.inotify is None:
+            time.sleep(timeout)
+            self.scan_all()
+            return
+        paths, overflowed = self.inotify.read(timeout)
+        if overflowed:
+            self.scan_all()
+        else:
+            self.scan(paths)
+
+    def take_ready(self, max_files: int) -> list[PendingFile]:
+        """hand out up to max_files of the pending files that have not been
+        modified for settle_seconds, longest waiting first"""
+        self.scan(list(self.pending))
+        settled_before = time.time_ns() - int(self.settle_seconds * 1e9)
+        ready = sorted(
+            (pending for pending in self.pending.values()
+             if pending.mtime_ns <= settled_before),
+            key=lambda pending: pending.first_seen)[:max_files]
+        for pending in ready:
+            del self.pending[pending.path]
+            self.handed_out[pending.path] = (pending.size, pending.mtime_ns)
+        return ready
+
+    def next_batch(self, max_files: int = DEFAULT_WATCH_BATCH_SIZE,
+                   timeout: float = None) -> list[PendingFile]:
+        """wait until some files are ready and hand out up to max_files of
+        them, or return an empty list after timeout seconds if given"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            ready = self.take_ready(max_files)
+            if ready:
+                return ready
+            wait = self.poll_interval
+            if self.pending:
+                # wake when the first pending file would settle
+                oldest = min(pending.mtime_ns
+                             for pending in self.pending.values())
+                wait = min(wait,
+                           max(oldest / 1e9 + self.settle_seconds -
+                               time.time(), 0.01))
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return []
+                wait = min(wait, remaining)
+            self.wait_for_changes(wait)
+
+    def close(self):
+        if self.inotify is not None:
+            self.inotify.close()
+            self.inotify = None
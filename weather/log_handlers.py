@@ -0,0 +1,64 @@
+import logging
+import os
+from logging.handlers import QueueHandler, QueueListener
+from queue import Queue
+
+
+class BackgroundHandler(QueueHandler):
+    """Puts records on a queue and has a background thread pass them on to
+    other handlers, so the logging thread never waits on their I/O.
+
+    In dictConfig, give the target handlers as cfg:// references:
+
+        'background': {
+            '()': 'weather.log_handlers.BackgroundHandler',
+            'handlers': ['cfg://handlers.console', 'cfg://handlers.file'],
+        }
+
+    Records still queued are written when logging shuts down at exit.
+    """
+
+    def __init__(self, handlers, respect_handler_level: bool = True):
+        super().__init__(Queue(-1))
+        # resolved on the first record, by when dictConfig has configured
+        #  the handlers referenced
+        self.target_handlers = handlers
+        self.respect_handler_level = respect_handler_level
+        self.listener = None
+        self.listener_pid = None
+
+    def start_listener(self):
+        handlers = [
+            self.target_handlers[i] for i in range(len(self.target_handlers))
+        ]
+        for handler in handlers:
+            if not isinstance(handler, logging.Handler):
+                raise ValueError(
+                    f'BackgroundHandler target is not a handler: {handler!r}')
+        # a forked process inherits the listener but not its thread, so
+        #  starts its own, with a new queue
+        self.queue = Queue(-1)
+        self.listener_pid = os.getpid()
+        self.listener = QueueListener(
+            self.queue,
+            *handlers,
+            respect_handler_level=self.respect_handler_level)
+        self.listener.start()
+
+    def enqueue(self, record):
+        # emit() is called holding this handler's lock, so the listener is
+        #  only started once
+        if self.listener is None or self.listener_pid != os.getpid():
+            self.start_listener()
+        super().enqueue(record)
+
+    def flush(self):
+        """wait until every queued record has been handled"""
+        if self.listener_pid == os.getpid():
+            self.queue.join()
+
+    def close(self):
+        if self.listener_pid == os.getpid():
+            self.listener.stop()
+        self.listener = self.listener_pid = None
+        super().close()
@@ -28,9 +28,14 @@ LOGGING = {
             'formatter': 'timestamp_and_level',
             'filename': 'logs/log.info.log',
         },
+        # writes to the two above from a background thread
+        'background': {
+            '()': 'weather.log_handlers.BackgroundHandler',
+            'handlers': ['cfg://handlers.console', 'cfg://handlers.file'],
+        },
     },
     'root': {
-        'handlers': ['console', 'file'],
+        'handlers': ['background'],
         'level': 'INFO',
     },
 }
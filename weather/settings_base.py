@@ -90,9 +90,61 @@ except KeyError:
         'default': {
             'ENGINE': 'django.db.backends.sqlite3',
             'NAME': BASE_DIR / 'db.sqlite3',
+            # a file rather than in-memory test database so that
+            #  ingestion worker processes can share it
+            'TEST': {
+                'NAME': BASE_DIR / 'test_db.sqlite3',
+            },
         }
     }
 
+# Caches
+# https://docs.djangoproject.com/en/4.1/topics/cache/
+
+# API responses are cached in each process by default. API_CACHE=file or
+#  API_CACHE=redis shares them between processes, at API_CACHE_LOCATION
+API_CACHES = {
+    'lru': {
+        'BACKEND': 'history.cache.LRUCache',
+        'TIMEOUT': None,
+        'OPTIONS': {
+            'MAX_SIZE': 64 * 1024 * 1024,
+        },
+    },
+    'file': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.environ.get('API_CACHE_LOCATION',
+                                   BASE_DIR / 'api_cache'),
+        'TIMEOUT': 24 * 60 * 60,
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000,
+        },
+    },
+    'redis': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.environ.get('API_CACHE_LOCATION',
+                                   'redis://127.0.0.1:6379'),
+        'TIMEOUT': 24 * 60 * 60,
+    },
+}
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'weather_api': API_CACHES[os.environ.get('API_CACHE', 'lru')],
+}
+
+# Columnar copies of each station's days, written by ingest_history and
+#  read by the aggregation endpoint
+WEATHER_SERIES_DIR = Path(
+    os.environ.get('WEATHER_SERIES_DIR', BASE_DIR / 'series'))
+
+# Ingestion jobs queued through the API may only read files in this
+#  directory, and their paths are given relative to it
+WEATHER_INGESTION_ROOT = Path(
+    os.environ.get('WEATHER_INGESTION_ROOT', BASE_DIR / 'data'))
+
 # Password validation
 # https://docs.djangoproject.com/en/4.1/ref/settings/#auth-password-validators
 
@@ -142,5 +194,5 @@ REST_FRAMEWORK = {
     'PAGE_SIZE':
     100,
     'DEFAULT_FILTER_BACKENDS':
-    ('django_filters.rest_framework.DjangoFilterBackend', ),
+    ('history.filters.StationFilterBackend', ),
 }